@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+from ellipse import PARITY, eccentric_anomaly_from_true
+from flightpath import FlightPath
+
+# Orbit artifacts generated by kepler, and where the binary cache of them is kept.
+ORBITS_DIRECTORY = Path(__file__).resolve().parents[2] / 'kepler' / 'artifacts' / 'orbits'
+CACHE_DIRECTORY = Path(__file__).resolve().parents[1] / '.cache' / 'orbits'
+
+# Bump when the cache layout changes, to invalidate existing caches.
+CACHE_VERSION = 1
+
+# Fields of the 'orbit' and 'specs' sections of an artifact, in table column order.
+ELEMENT_FIELDS = (
+    'semiMajorAxis', 'eccentricity', 'inclination', 'longitudeAscendingNode', 'argumentPeriapsis', 'trueAnomalyAtEpoch'
+)
+SPEC_FIELDS = ('mass', 'diameter', 'drag', 'density', 'volume', 'ballisticCoefficient')
+ELEMENT_DTYPE = np.dtype([(field, np.float64) for field in ELEMENT_FIELDS])
+SPEC_DTYPE = np.dtype([('material', 'U16')] + [(field, np.float64) for field in SPEC_FIELDS])
+
+# The artifacts aren't strictly valid JSON: the sections aren't separated by commas and the last one has a
+# trailing comma. These patterns repair both.
+_MISSING_COMMA = re.compile(r'([}\]])(\s*")')
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+# Coordinates of the path points, parsed without building a dict per point.
+_COORDINATE = re.compile(r'"([xyz])"\s*:\s*([-+0-9.eE]+)')
+
+def parse_orbit(text: str) -> Tuple[dict, dict, np.ndarray]:
+    """
+    Parse one orbit artifact, tolerating the missing and trailing commas of the current format.
+
+    Args:
+        text (str): Contents of the artifact.
+
+    Returns:
+        Tuple[dict, dict, np.ndarray]: The 'orbit' elements, the 'specs' and the path as an (N, 3) array.
+    """
+    header, _, path = text.partition('"path"')
+
+    # The orbit and specs sections are small; repair them into a JSON object and parse normally.
+    header = _TRAILING_COMMA.sub(r'\1', _MISSING_COMMA.sub(r'\1,\2', header.rstrip().rstrip(',')))
+    sections = json.loads(header + '}')
+
+    # Fast path for the path points, which are always written as x, y, z in order.
+    matches = _COORDINATE.findall(path)
+    if ''.join(key for key, _ in matches) == 'xyz' * (len(matches) // 3):
+        points = np.array([value for _, value in matches], dtype=np.float64).reshape(-1, 3)
+    else:
+        points = json.loads(_TRAILING_COMMA.sub(r'\1', path.partition(':')[2].strip().rstrip('}').rstrip().rstrip(',')))
+        points = np.array([[point['x'], point['y'], point['z']] for point in points], dtype=np.float64).reshape(-1, 3)
+
+    return sections['orbit'], sections['specs'], points
+
+def _load_file(path: Path) -> Tuple[tuple, tuple, np.ndarray]:
+    orbit, specs, points = parse_orbit(path.read_text())
+    return (
+        tuple(orbit[field] for field in ELEMENT_FIELDS),
+        (specs['material'],) + tuple(specs[field] for field in SPEC_FIELDS),
+        points
+    )
+
+class OrbitCatalog:
+    """
+    The orbit artifacts as tables: path points of every orbit concatenated into one (total, 3) array, with
+    offsets so orbit i is paths[offsets[i]:offsets[i + 1]], plus the element and specs tables with one row per
+    orbit. Loaded from the cache, the arrays are memory-mapped.
+    """
+    __slots__ = ('names', 'elements', 'specs', 'offsets', 'paths')
+
+    def __init__(self, names: List[str], elements: np.ndarray, specs: np.ndarray, offsets: np.ndarray, paths: np.ndarray):
+        self.names = names
+        self.elements = elements
+        self.specs = specs
+        self.offsets = offsets
+        self.paths = paths
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def path(self, index: int) -> np.ndarray:
+        """
+        Path points of orbit index, as an (N, 3) view.
+        """
+        return self.paths[self.offsets[index]:self.offsets[index + 1]]
+
+    def flight_path(self, index: int, parity: float = PARITY) -> FlightPath:
+        """
+        Path of orbit index as a FlightPath, with points parity seconds apart and full confidence.
+        """
+        points = self.path(index)
+        return FlightPath.from_columns(points[:, 0], points[:, 1], points[:, 2], 0.0, np.arange(len(points)) * parity, 1.0)
+
+    def model_elements(self) -> np.ndarray:
+        """
+        Elements as the (K, 6) [a, e, incl, omega, Omega, M] array used by ellipse.ellipse_model, with angles in
+        radians and the true anomaly at epoch converted to a mean anomaly.
+        """
+        e = self.elements['eccentricity']
+        eccentric_anomaly = eccentric_anomaly_from_true(np.radians(self.elements['trueAnomalyAtEpoch']), e)
+        return np.column_stack((
+            self.elements['semiMajorAxis'],
+            e,
+            np.radians(self.elements['inclination']),
+            np.radians(self.elements['argumentPeriapsis']),
+            np.radians(self.elements['longitudeAscendingNode']),
+            eccentric_anomaly - e * np.sin(eccentric_anomaly)
+        ))
+
+def _fingerprint(files: List[Path]) -> str:
+    # Names, sizes and modification times of the artifacts; any change invalidates the cache.
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for path in files:
+        stat = path.stat()
+        digest.update(f'{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+def build_cache(files: List[Path], cache_directory: Path, fingerprint: str, workers: Optional[int] = None) -> None:
+    """
+    Parse the artifacts across a process pool and write the cache: paths.npy, offsets.npy, elements.npy,
+    specs.npy and a manifest.json holding the orbit names and the fingerprint of the artifacts.
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        loaded = [_load_file(path) for path in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            loaded = list(executor.map(_load_file, files, chunksize=max(1, len(files) // (4 * workers))))
+
+    offsets = np.zeros(len(loaded) + 1, dtype=np.int64)
+    np.cumsum([len(points) for _, _, points in loaded], out=offsets[1:])
+    paths = np.concatenate([points for _, _, points in loaded]) if loaded else np.empty((0, 3))
+
+    # Drop the old manifest before touching the arrays: its fingerprint may still match (e.g. on rebuild), and
+    # it would otherwise vouch for half-written arrays if this build is interrupted.
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    (cache_directory / 'manifest.json').unlink(missing_ok=True)
+    np.save(cache_directory / 'paths.npy', np.ascontiguousarray(paths, dtype=np.float64))
+    np.save(cache_directory / 'offsets.npy', offsets)
+    np.save(cache_directory / 'elements.npy', np.array([elements for elements, _, _ in loaded], dtype=ELEMENT_DTYPE))
+    np.save(cache_directory / 'specs.npy', np.array([specs for _, specs, _ in loaded], dtype=SPEC_DTYPE))
+
+    # The manifest goes last, so an interrupted build is never mistaken for a valid cache.
+    manifest = {'fingerprint': fingerprint, 'names': [path.stem for path in files]}
+    (cache_directory / 'manifest.json').write_text(json.dumps(manifest))
+
+def load_orbits(directory: Union[str, Path] = ORBITS_DIRECTORY, cache_directory: Union[str, Path] = CACHE_DIRECTORY,
+                workers: Optional[int] = None, rebuild: bool = False) -> OrbitCatalog:
+    """
+    Load the orbit artifacts, from the binary cache when it is up to date.
+
+    Args:
+        directory (Union[str, Path]): Directory of the orbit artifacts.
+        cache_directory (Union[str, Path]): Directory of the binary cache.
+        workers (Optional[int]): Number of processes parsing the artifacts when (re)building the cache.
+        rebuild (bool): Rebuild the cache even if it is up to date.
+
+    Returns:
+        OrbitCatalog: The orbits, memory-mapped from the cache.
+    """
+    directory, cache_directory = Path(directory), Path(cache_directory)
+    files = sorted(directory.glob('*.json'))
+    fingerprint = _fingerprint(files)
+
+    manifest_path = cache_directory / 'manifest.json'
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    if rebuild or manifest.get('fingerprint') != fingerprint:
+        build_cache(files, cache_directory, fingerprint, workers)
+        manifest = json.loads(manifest_path.read_text())
+
+    return OrbitCatalog(
+        manifest['names'],
+        np.load(cache_directory / 'elements.npy', mmap_mode='r'),
+        np.load(cache_directory / 'specs.npy', mmap_mode='r'),
+        np.load(cache_directory / 'offsets.npy', mmap_mode='r'),
+        np.load(cache_directory / 'paths.npy', mmap_mode='r')
+    )
+
+# Example usage:
+if __name__ == "__main__":
+    catalog = load_orbits()
+    print(f"Loaded {len(catalog)} orbits with {len(catalog.paths)} path points.")
@@ -0,0 +1,110 @@
+import os
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from flightpath import FlightPath, as_flight_path
+from ellipse import fit_ellipse_to_flight_path
+
+class FitOutcome(NamedTuple):
+    """
+    Outcome of fitting one flight path in a batch: the fit's return value, or the formatted exception if the
+    fit failed (in which case result is None).
+    """
+    result: Any
+    error: Optional[str]
+
+@contextmanager
+def share_array(array: np.ndarray) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    Copy an array into a new shared memory block for the duration of the context.
+
+    Args:
+        array (np.ndarray): Array to share.
+
+    Yields:
+        Tuple[str, np.ndarray]: Name of the shared memory block and the array view backed by it.
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        yield block.name, shared
+        del shared
+    finally:
+        block.close()
+        block.unlink()
+
+def attach_array(name: str, shape: Tuple[int, ...], dtype=np.float64) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Attach to a shared memory block created by share_array. The block must be kept referenced for as long as
+    the returned array is in use.
+
+    Returns:
+        Tuple[SharedMemory, np.ndarray]: The attached block and the array view backed by it.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def pack_flight_paths(flight_paths: Iterable) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenate flight paths into one (6, total) column array plus offsets, so flight path i is the column
+    range offsets[i]:offsets[i + 1].
+    """
+    flight_paths = [as_flight_path(flight_path) for flight_path in flight_paths]
+    offsets = np.zeros(len(flight_paths) + 1, dtype=np.int64)
+    np.cumsum([len(flight_path) for flight_path in flight_paths], out=offsets[1:])
+    values = np.concatenate([flight_path.values for flight_path in flight_paths], axis=1) if flight_paths else np.empty((6, 0))
+    return values, offsets
+
+# Per-worker state, set by _initialize_worker.
+_worker = {}
+
+def _initialize_worker(name: str, shape: Tuple[int, int], offsets: np.ndarray, fit: Callable):
+    _worker['block'], _worker['values'] = attach_array(name, shape)
+    _worker['offsets'] = offsets
+    _worker['fit'] = fit
+
+def _fit_one(index: int, values: np.ndarray = None, offsets: np.ndarray = None, fit: Callable = None) -> FitOutcome:
+    values = _worker['values'] if values is None else values
+    offsets = _worker['offsets'] if offsets is None else offsets
+    fit = _worker['fit'] if fit is None else fit
+    try:
+        # Zero-copy view of this object's columns.
+        return FitOutcome(fit(FlightPath(values[:, offsets[index]:offsets[index + 1]])), None)
+    except Exception:
+        return FitOutcome(None, traceback.format_exc())
+
+def fit_many(flight_paths: Iterable, workers: Optional[int] = None, chunksize: int = 1,
+             fit: Callable = fit_ellipse_to_flight_path) -> List[FitOutcome]:
+    """
+    Fit many flight paths across a process pool.
+
+    The flight paths are packed into one shared memory block that every worker attaches to, so each task only
+    ships an index instead of a pickled flight path. A failing fit is reported in its outcome and doesn't stop
+    the rest of the batch.
+
+    Args:
+        flight_paths (Iterable): Flight paths, as FlightPath or lists of dicts.
+        workers (Optional[int]): Number of worker processes. Defaults to the number of CPUs; 1 fits in-process.
+        chunksize (int): Number of flight paths handed to a worker per task.
+        fit (Callable): Fit function applied to each FlightPath. Must be picklable (a module-level function).
+
+    Returns:
+        List[FitOutcome]: One outcome per flight path, in input order.
+    """
+    values, offsets = pack_flight_paths(flight_paths)
+    workers = workers or os.cpu_count()
+
+    if workers == 1:
+        return [_fit_one(i, values, offsets, fit) for i in range(len(offsets) - 1)]
+
+    with share_array(values) as (name, _):
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initialize_worker,
+            initargs=(name, values.shape, offsets, fit)
+        ) as executor:
+            return list(executor.map(_fit_one, range(len(offsets) - 1), chunksize=chunksize))
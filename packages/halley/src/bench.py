@@ -0,0 +1,180 @@
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable, List, Tuple
+from batch import pack_flight_paths
+from cloud import apply_icp_algorithm, cloud
+from ellipse import fit_ellipse_to_flight_path, fit_elements_to_flight_path
+from flightpath import FlightPath
+from pca import fit_ellipses_pca
+from sample import generate_catalog, generate_images
+
+# Benchmark of the halley pipeline on synthetic data: generate a catalog with sample.generate_catalog, then
+# associate (cloud.cloud), register (cloud.apply_icp_algorithm) and fit (ellipse, pca), sweeping the number of
+# objects, frames and the drop out rate. Each stage records its wall time, peak traced memory and accuracy
+# against the known elements, and all records are written to a JSON file for comparison across commits.
+#
+# Usage: python bench.py --objects 10 100 --frames 100 300 --dropout 0 0.2 --output bench.json
+
+def measure(function: Callable, *args, **kwargs) -> Tuple[object, dict]:
+    """
+    Run a function, measuring its wall time and peak traced memory.
+
+    Returns:
+        Tuple[object, dict]: The function's result (None if it raised) and the measurements, with the formatted
+            exception under 'error' if it raised.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    record = {}
+    try:
+        result = function(*args, **kwargs)
+    except Exception as exception:
+        result = None
+        record['error'] = f'{type(exception).__name__}: {exception}'
+    record['wall_time'] = time.perf_counter() - start
+    record['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, record
+
+def _fit_all(fit: Callable, flight_paths: List[FlightPath], **kwargs) -> List[object]:
+    # Fit every flight path, keeping failures (as the exception) in place of their result.
+    results = []
+    for flight_path in flight_paths:
+        try:
+            results.append(fit(flight_path, **kwargs))
+        except Exception as exception:
+            results.append(exception)
+    return results
+
+def _angle_error(estimated: np.ndarray, known: np.ndarray) -> np.ndarray:
+    # Absolute difference of two angles, wrapped into [0, π].
+    return np.abs(np.remainder(estimated - known + np.pi, 2 * np.pi) - np.pi)
+
+def run_case(n_objects: int, n_frames: int, dropout: float, parity: float, seed: int, fit_objects: int,
+             delta_t: float, tolerance: float) -> List[dict]:
+    """
+    Benchmark every stage on one synthetic catalog.
+
+    Returns:
+        List[dict]: One record per stage.
+    """
+    case = {'objects': n_objects, 'frames': n_frames, 'dropout': dropout}
+    chunk = next(generate_catalog(
+        n_objects, np.arange(n_frames) * parity, dropout=dropout, seed=seed, chunk_size=n_objects, velocities=True
+    ))
+    images = generate_images(chunk)
+    detections = sum(len(image['points']) for image in images)
+    records = []
+
+    # Association.
+    result, record = measure(cloud, images, delta_t, tolerance)
+    if result is not None:
+        record['associations_per_detection'] = len(result) / max(detections, 1)
+    records.append({'stage': 'cloud', **case, 'detections': detections, **record})
+
+    # Registration of the first frame against a known rigid transformation of itself.
+    points = np.array([point['coordinates'] for point in images[0]['points']]).reshape(-1, 3)
+    angle = 1e-3
+    R = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    t = np.array([1.0, -2.0, 0.5])
+    result, record = measure(apply_icp_algorithm, points, points @ R.T + t)
+    if result is not None:
+        record['rotation_error'] = float(np.linalg.norm(result.R - R))
+        record['translation_error'] = float(np.linalg.norm(result.t - t))
+        record['iterations'] = result.iterations
+        record['rms'] = result.rms
+    records.append({'stage': 'apply_icp_algorithm', **case, **record})
+
+    # Fits of the first fit_objects objects, grouped by their known identity.
+    fitted = np.arange(min(fit_objects, n_objects))
+    flight_paths = []
+    for i in fitted:
+        observed = ~np.isnan(chunk.positions[i, :, 0])
+        x, y, z = chunk.positions[i, observed].T
+        s = np.linalg.norm(chunk.velocities[i, observed], axis=1)
+        flight_paths.append(FlightPath.from_columns(x, y, z, s, chunk.timestamps[observed], 1.0))
+    known = chunk.elements[fitted]
+
+    # Proximity threshold of the period estimate: about one sampling step, so every revolution closes.
+    proximity = float(np.nanmax(np.linalg.norm(chunk.velocities[fitted], axis=-1))) * parity
+
+    results, record = measure(_fit_all, fit_ellipse_to_flight_path, flight_paths, proximity_threshold_mod=proximity)
+    fits = [(i, result) for i, result in enumerate(results or []) if not isinstance(result, Exception)]
+    record['failures'] = len(flight_paths) - len(fits)
+    if fits:
+        estimated = np.array([result[0] for _, result in fits])
+        truth = known[[i for i, _ in fits]]
+        record['semi_major_axis_error'] = float(np.median(np.abs(estimated[:, 0] - truth[:, 0])))
+        record['eccentricity_error'] = float(np.median(np.abs(estimated[:, 1] - truth[:, 1])))
+    records.append({'stage': 'fit_ellipse_to_flight_path', **case, 'fitted': len(flight_paths), **record})
+
+    for stage, multi_start in (('fit_elements_to_flight_path', False), ('fit_elements_multistart', True)):
+        results, record = measure(
+            _fit_all, fit_elements_to_flight_path, flight_paths, proximity_threshold_mod=proximity,
+            multi_start=multi_start
+        )
+        fits = [(i, result) for i, result in enumerate(results or []) if not isinstance(result, Exception)]
+        record['failures'] = len(flight_paths) - len(fits)
+        if fits:
+            estimated = np.array([result[0] for _, result in fits])
+            truth = known[[i for i, _ in fits]]
+            record['semi_major_axis_error'] = float(np.median(np.abs(estimated[:, 0] - truth[:, 0])))
+            record['eccentricity_error'] = float(np.median(np.abs(estimated[:, 1] - truth[:, 1])))
+            record['inclination_error'] = float(np.median(_angle_error(estimated[:, 2], truth[:, 2])))
+            record['node_error'] = float(np.median(_angle_error(estimated[:, 4], truth[:, 4])))
+        records.append({'stage': stage, **case, 'fitted': len(flight_paths), **record})
+
+    # All tracks at once, in ragged form.
+    values, offsets = pack_flight_paths(flight_paths)
+    estimated, record = measure(fit_ellipses_pca, values[:3].T, offsets)
+    if estimated is not None:
+        record['failures'] = int(np.count_nonzero(np.isnan(estimated[:, 3])))
+        record['semi_major_axis_error'] = float(np.nanmedian(np.abs(estimated[:, 3] - known[:, 0])))
+    records.append({'stage': 'fit_ellipses_pca', **case, 'fitted': len(flight_paths), **record})
+
+    return records
+
+def _commit() -> str:
+    # Commit of the working tree, if it is a git checkout.
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the halley pipeline on synthetic data.')
+    parser.add_argument('--objects', type=int, nargs='+', default=[10, 100], help='Numbers of objects to sweep.')
+    parser.add_argument('--frames', type=int, nargs='+', default=[200], help='Numbers of frames to sweep.')
+    parser.add_argument('--dropout', type=float, nargs='+', default=[0.0, 0.2], help='Drop out rates to sweep.')
+    parser.add_argument('--parity', type=float, default=60.0, help='Seconds between frames.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalogs.')
+    parser.add_argument('--fit-objects', type=int, default=10, help='Maximum number of objects fitted per case.')
+    parser.add_argument('--delta-t', type=float, default=1.0, help='Time interval of cloud.cloud predictions.')
+    parser.add_argument('--tolerance', type=float, default=5.0, help='Tolerance distance of cloud.cloud.')
+    parser.add_argument('--output', default='bench.json', help='Path of the JSON results file.')
+    args = parser.parse_args()
+
+    records = []
+    for n_objects, n_frames, dropout in itertools.product(args.objects, args.frames, args.dropout):
+        for record in run_case(n_objects, n_frames, dropout, args.parity, args.seed, args.fit_objects, args.delta_t, args.tolerance):
+            records.append(record)
+            print(json.dumps(record))
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': _commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'arguments': vars(args),
+            'records': records
+        }, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,31 @@
+import itertools
 import numpy as np
+import instrument
 from scipy.spatial import KDTree
-from typing import List, Tuple
-
-def apply_icp_algorithm(Pj: np.ndarray, Pref: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+from scipy.stats import chi2
+from typing import List, NamedTuple, Optional, Tuple, Union
+from ellipse import ellipse_model_jacobian, mean_motion
+from flightpath import FlightPath
+
+# Gate of the orbit-propagated association: a true detection falls inside its gate with GATE_PROBABILITY, so
+# the gate is the ellipsoid of squared Mahalanobis distance GATE_THRESHOLD (chi-squared with 3 degrees of
+# freedom) around the prediction.
+GATE_PROBABILITY = 0.9973 # As 3 sigma in one dimension.
+GATE_THRESHOLD = float(chi2.ppf(GATE_PROBABILITY, 3))
+DETECTION_NOISE_VARIANCE = 1e-6 # Variance of one position coordinate of a detection, in km^2 (1 m standard deviation).
+
+class ICPResult(NamedTuple):
+    """
+    Result of an ICP registration.
+    """
+    R: np.ndarray # Rotation matrix, shape (3, 3).
+    t: np.ndarray # Translation vector, shape (3,).
+    iterations: int # Number of ICP iterations run.
+    rms: float # Root mean square distance between the transformed points and their nearest neighbors.
+
+@instrument.timed()
+def apply_icp_algorithm(Pj: np.ndarray, Pref: np.ndarray, max_iterations: int = 50, tolerance: float = 1e-6,
+                        workers: int = 1) -> ICPResult:
     """
      Point Cloud Registration:
         • Given two point clouds Pj and Pref, where each point is represented as pi and Gref, k respectively.
@@ -24,39 +47,54 @@ def apply_icp_algorithm(Pj: np.ndarray, Pref: np.ndarray) -> Tuple[np.ndarray, n
             If || Gref,k - Pig || < tolerance, then Pij is associated with Gref,k(j).*
 
     Args:
-        Pj (np.ndarray): Point cloud Pj.
-        Pref (np.ndarray): Reference point cloud Pref.
+        Pj (np.ndarray): Point cloud Pj, shape (N, 3).
+        Pref (np.ndarray): Reference point cloud Pref, shape (M, 3).
+        max_iterations (int): Maximum number of ICP iterations.
+        tolerance (float): Convergence threshold on the change of R and t between iterations.
+        workers (int): Number of workers for the nearest neighbor queries (-1 uses all cores).
 
     Returns:
-        Tuple[np.ndarray, np.ndarray]: Tuple containing the rotation matrix R and translation vector t.
+        ICPResult: Rotation matrix R, translation vector t, number of iterations run and final RMS error.
     """
     # Initial transformation guess?
     R = np.eye(3)
-    t = np.zeros((3, 1))
+    t = np.zeros(3)
+
+    # Pref never changes, so its index is built once per registration.
+    tree = KDTree(Pref)
+    instrument.count('kdtree_builds')
+
+    # The centroid of Pj doesn't depend on the transformation either.
+    centroid_Pj = np.mean(Pj, axis=0)
+    Pj_centered = Pj - centroid_Pj
+
+    iterations = 0
+    while iterations < max_iterations:
+        iterations += 1
 
-    for _ in range(max_iterations):
         # Apply current transformation to Pj
-        Pj_transformed = np.dot(R, Pj.T) + t
+        Pj_transformed = np.dot(Pj, R.T) + t
 
         # Find nearest neighbors in Pref for each point in Pj
-        tree = KDTree(Pref.T)
-        _, nearest_indices = tree.query(Pj_transformed.T)
+        _, nearest_indices = tree.query(Pj_transformed, workers=workers)
+        instrument.count('kdtree_queries', len(Pj))
+        nearest = Pref[nearest_indices]
 
         # Compute centroids
-        centroid_Pj = np.mean(Pj, axis=0)
-        centroid_Pref = np.mean(Pref[nearest_indices], axis=0)
+        centroid_Pref = np.mean(nearest, axis=0)
 
         # Compute cross-covariance matrix
-        H = np.dot((Pj - centroid_Pj).T, Pref[nearest_indices] - centroid_Pref)
+        H = np.dot(Pj_centered.T, nearest - centroid_Pref)
 
         # Singular Value Decomposition
         U, _, Vt = np.linalg.svd(H)
 
-        # Compute rotation matrix
-        R_new = np.dot(Vt.T, U.T)
+        # Compute rotation matrix, correcting a reflection into a proper rotation
+        D = np.diag([1.0, 1.0, np.sign(np.linalg.det(np.dot(Vt.T, U.T)))])
+        R_new = np.dot(Vt.T, np.dot(D, U.T))
 
         # Compute translation vector
-        t_new = centroid_Pref.T - np.dot(R_new, centroid_Pj.T)
+        t_new = centroid_Pref - np.dot(R_new, centroid_Pj)
 
         # Update transformation
         delta_R = R_new - R
@@ -68,49 +106,214 @@ def apply_icp_algorithm(Pj: np.ndarray, Pref: np.ndarray) -> Tuple[np.ndarray, n
         if np.linalg.norm(delta_R) < tolerance and np.linalg.norm(delta_t) < tolerance:
             break
 
-    return R, t
+    # RMS error of the final transformation against its nearest neighbors
+    distances, _ = tree.query(np.dot(Pj, R.T) + t, workers=workers)
+    instrument.count('kdtree_queries', len(Pj))
+    instrument.count('icp_registrations')
+    instrument.count('icp_iterations', iterations)
+    rms = float(np.sqrt(np.mean(distances**2))) if len(distances) else 0.0
+
+    return ICPResult(R, t, iterations, rms)
 
 
-def predict_expected_positions(Pij: np.ndarray, sij: np.ndarray, Vij: np.ndarray, delta_t: float) -> np.ndarray:
+def predict_expected_positions(Pij: np.ndarray, sij: np.ndarray, Vij: np.ndarray, delta_t: float,
+                               mu: float = 0.0) -> np.ndarray:
     """
     Predict the expected positions based on speed.
 
+    With mu = 0 the points move at constant speed, whose error grows with delta_t^2 (about 15 km over a minute
+    in LEO). With the gravitational parameter of the central body, they follow the Lagrange f and g series of
+    two-body motion to third order in delta_t, whose error grows with delta_t^4 (a few km over four minutes in
+    LEO), so that points can still be matched across frames they dropped out of.
+
     Args:
         Pij (np.ndarray): Array of Cartesian coordinates of points Pij.
         sij (np.ndarray): Array of speeds for points Pij.
         Vij (np.ndarray): Array of unit vectors representing the direction of motion of points Pij.
         delta_t (float): Time interval.
+        mu (float): Gravitational parameter of the body the coordinates are centered on (e.g.
+            ellipse.MU_EARTH), or 0 for the constant speed model.
 
     Returns:
         np.ndarray: Array of predicted expected positions.
     """
-    # Predicted expected positions based on constant speed model
-    return Pij + sij[:, np.newaxis] * Vij * delta_t
-
-def search_nearest_neighbors(Pj: np.ndarray, Pref: np.ndarray, tolerance: float) -> List[Tuple[np.ndarray, np.ndarray]]:
+    velocities = sij[:, np.newaxis] * Vij
+    if not mu:
+        # Predicted expected positions based on constant speed model
+        return Pij + velocities * delta_t
+
+    # r(t) = f r + g v, with f = 1 - u t^2 / 2 + u p t^3 / 2 and g = t - u t^3 / 6, where u = mu / |r|^3 and
+    # p = r.v / |r|^2.
+    squared_radii = np.einsum('ij,ij->i', Pij, Pij)
+    u = mu / squared_radii**1.5
+    p = np.einsum('ij,ij->i', Pij, velocities) / squared_radii
+    f = 1 - u * delta_t**2 / 2 + u * p * delta_t**3 / 2
+    g = delta_t - u * delta_t**3 / 6
+    return f[:, np.newaxis] * Pij + g[:, np.newaxis] * velocities
+
+def search_nearest_neighbors(Pj: np.ndarray, Pref: np.ndarray, tolerance: float, tree: KDTree = None,
+                             workers: int = 1) -> Tuple[np.ndarray, np.ndarray]:
     """
     Search for nearest neighbors within tolerance distance.
 
+    The neighbors are returned in a CSR-style layout: the neighbors of point i of Pj are the points
+    indices[offsets[i]:offsets[i + 1]] of Pref, so attributes of the neighbors can be gathered with a single
+    fancy index (e.g. speeds[indices]) instead of copying points around.
+
     Args:
-        Pj (np.ndarray): Point cloud Pj.
-        Pref (np.ndarray): Reference point cloud Pref.
+        Pj (np.ndarray): Point cloud Pj, shape (N, 3).
+        Pref (np.ndarray): Reference point cloud Pref, shape (M, 3).
         tolerance (float): Tolerance distance.
+        tree (KDTree): Prebuilt KDTree of Pref, to reuse an existing index. Built from Pref if None.
+        workers (int): Number of workers for the queries (-1 uses all cores).
 
     Returns:
-        List[Tuple[np.ndarray, np.ndarray]]: List of tuples containing associated points.
+        Tuple[np.ndarray, np.ndarray]: Offsets, shape (N + 1,), and indices into Pref of the associated points.
     """
     # Build KDTree from reference point cloud
-    tree = KDTree(Pref)
+    if tree is None:
+        tree = KDTree(Pref)
+        instrument.count('kdtree_builds')
 
     # Search for nearest neighbors for each point in Pj
-    nearest_indices = tree.query_ball_point(Pj, tolerance)
+    nearest_indices = tree.query_ball_point(Pj, tolerance, workers=workers)
+
+    # Flatten the per-point neighbor lists into offsets and indices
+    counts = np.fromiter(map(len, nearest_indices), dtype=np.intp, count=len(nearest_indices))
+    offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    indices = np.fromiter(itertools.chain.from_iterable(nearest_indices), dtype=np.intp, count=offsets[-1])
+
+    # Candidates per point: association_candidates / association_queries.
+    instrument.count('kdtree_queries', len(Pj))
+    instrument.count('association_queries', len(Pj))
+    instrument.count('association_candidates', offsets[-1])
+
+    return offsets, indices
+
+class OrbitPrediction(NamedTuple):
+    """
+    Predicted positions of K tracks at one timestamp, with the covariance of the difference between a
+    prediction and its detection.
+    """
+    positions: np.ndarray # Shape (K, 3).
+    covariances: np.ndarray # Shape (K, 3, 3): J P J^T + R, the propagated state covariance plus detection noise.
+
+def predict_orbit_positions(states: np.ndarray, timestamp: float, covariances: Optional[np.ndarray] = None,
+                            noise_variance: Union[float, np.ndarray] = DETECTION_NOISE_VARIANCE) -> OrbitPrediction:
+    """
+    Predict where known tracks are at a frame's timestamp by propagating their Keplerian states, in one
+    vectorized batch.
 
-    # Associate points within tolerance distance
-    associated_points = [(Pj[i], Pref[indices]) for i, indices in enumerate(nearest_indices)]
+    Unlike the constant speed model of predict_expected_positions, this stays accurate when an object covers a
+    large part of its orbit between frames (e.g. at PARITY = 3600 s), so the gates can stay tight. The state
+    covariance is propagated to the position through the Jacobian J of the model at the timestamp.
 
-    return associated_points
+    Args:
+        states (np.ndarray): Elements [a, e, incl, omega, Omega, M] of shape (K, 6), with the mean motion from
+            Kepler's third law (ellipse.mean_motion), or of shape (K, 7) with the mean motion n as the last
+            column (as refine.OrbitState.state).
+        timestamp (float): Time to predict at, on the time axis of the elements (M at t = 0).
+        covariances (Optional[np.ndarray]): State covariances of shape (K, 6, 6) or (K, 7, 7), matching states.
+            None treats the states as exact, leaving only the detection noise.
+        noise_variance (Union[float, np.ndarray]): Variance of one position coordinate of a detection, a scalar
+            or one per track.
+
+    Returns:
+        OrbitPrediction: Predicted positions and their innovation covariances.
+    """
+    states = np.asarray(states, dtype=float).reshape(-1, np.shape(states)[-1])
+    n = states[:, 6] if states.shape[1] == 7 else mean_motion(states[:, 0])
+    times = np.array([float(timestamp)])
+    positions, jacobian = ellipse_model_jacobian(states[:, :6], times, n)
+    positions, jacobian = positions[:, 0], jacobian[:, 0]
+    if states.shape[1] == 7:
+        # The mean anomaly at the timestamp is M + n * t, so its derivative with respect to n is t times that
+        # with respect to M.
+        jacobian = np.concatenate((jacobian, jacobian[..., 5:6] * times[0]), axis=-1)
+
+    innovation_covariances = np.broadcast_to(
+        np.asarray(noise_variance, dtype=float).reshape(-1, 1, 1) * np.eye(3), (len(states), 3, 3)
+    ).copy()
+    if covariances is not None:
+        innovation_covariances += jacobian @ np.asarray(covariances, dtype=float) @ np.swapaxes(jacobian, 1, 2)
+    return OrbitPrediction(positions, innovation_covariances)
+
+def search_mahalanobis_neighbors(prediction: OrbitPrediction, Pref: np.ndarray, threshold: float = GATE_THRESHOLD,
+                                 tree: KDTree = None, workers: int = 1
+                                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gate the points of a frame against predicted positions with covariance ellipsoids.
+
+    Point j falls in the gate of track i when the squared Mahalanobis distance d^T S_i^-1 d of their difference
+    d is at most threshold, S_i being the track's innovation covariance. Every point in a gate is kept as a
+    hypothesis (to be resolved e.g. by stream.assign_globally), so a track near another isn't forced onto the
+    nearest point. The candidates come from a KDTree ball query with the radius of each ellipsoid's longest
+    axis, so only points near a gate are ever tested.
+
+    Args:
+        prediction (OrbitPrediction): Predicted positions and innovation covariances of K tracks.
+        Pref (np.ndarray): Points of the frame, shape (M, 3).
+        threshold (float): Squared Mahalanobis distance of the gates.
+        tree (KDTree): Prebuilt KDTree of Pref, to reuse an existing index. Built from Pref if None.
+        workers (int): Number of workers for the queries (-1 uses all cores).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Offsets, shape (K + 1,), indices into Pref of the points in
+            every gate, in the CSR-style layout of search_nearest_neighbors, and their squared Mahalanobis
+            distances.
 
-def cloud(images: List[dict], delta_t: float = 1.0, tolerance: float = 5.0) -> List[List[Tuple[float, float, float, float, float, float]]]:
+    Raises:
+        ValueError: If an innovation covariance is singular (e.g. exact states with a zero noise variance),
+            since its gate would have no volume.
+    """
+    # Radius of the ball around each ellipsoid, from the largest eigenvalue of the covariance.
+    eigenvalues = np.linalg.eigvalsh(prediction.covariances)
+    singular = np.flatnonzero(eigenvalues[:, 0] <= 0) if len(eigenvalues) else []
+    if len(singular):
+        raise ValueError(
+            f"Singular innovation covariance for {len(singular)} prediction(s), e.g. #{singular[0]}; "
+            "use a positive noise variance."
+        )
+    radii = np.sqrt(threshold * np.maximum(eigenvalues[:, -1], 0.0))
+    offsets, indices = search_nearest_neighbors(prediction.positions, Pref, radii, tree, workers)
+
+    # Exact test of the candidates against the ellipsoids.
+    queries = np.repeat(np.arange(len(radii)), np.diff(offsets))
+    differences = Pref[indices] - prediction.positions[queries]
+    inverses = np.linalg.inv(prediction.covariances)
+    squared_distances = np.einsum('ni,nij,nj->n', differences, inverses[queries], differences)
+    inside = squared_distances <= threshold
+    if instrument.active() is not None:
+        instrument.count('gated_candidates', np.count_nonzero(inside))
+
+    counts = np.bincount(queries[inside], minlength=len(radii))
+    offsets = np.zeros(len(radii) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, indices[inside], squared_distances[inside]
+
+def load_frame(image: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extract the point cloud data of an image as arrays.
+
+    Args:
+        image (dict): Image with a list of points, each with 'coordinates', 'speed', 'direction' and optionally
+            'confidence' (defaults to 1).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Coordinates (N, 3), speeds (N,), unit directions
+            of motion (N, 3) and confidence scores (N,).
+    """
+    points = image['points']
+    point_cloud = np.array([point['coordinates'] for point in points], dtype=float).reshape(-1, 3)
+    speeds = np.array([point['speed'] for point in points], dtype=float)
+    directions = np.array([point['direction'] for point in points], dtype=float).reshape(-1, 3)
+    confidences = np.array([point.get('confidence', 1.0) for point in points], dtype=float)
+    return point_cloud, speeds, directions, confidences
+
+@instrument.timed()
+def cloud(images: List[dict], delta_t: float = 1.0, tolerance: float = 5.0, columnar: bool = False
+          ) -> Union[List[Tuple[float, float, float, float, float, float]], FlightPath]:
     """
     Main function to execute the entire process.
 
@@ -118,39 +321,41 @@ def cloud(images: List[dict], delta_t: float = 1.0, tolerance: float = 5.0) -> L
         images (List[dict]): List of images with points data.
         delta_t (float): Time interval for predicting expected positions.
         tolerance (float): Tolerance distance for searching nearest neighbors.
+        columnar (bool): Return the associated points as a columnar FlightPath instead of a list of tuples.
 
     Returns:
-        List[List[Tuple[float, float, float, float, float, float]]]: List of flight paths
-            represented as tuples of (x, y, z, s, C, t) for associated points.
+        Union[List[Tuple[float, float, float, float, float, float]], FlightPath]: List of flight paths
+            represented as tuples of (x, y, z, s, C, t) for associated points, or a FlightPath if columnar.
     """
-    # Placeholder for flight paths
+    # Placeholder for flight paths, as (6, n) blocks of (x, y, z, s, C, t) rows per image
     flight_paths = []
 
     # Iterate over images
     for image in images:
         # Extract point cloud data from the image
-        point_cloud = np.array([point['coordinates'] for point in image['points']])
-        speeds = np.array([point['speed'] for point in image['points']])
-        directions = np.array([point['direction'] for point in image['points']])
+        point_cloud, speeds, directions, confidences = load_frame(image)
 
         # Predict expected positions based on speed
         predicted_positions = predict_expected_positions(point_cloud, speeds, directions, delta_t)
 
         # Search for nearest neighbors within tolerance distance
-        associated_points = search_nearest_neighbors(predicted_positions, point_cloud, tolerance)
-
-        # Append associated points to flight paths
-        for associated_point in associated_points:
-            # Extract coordinates, speed, confidence score, and timestamp
-            x, y, z = associated_point[0]
-            s = speeds[np.where((point_cloud == associated_point[1]).all(axis=1))][0]
-            C = associated_point[1]['confidence']
-            t = image['timestamp']
-
-            # Append to flight paths
-            flight_paths.append((x, y, z, s, C, t))
-
-    return flight_paths
+        offsets, indices = search_nearest_neighbors(predicted_positions, point_cloud, tolerance)
+
+        # Gather coordinates of the predicted point, and speed and confidence score of each associated point
+        queries = np.repeat(np.arange(len(predicted_positions)), np.diff(offsets))
+        flight_paths.append(np.vstack((
+            predicted_positions[queries].T,
+            speeds[indices],
+            confidences[indices],
+            np.full(len(indices), image['timestamp'], dtype=float)
+        )))
+
+    flight_paths = np.concatenate(flight_paths, axis=1) if flight_paths else np.empty((6, 0))
+    x, y, z, s, C, t = flight_paths
+
+    if columnar:
+        return FlightPath.from_columns(x, y, z, s, t, C)
+    return list(map(tuple, flight_paths.T.tolist()))
 
 # Example usage:
 if __name__ == "__main__":
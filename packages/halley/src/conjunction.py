@@ -0,0 +1,243 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import NamedTuple, Optional
+from ellipse import ellipse_model, mean_motion, orbital_plane_basis
+from propagate import propagate
+
+# Conjunction screening settings.
+SCREENING_DISTANCE = 5.0 # Miss distance below which a close approach is reported, in km.
+SCREENING_STEP = 10.0 # Time step of the spatial sieve, in seconds.
+SCREENING_BLOCK = 64 # Time steps propagated at once by the spatial sieve.
+COPLANAR_INCLINATION = np.radians(1.0) # Mutual inclination below which the orbit geometry filter passes a pair.
+TCA_TOLERANCE = 1e-3 # Width of the bracket of the time of closest approach at which the search stops, in seconds.
+
+# Inverse of the golden ratio, the shrink factor of the golden-section search.
+_GOLDEN = (np.sqrt(5) - 1) / 2
+
+class Conjunctions(NamedTuple):
+    """
+    Close approaches found by screen, one entry per encounter, sorted by miss distance.
+    """
+    first: np.ndarray # Index of the first object of every encounter.
+    second: np.ndarray # Index of the second object, always greater than first.
+    times: np.ndarray # Time of closest approach.
+    distances: np.ndarray # Miss distance at the time of closest approach.
+
+def apsides(elements: np.ndarray):
+    """
+    Perigee and apogee radii a(1 - e) and a(1 + e) of every orbit.
+    """
+    elements = np.asarray(elements, dtype=float)
+    return elements[:, 0] * (1 - elements[:, 1]), elements[:, 0] * (1 + elements[:, 1])
+
+def apsis_filter(elements: np.ndarray, first: np.ndarray, second: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Mask of the pairs whose radial shells, from perigee to apogee, come within threshold of each other. Other
+    pairs can never be that close, whatever their phases.
+    """
+    perigees, apogees = apsides(elements)
+    return (perigees[first] <= apogees[second] + threshold) & (perigees[second] <= apogees[first] + threshold)
+
+def overlapping_objects(elements: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Mask of the objects whose radial shell comes within threshold of at least one other object's, by a sweep
+    over the objects sorted by perigee instead of testing every pair.
+    """
+    perigees, apogees = apsides(elements)
+    order = np.argsort(perigees)
+    perigees, apogees = perigees[order], apogees[order]
+    # Highest apogee below each object (in perigee order) and lowest perigee above it.
+    below = np.concatenate(([-np.inf], np.maximum.accumulate(apogees)[:-1]))
+    above = np.concatenate((perigees[1:], [np.inf]))
+    mask = np.empty(len(order), dtype=bool)
+    mask[order] = (perigees <= below + threshold) | (above <= apogees + threshold)
+    return mask
+
+def _radius(elements: np.ndarray, directions: np.ndarray) -> np.ndarray:
+    # Radius of every orbit in the direction of a unit vector of its plane, from its true anomaly there.
+    a, e, incl, omega, Omega = (elements[:, i] for i in range(5))
+    P, Q = orbital_plane_basis(incl, omega, Omega)
+    true_anomaly = np.arctan2(np.einsum('ij,ij->i', directions, Q), np.einsum('ij,ij->i', directions, P))
+    return a * (1 - e**2) / (1 + e * np.cos(true_anomaly))
+
+def _radius_slope(elements: np.ndarray) -> np.ndarray:
+    # Bound on |dr/dν| of every orbit: r e sin ν / (1 + e cos ν), with r at most the apogee radius a(1 + e)
+    # and sin ν / (1 + e cos ν) at most 1 / sqrt(1 - e^2).
+    a, e = elements[:, 0], elements[:, 1]
+    return a * (1 + e) * e / np.sqrt(1 - e**2)
+
+def node_filter(elements: np.ndarray, first: np.ndarray, second: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Mask of the pairs whose orbits can come within threshold of each other near the line where their planes
+    intersect.
+
+    A point of an orbit at an angle δ from the line of nodes lies r sin δ sin i from the other plane, i being
+    the mutual inclination, so it can only be within threshold of the other orbit if
+    sin δ <= threshold / (q sin i), q being its perigee radius. Within that angle of a node the radius of
+    either orbit changes by at most |dr/dν| δ, so the pair is dropped only when the radii of the two orbits
+    differ at both nodes by more than threshold plus that slack for both orbits. Pairs whose bound on δ
+    reaches 90° (nearly coplanar or very close orbits) always pass, as do those below COPLANAR_INCLINATION,
+    whose line of nodes is ill-defined.
+    """
+    elements = np.asarray(elements, dtype=float)
+    normals = []
+    for objects in (first, second):
+        P, Q = orbital_plane_basis(elements[objects, 2], elements[objects, 3], elements[objects, 4])
+        normals.append(np.cross(P, Q))
+    line = np.cross(normals[0], normals[1])
+    sine = np.linalg.norm(line, axis=1)
+    coplanar = np.arcsin(np.clip(sine, 0.0, 1.0)) < COPLANAR_INCLINATION
+    line = line / np.where(coplanar, 1.0, sine)[:, np.newaxis]
+
+    # Largest angle from the line of nodes at which each orbit can be within threshold of the other plane.
+    perigees, _ = apsides(elements)
+    slack = np.zeros(len(first))
+    close = coplanar.copy()
+    for objects in (first, second):
+        bound = threshold / (perigees[objects] * np.where(coplanar, 1.0, sine))
+        close |= bound >= 1
+        slack += _radius_slope(elements[objects]) * np.arcsin(np.minimum(bound, 1.0))
+
+    for direction in (line, -line):
+        gap = np.abs(_radius(elements[first], direction) - _radius(elements[second], direction))
+        close |= gap <= threshold + slack
+    return close
+
+def candidate_pairs(elements: np.ndarray, timestamps: np.ndarray, radius: float,
+                    mean_motions: Optional[np.ndarray] = None, block: int = SCREENING_BLOCK):
+    """
+    Spatial sieve: every (pair, time step) at which two objects are within radius of each other.
+
+    The catalog is propagated a block of time steps at a time, and the close pairs of every step come from a
+    KD-tree over the positions of that step, so the cost grows with the number of objects and close pairs
+    rather than with the number of pairs.
+
+    Args:
+        elements (np.ndarray): Elements of shape (K, 6).
+        timestamps (np.ndarray): Time steps of shape (T,).
+        radius (float): Search radius.
+        mean_motions (Optional[np.ndarray]): Mean motions of shape (K,), defaulting to Kepler's third law.
+        block (int): Time steps propagated at once.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: First and second object (first < second), time
+            step and distance of every close (pair, step).
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    first, second, steps, distances = [], [], [], []
+    for start in range(0, len(timestamps), block):
+        positions = propagate(elements, timestamps[start:start + block], mean_motions=mean_motions)
+        for step in range(positions.shape[1]):
+            pairs = cKDTree(positions[:, step]).query_pairs(radius, output_type='ndarray')
+            first.append(pairs[:, 0])
+            second.append(pairs[:, 1])
+            steps.append(np.full(len(pairs), start + step))
+            distances.append(np.linalg.norm(positions[pairs[:, 0], step] - positions[pairs[:, 1], step], axis=1))
+    if not first:
+        return (np.empty(0, dtype=np.intp),) * 3 + (np.empty(0),)
+    return np.concatenate(first), np.concatenate(second), np.concatenate(steps), np.concatenate(distances)
+
+def closest_approach(elements: np.ndarray, mean_motions: np.ndarray, first: np.ndarray, second: np.ndarray,
+                     lower: np.ndarray, upper: np.ndarray, tolerance: float = TCA_TOLERANCE):
+    """
+    Time and distance of closest approach of many pairs at once, by golden-section search of the distance
+    over each pair's bracket [lower, upper], in which it is assumed to have a single minimum.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Times and distances of closest approach.
+    """
+    def distance(times):
+        points = [
+            ellipse_model(elements[objects], times[:, np.newaxis], mean_motions[objects])[:, 0]
+            for objects in (first, second)
+        ]
+        return np.linalg.norm(points[0] - points[1], axis=1)
+
+    lower, upper = np.asarray(lower, dtype=float).copy(), np.asarray(upper, dtype=float).copy()
+    left = upper - _GOLDEN * (upper - lower)
+    right = lower + _GOLDEN * (upper - lower)
+    left_distance, right_distance = distance(left), distance(right)
+    while len(lower) and np.max(upper - lower) > tolerance:
+        # Keep the side of the smaller distance; one new evaluation per pair and iteration.
+        move_left = left_distance < right_distance
+        upper = np.where(move_left, right, upper)
+        lower = np.where(move_left, lower, left)
+        new = np.where(move_left, upper - _GOLDEN * (upper - lower), lower + _GOLDEN * (upper - lower))
+        new_distance = distance(new)
+        left, right, left_distance, right_distance = (
+            np.where(move_left, new, right), np.where(move_left, left, new),
+            np.where(move_left, new_distance, right_distance), np.where(move_left, left_distance, new_distance)
+        )
+    times = (lower + upper) / 2
+    return times, distance(times)
+
+def screen(elements: np.ndarray, start: float, end: float, threshold: float = SCREENING_DISTANCE,
+           step: float = SCREENING_STEP, mean_motions: Optional[np.ndarray] = None,
+           tolerance: float = TCA_TOLERANCE) -> Conjunctions:
+    """
+    All-pairs conjunction screening of a catalog over a time span.
+
+    The pairs are pruned by a sieve of cheap vectorized filters before any precise search:
+    1. Objects whose radial shell (perigee to apogee) overlaps no other object's are dropped altogether.
+    2. A spatial sieve (candidate_pairs) finds the pairs within threshold plus the largest relative
+       displacement over half a step of each other at some time step, so no encounter between steps is missed.
+    3. Those pairs go through the apogee/perigee and orbit geometry (node_filter) tests.
+    4. Every surviving run of consecutive close steps gets a golden-section search of its time of closest
+       approach, bracketed by the steps around its closest step.
+
+    Args:
+        elements (np.ndarray): Elements [a, e, incl, omega, Omega, M] of shape (K, 6), with M at t = 0.
+        start (float): Start of the time span.
+        end (float): End of the time span.
+        threshold (float): Miss distance below which an encounter is reported.
+        step (float): Time step of the spatial sieve.
+        mean_motions (Optional[np.ndarray]): Mean motions of shape (K,), defaulting to Kepler's third law.
+        tolerance (float): Precision of the times of closest approach.
+
+    Returns:
+        Conjunctions: Encounters closer than threshold, sorted by miss distance.
+    """
+    elements = np.asarray(elements, dtype=float)
+    mean_motions = mean_motion(elements[:, 0]) if mean_motions is None else np.asarray(mean_motions, dtype=float)
+
+    # 1. Radial shells.
+    objects = np.flatnonzero(overlapping_objects(elements, threshold))
+
+    # 2. Spatial sieve, with the search radius covering the relative motion over half a step. The fastest
+    # speed of an orbit, at perigee, is n a sqrt((1 + e) / (1 - e)).
+    a, e = elements[objects, 0], elements[objects, 1]
+    max_speed = np.max(mean_motions[objects] * a * np.sqrt((1 + e) / (1 - e)), initial=0.0)
+    timestamps = np.arange(start, end + step, step)
+    first, second, steps, distances = candidate_pairs(
+        elements[objects], timestamps, threshold + max_speed * step, mean_motions[objects]
+    )
+    first, second = objects[first], objects[second]
+
+    # 3. Geometric filters of the distinct pairs.
+    pairs, inverse = np.unique(np.column_stack((first, second)), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    kept = apsis_filter(elements, pairs[:, 0], pairs[:, 1], threshold)
+    kept[kept] = node_filter(elements, pairs[kept, 0], pairs[kept, 1], threshold)
+    selected = kept[inverse]
+    inverse, steps, distances = inverse[selected], steps[selected], distances[selected]
+
+    # 4. One search per run of consecutive steps of a pair, around the run's closest step.
+    order = np.lexsort((steps, inverse))
+    inverse, steps, distances = inverse[order], steps[order], distances[order]
+    new_run = np.ones(len(steps), dtype=bool)
+    new_run[1:] = (inverse[1:] != inverse[:-1]) | (steps[1:] != steps[:-1] + 1)
+    runs = np.cumsum(new_run) - 1
+    closest = np.lexsort((distances, runs))
+    closest = closest[np.r_[True, runs[closest][1:] != runs[closest][:-1]]] if len(closest) else closest
+    run_pairs = pairs[inverse[closest]]
+    times, distances = closest_approach(
+        elements, mean_motions, run_pairs[:, 0], run_pairs[:, 1],
+        np.maximum(timestamps[steps[closest]] - step, start), np.minimum(timestamps[steps[closest]] + step, end),
+        tolerance
+    )
+
+    close = distances <= threshold
+    order = np.argsort(distances[close])
+    return Conjunctions(
+        run_pairs[close, 0][order], run_pairs[close, 1][order], times[close][order], distances[close][order]
+    )
@@ -1,10 +1,20 @@
+import functools
 import numpy as np
-from scipy.optimize import minimize
-from typing import Union
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares, minimize
+from scipy.signal import lombscargle
+from scipy.spatial import cKDTree
+from typing import NamedTuple
+import instrument
+import kernels
+from flightpath import FlightPath, as_flight_path
+from pca import fit_planes
 
 # TODO: move
 PARITY = 60 * 60 # Parity between images in seconds.
 CONVERSION_RATIO = 1.0 # Conversion ratio by which to normalize coordinates.
+MU_EARTH = 398600.4418 # Standard gravitational parameter of the Earth in km^3 / s^2.
+EARTH_RADIUS = 6378.137 # Equatorial radius of the Earth in km.
 
 # TODO: Gather statistical resources to cite for the common values listed here for these to orient around.
 """
@@ -36,72 +46,163 @@ Reasoning Behind Initial Guesses:
     INIT_GUESS_ORIENTATION
 ] = [1080, 864, 0.1, 0]
 
+# Eccentricity prior used by the error function.
+EXPECTED_ECCENTRICITY = INIT_GUESS_ECCENTRICITY # Eccentricity the fit is pulled towards.
+BETA = 1.0 # Weight of the eccentricity deviation term.
+
+# Proximity threshold mod used when estimating the orbital period of a flight path.
+PROXIMITY_THRESHOLD_MOD = 1.0
+
+# Orbital period estimation settings.
+PERIOD_METHODS = ('recurrence', 'lombscargle')
+PERIOD_OUTLIER_THRESHOLD = 3.0 # Recurrences further than this many (normal-scaled) MADs from the median are dropped.
+RECURRENCE_PREFIX = 2048 # Points searched with the KD-tree to bootstrap the period of longer paths.
+LOMB_SCARGLE_OVERSAMPLING = 5 # Trial frequencies per resolution element (1 / time span) of the periodogram.
+
+# Solvers accepted by scipy.optimize.least_squares for the six-element fit.
+LEAST_SQUARES_METHODS = ('trf', 'dogbox', 'lm')
+
+# Multi-start fit settings.
+MULTI_START_PHASES = 8 # Mean anomalies tried per semi-major axis of the plane seeds.
+MULTI_START_TRIPLETS = 16 # Triplets of observations turned into Gibbs seeds.
+MULTI_START_REFINED = 3 # Best seeds refined by the solver.
+MULTI_START_CHUNK = 1 << 20 # Candidates x data points evaluated per pass of the batch cost.
+
+# Kepler's equation solver settings.
+KEPLER_MAX_ITERATIONS = 50 # Fixed cap on Newton iterations per solve.
+KEPLER_TOLERANCE = 1e-10 # Convergence tolerance on the eccentric anomaly, in radians.
+
 def preprocess_data(flight_path):
     """
     Preprocess flight path data.
     Normalize coordinates, estimate speed, and calculate confidence score modifier.
+
+    Parameters:
+    - flight_path (FlightPath or list of dict): Flight path data.
+
+    Returns:
+    - normalized_flight_path (FlightPath): Flight path with normalized coordinates.
+    - confidence_score_modifiers (np.ndarray): Confidence score modifier of each data point.
     """
-    # Normalize coordinates
-    # You can implement normalization here
-    
     # Estimate speed
     # You can implement speed estimation here
-    
-    # Calculate confidence score modifier
+
+    flight_path = as_flight_path(flight_path)
+
+    # TODO: Maybe just modify in-place?
+    # Normalize coordinates (assuming conversion ratio from original units to kilometers)
+    normalized_flight_path = FlightPath(flight_path.values.copy())
+    normalized_flight_path.values[:3] *= CONVERSION_RATIO
+
+    # Calculate confidence score modifier (you can adjust this based on your model)
     # You can implement confidence score modifier calculation (alpha, beta distribution) here
-    
-    # Initialize lists to store processed data
-    normalized_flight_path = []
-    confidence_score_modifiers = []
-    
-    # Iterate over each data point in the flight path
-    for data_point in flight_path:
-        # Extract coordinates (x, y, z), speed (s), time (t), and confidence score (C)
-        x, y, z = data_point['x'], data_point['y'], data_point['z']
-        speed = data_point['s']
-        time = data_point['t']
-        confidence_score = data_point['C']
-        
-        # Normalize coordinates (assuming conversion ratio from original units to kilometers)
-        normalized_x = x * conversion_ratio
-        normalized_y = y * conversion_ratio
-        normalized_z = z * conversion_ratio
-        
-        # Calculate confidence score modifier (you can adjust this based on your model)
-        confidence_score_modifier = confidence_score
-        
-        # TODO: Maybe just modify in-place?
-        # Append processed data to lists
-        normalized_flight_path.append({'x': normalized_x, 'y': normalized_y, 'z': normalized_z, 's': speed, 't': time})
-        confidence_score_modifiers.append(confidence_score_modifier)
-    
+    confidence_score_modifiers = normalized_flight_path.C
+
     return normalized_flight_path, confidence_score_modifiers
 
-def estimate_parameters(flight_path, estimated_speeds):
+class FitContext:
+    """
+    Per-flight-path invariants for the ellipse fit.
+
+    The orbital period, inclination, observed positions and confidence weights don't depend on the parameters
+    being optimized, so they are computed once per flight path here and shared by every objective evaluation.
+    """
+    __slots__ = (
+        'x', 'y', 'z', 'speed', 'time', 'confidence_score_modifiers',
+        'orbital_period', 'period_uncertainty', 'inclination', 'mean_motion', 'mean_anomaly', 'predicted_z', 'displacement',
+        'positions', 'weights'
+    )
+
+    def __init__(self, flight_path, confidence_score_modifiers, proximity_threshold_mod=PROXIMITY_THRESHOLD_MOD):
+        """
+        Parameters:
+        - flight_path (FlightPath or list of dict): Flight path data containing observed positions, speeds and times.
+        - confidence_score_modifiers (array-like): Confidence score modifier of each data point. If None, the
+          confidence scores (C) of the flight path are used.
+        - proximity_threshold_mod (float): Proximity threshold mod used to estimate the orbital period.
+        """
+        # Coordinates (x, y, z), speed (s), and time (t) for every data point, as column views.
+        flight_path = as_flight_path(flight_path)
+        self.x, self.y, self.z = flight_path.x, flight_path.y, flight_path.z
+        self.speed = flight_path.s
+        self.time = flight_path.t
+        if confidence_score_modifiers is None:
+            confidence_score_modifiers = flight_path.C
+        self.confidence_score_modifiers = np.asarray(confidence_score_modifiers, dtype=float)
+
+        # Estimate orbital period and inclination once for the whole flight path.
+        period = estimate_period(flight_path, proximity_threshold_mod)
+        if period is None:
+            raise ValueError("Could not estimate an orbital period for the flight path.")
+        self.orbital_period, self.period_uncertainty = period.period, period.uncertainty
+        self.inclination = estimate_orbital_inclination(flight_path)
+
+        # Calculate mean anomaly (M) using the formula: M = (2π / T) * t, where T is the orbital period.
+        self.mean_motion = 2 * np.pi / self.orbital_period
+        self.mean_anomaly = self.mean_motion * self.time
+
+        # Calculate predicted z coordinate taking into account orbital inclination.
+        self.predicted_z = self.z * np.cos(self.inclination)
+
+        # TODO: Make this the parity? Or half the parity?
+        # Distance covered by the object over a small time interval (assuming constant speed).
+        self.displacement = self.speed * PARITY
+
+        # Observed positions and per-coordinate residual weights (sqrt of the confidence) for the six-element fit.
+        self.positions = flight_path.positions
+        self.weights = np.sqrt(self.confidence_score_modifiers)[:, np.newaxis]
+
+    def __len__(self):
+        return len(self.time)
+
+@instrument.timed()
+def estimate_parameters(context, expected_eccentricity=EXPECTED_ECCENTRICITY, beta=BETA, multi_start=False, workers=1):
     """
     Estimate ellipse parameters.
+
+    Parameters:
+    - context (FitContext): Precomputed invariants of the flight path, reused by every objective evaluation.
+    - expected_eccentricity (float): Eccentricity the fit is pulled towards.
+    - beta (float): Weight of the eccentricity deviation term.
+    - multi_start (bool): Instead of the fixed initial guess, score a grid of seeds (semi-major axes from the
+      observed distances, eccentricities and orientations) in one batched evaluation of calculate_error and
+      refine the MULTI_START_REFINED best.
+    - workers (int): Number of processes refining the seeds; 1 refines them in-process.
+
+    Returns:
+    - optimized_parameters (np.ndarray): Optimized [semi-major axis, eccentricity, orientation].
     """
-    # Initial guess for ellipse parameters
-    # You can use the Earth's radius to estimate initial parameters
-    
-    # Optimization function (minimize error)
-    # You can use scipy's minimize function
-    
-    # Optimize ellipse parameters
-    # You can optimize parameters using nonlinear least squares
-    
-    # Initial guess for ellipse parameters
+    # Initial guess for ellipse parameters. The semi-minor axis follows from the semi-major axis and the
+    # eccentricity, so it is not optimized separately.
     initial_parameters = [
         INIT_GUESS_SEMI_MAJOR,
-        INIT_GUESS_SEMI_MINOR,
         INIT_GUESS_ECCENTRICITY,
         INIT_GUESS_ORIENTATION
     ]
-    
+    if not multi_start:
+        return _minimize_parameters(context, expected_eccentricity, beta, initial_parameters)
+
+    # Grid of seeds around the observed distances from the origin, scored all at once.
+    distance = np.median(np.hypot(context.x, context.y))
+    a, e, orientation = np.meshgrid(
+        [INIT_GUESS_SEMI_MAJOR, 0.5 * distance, distance, 2 * distance],
+        [0.0, expected_eccentricity, 0.5],
+        np.linspace(-np.pi, np.pi, MULTI_START_PHASES, endpoint=False),
+        indexing='ij'
+    )
+    seeds = np.column_stack((a.ravel(), e.ravel(), orientation.ravel()))
+    errors = calculate_error(seeds.T, context, None, expected_eccentricity, beta)
+    seeds = seeds[np.argsort(errors)[:MULTI_START_REFINED]]
+
+    refined = _refine_seeds(functools.partial(_minimize_parameters, context, expected_eccentricity, beta), seeds, workers)
+    errors = calculate_error(np.array(refined).T, context, None, expected_eccentricity, beta)
+    return refined[int(np.argmin(errors))]
+
+def _minimize_parameters(context, expected_eccentricity, beta, initial_parameters):
     # Optimization function (minimize error)
     def optimization_function(parameters):
         # Calculate error for given parameters
-        error = calculate_error(parameters, flight_path, estimated_speeds)
+        error = calculate_error(parameters, context, None, expected_eccentricity, beta)
         return error
     
     # Optimize ellipse parameters
@@ -112,94 +213,166 @@ def estimate_parameters(flight_path, estimated_speeds):
     
     return optimized_parameters
 
+def _refine_seeds(refine, seeds, workers=1):
+    # Apply a (picklable) refinement to every seed, across a process pool when workers > 1.
+    if workers is None or workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(refine, seeds))
+    return [refine(seed) for seed in seeds]
+
+def solve_kepler(mean_anomaly, eccentricity, max_iterations=KEPLER_MAX_ITERATIONS, tolerance=KEPLER_TOLERANCE):
+    """
+    Solve Kepler's equation M = E - e * sin(E) for the eccentric anomaly E, for every mean anomaly at once.
+
+    Parameters:
+    - mean_anomaly (array-like): Mean anomalies (M) in radians.
+    - eccentricity (array-like): Eccentricities (e), broadcast against mean_anomaly. E.g. shape (K, 1) against
+      mean anomalies of shape (N,) solves K candidate eccentricities in one call, giving shape (K, N).
+    - max_iterations (int): Fixed cap on the number of Newton iterations.
+    - tolerance (float): Convergence tolerance on the Newton step, in radians.
+
+    Returns:
+    - eccentric_anomaly (np.ndarray): Eccentric anomalies (E) in radians, in the broadcast shape of the inputs.
+    - converged (np.ndarray): Boolean mask, True where a Newton step was within tolerance.
+    """
+    mean_anomaly, eccentricity = np.broadcast_arrays(
+        np.asarray(mean_anomaly, dtype=float),
+        np.asarray(eccentricity, dtype=float)
+    )
+
+    # Wrap the mean anomaly into [-π, π) so the Newton iteration starts close to the root; whole revolutions
+    # are added back at the end.
+    wrapped_mean_anomaly = np.remainder(mean_anomaly + np.pi, 2 * np.pi) - np.pi
+
+    # Starting guess: E = M + e * sin(M) for near-circular orbits, ±π for highly eccentric ones.
+    eccentric_anomaly = np.where(
+        eccentricity < 0.8,
+        wrapped_mean_anomaly + eccentricity * np.sin(wrapped_mean_anomaly),
+        np.sign(wrapped_mean_anomaly) * np.pi
+    )
+
+    # Newton iterations on f(E) = E - e * sin(E) - M over the whole array. Entries stop moving once their step
+    # is within tolerance, as in the compiled kernels, so every result is independent of what else
+    # is solved in the same call (e.g. how propagate chunks a catalog).
+    converged = np.zeros(eccentric_anomaly.shape, dtype=bool)
+    sweeps = 0
+    for sweeps in range(1, max_iterations + 1):
+        step = (eccentric_anomaly - eccentricity * np.sin(eccentric_anomaly) - wrapped_mean_anomaly) \
+            / (1 - eccentricity * np.cos(eccentric_anomaly))
+        eccentric_anomaly = eccentric_anomaly - np.where(converged, 0.0, step)
+        converged |= np.abs(step) < tolerance
+        if converged.all():
+            break
+
+    # Every sweep steps the whole array.
+    instrument.count('kepler_solves', eccentric_anomaly.size)
+    instrument.count('kepler_iterations', sweeps * eccentric_anomaly.size)
+
+    return eccentric_anomaly + (mean_anomaly - wrapped_mean_anomaly), converged
+
+def true_anomaly_from_eccentric(eccentric_anomaly, eccentricity):
+    """
+    Convert eccentric anomaly to true anomaly: ν = 2 * atan2(sqrt(1 + e) * sin(E / 2), sqrt(1 - e) * cos(E / 2)).
+
+    Parameters:
+    - eccentric_anomaly (array-like): Eccentric anomalies (E) in radians.
+    - eccentricity (array-like): Eccentricities (e), broadcast against eccentric_anomaly.
+
+    Returns:
+    - true_anomaly (np.ndarray): True anomalies (ν) in radians.
+    """
+    return 2 * np.arctan2(
+        np.sqrt(1 + eccentricity) * np.sin(eccentric_anomaly / 2),
+        np.sqrt(1 - eccentricity) * np.cos(eccentric_anomaly / 2)
+    )
+
+def eccentric_anomaly_from_true(true_anomaly, eccentricity):
+    """
+    Convert true anomaly to eccentric anomaly: E = 2 * atan2(sqrt(1 - e) * sin(ν / 2), sqrt(1 + e) * cos(ν / 2)).
+
+    Parameters:
+    - true_anomaly (array-like): True anomalies (ν) in radians.
+    - eccentricity (array-like): Eccentricities (e), broadcast against true_anomaly.
+
+    Returns:
+    - eccentric_anomaly (np.ndarray): Eccentric anomalies (E) in radians.
+    """
+    return 2 * np.arctan2(
+        np.sqrt(1 - eccentricity) * np.sin(true_anomaly / 2),
+        np.sqrt(1 + eccentricity) * np.cos(true_anomaly / 2)
+    )
+
+def mean_motion(semi_major_axis, mu=MU_EARTH):
+    """
+    Mean motion n = sqrt(mu / a^3) of an orbit, in radians per second.
+
+    Parameters:
+    - semi_major_axis (array-like): Semi-major axes (a) in km.
+    - mu (float): Standard gravitational parameter in km^3 / s^2.
+
+    Returns:
+    - mean_motion (np.ndarray): Mean motions in radians per second.
+    """
+    return np.sqrt(mu / np.asarray(semi_major_axis, dtype=float)**3)
 
 def calculate_error(parameters, flight_path, confidence_score_modifiers, expected_eccentricity, beta):
     """
     Calculate error for the fitted ellipse.
+
+    The flight path may be given as a FitContext, in which case its precomputed invariants are used and
+    confidence_score_modifiers is ignored; otherwise a context is built for this call. The parameters may also
+    be given as arrays of K candidates each, e.g. (a[K], e[K], θ[K]), in which case the error of every
+    candidate is evaluated in one pass and an array of K errors is returned.
     """
-    # Extract ellipse parameters.
-    semi_major_axis, eccentricity, orientation = parameters
-    
-    # Calculate predicted positions based on ellipse parameters.
-    predicted_positions = []  # List to store predicted positions.
-    
-    for data_point in flight_path:
-        # Extract coordinates (x, y, z), speed (s), and time (t).
-        x, y, z = data_point['x'], data_point['y'], data_point['z']
-        speed = data_point['s']
-        time = data_point['t']
-
-        # TODO: Proximity threshold mod should be a configurable constant.
-        # Estimate orbital period.
-        orbital_period = estimate_orbital_period(flight_path, 1.0)
-        
-        # Calculate mean anomaly (M) using the formula: M = (2π / T) * t, where T is the orbital period.
-        mean_anomaly = (2 * np.pi / orbital_period) * time
-        
-        # Calculate eccentric anomaly (E) using an iterative method.
-        eccentric_anomaly = mean_anomaly
-        max_iterations = 1000  # Maximum number of iterations.
-        tolerance = 1e-6  # Convergence tolerance.
-        for _ in range(max_iterations):
-            next_eccentric_anomaly = eccentric_anomaly + (mean_anomaly + eccentricity * np.sin(eccentric_anomaly) - eccentric_anomaly) / (1 - eccentricity * np.cos(eccentric_anomaly))
-            if np.abs(next_eccentric_anomaly - eccentric_anomaly) < tolerance:
-                break
-            eccentric_anomaly = next_eccentric_anomaly
-        
-        # Calculate true anomaly (ν) using the formula: ν = 2 * atan(sqrt((1 + e) / (1 - e)) * tan(E / 2)).
-        true_anomaly = 2 * np.arctan(np.sqrt((1 + eccentricity) / (1 - eccentricity)) * np.tan(eccentric_anomaly / 2))
-        
-        # Calculate distance from the center (r) using the formula: r = a * (1 - e^2) / (1 + e * cos(ν)).
-        distance_from_center = semi_major_axis * (1 - eccentricity**2) / (1 + eccentricity * np.cos(true_anomaly))
-        
-        # Calculate predicted position (x', y', z') in the orbital plane.
-        predicted_x_orbital_plane = distance_from_center * np.cos(true_anomaly)
-        predicted_y_orbital_plane = distance_from_center * np.sin(true_anomaly)
-        
-        # Rotate predicted position by the orientation angle.
-        predicted_x = predicted_x_orbital_plane * np.cos(orientation) - predicted_y_orbital_plane * np.sin(orientation)
-        predicted_y = predicted_x_orbital_plane * np.sin(orientation) + predicted_y_orbital_plane * np.cos(orientation)
-        
-        inclination = estimate_orbital_inclination(flight_path)
+    context = flight_path if isinstance(flight_path, FitContext) else FitContext(flight_path, confidence_score_modifiers)
+    if instrument.active() is not None:
+        instrument.count('objective_evaluations', np.broadcast(*(np.asarray(p) for p in parameters)).size)
+
+    # The whole chain below fused into one compiled pass per candidate.
+    if kernels.JIT:
+        semi_major_axis, eccentricity, orientation = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in parameters))
+        total_error = kernels.legacy_errors(
+            semi_major_axis.ravel(), eccentricity.ravel(), orientation.ravel(), context.mean_anomaly,
+            context.displacement, context.x, context.y, context.z, context.predicted_z,
+            context.confidence_score_modifiers, expected_eccentricity, beta, KEPLER_MAX_ITERATIONS, KEPLER_TOLERANCE
+        )
+        return total_error.reshape(semi_major_axis.shape)[()]
+
+    # Extract ellipse parameters, with a trailing axis to broadcast against the data points.
+    semi_major_axis, eccentricity, orientation = (np.asarray(p, dtype=float)[..., np.newaxis] for p in parameters)
+
+    # Calculate eccentric anomaly (E) for every data point (and every candidate eccentricity) at once.
+    eccentric_anomaly, _ = solve_kepler(context.mean_anomaly, eccentricity)
+
+    # Calculate true anomaly (ν).
+    true_anomaly = true_anomaly_from_eccentric(eccentric_anomaly, eccentricity)
+
+    # Calculate distance from the center (r) using the formula: r = a * (1 - e^2) / (1 + e * cos(ν)).
+    distance_from_center = semi_major_axis * (1 - eccentricity**2) / (1 + eccentricity * np.cos(true_anomaly))
+
+    # Calculate predicted position (x', y') in the orbital plane.
+    predicted_x_orbital_plane = distance_from_center * np.cos(true_anomaly)
+    predicted_y_orbital_plane = distance_from_center * np.sin(true_anomaly)
+
+    # Rotate predicted position by the orientation angle, then update it based on displacement.
+    cos_orientation, sin_orientation = np.cos(orientation), np.sin(orientation)
+    predicted_x = predicted_x_orbital_plane * cos_orientation - predicted_y_orbital_plane * sin_orientation \
+        + context.displacement * cos_orientation
+    predicted_y = predicted_x_orbital_plane * sin_orientation + predicted_y_orbital_plane * cos_orientation \
+        + context.displacement * sin_orientation
+
+    # Calculate squared error for each point.
+    squared_error = (predicted_x - context.x)**2 + (predicted_y - context.y)**2 + (context.predicted_z - context.z)**2
+
+    # Calculate eccentricity deviation term.
+    eccentricity_deviation = (eccentricity - expected_eccentricity)**2
+
+    # Combine squared error and eccentricity deviation term (weighted by confidence score modifier and beta).
+    errors = context.confidence_score_modifiers * (squared_error + beta * eccentricity_deviation)
+
+    # Calculate total error (one per candidate).
+    total_error = np.sum(errors, axis=-1)
 
-        # Calculate predicted z coordinate taking into account orbital inclination.
-        predicted_z = z * np.cos(inclination)
-        
-        # TODO: Make this the parity? Or half the parity?
-        # Determine the displacement of the object over a small time interval (assuming constant speed).
-        dt = PARITY
-        displacement_x = speed * np.cos(orientation) * dt
-        displacement_y = speed * np.sin(orientation) * dt
-        
-        # Update predicted position based on displacement.
-        predicted_x += displacement_x
-        predicted_y += displacement_y
-        
-        predicted_positions.append({'x': predicted_x, 'y': predicted_y, 'z': predicted_z})
-    
-    # Calculate error for each point.
-    errors = []
-    for predicted_position, data_point, confidence_score_modifier in zip(predicted_positions, flight_path, confidence_score_modifiers):
-        # Extract observed coordinates (x, y, z).
-        observed_x, observed_y, observed_z = data_point['x'], data_point['y'], data_point['z']
-        
-        # Extract predicted coordinates (x', y', z').
-        predicted_x, predicted_y, predicted_z = predicted_position['x'], predicted_position['y'], predicted_position['z']
-        
-        # Calculate squared error (weighted by confidence score modifier).
-        squared_error = (predicted_x - observed_x)**2 + (predicted_y - observed_y)**2 + (predicted_z - observed_z)**2
-        
-        # Calculate eccentricity deviation term.
-        eccentricity_deviation = (eccentricity - expected_eccentricity)**2
-        
-        # Combine squared error and eccentricity deviation term (weighted by confidence score modifier and beta).
-        error = confidence_score_modifier * (squared_error + beta * eccentricity_deviation)
-        
-        errors.append(error)
-    
-    # Calculate total error
-    total_error = sum(errors)
-    
     return total_error
 
         # # Extract ellipse parameters
@@ -313,166 +486,692 @@ def calculate_error(parameters, flight_path, confidence_score_modifiers, expecte
         
         # return total_error
 
-def estimate_orbital_period(flight_path, proximity_threshold_mod):
+class PeriodEstimate(NamedTuple):
     """
-    Estimate orbital period given a flight path.
+    Orbital period estimated from a flight path.
+    """
+    period: float # Estimated orbital period in seconds.
+    uncertainty: float # Standard error of the period (half width of the peak for a periodogram) in seconds.
+    samples: int # Number of recurrences combined (1 for a periodogram peak).
+
+def _weighted_median(values, weights):
+    # Value at which the cumulative weight of the sorted values reaches half the total.
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return values[order][np.searchsorted(cumulative, 0.5 * cumulative[-1])]
+
+def find_recurrences(positions, times, proximity_threshold):
+    """
+    Find, for every point of a flight path at once, where the object next returns to it.
+
+    All pairs of points within the proximity threshold come from one KD-tree query. The neighbours of each
+    anchor point are split into runs of consecutive indices: the run starting right after the anchor is the
+    object still leaving it, and the next run is its return. The return time is refined to the closest approach
+    to the anchor, by projecting the offset onto the local velocity, so the estimate isn't limited to the
+    sampling interval.
 
     Parameters:
-    - flight_path (list of dict): Flight path data containing observed positions.
-    - proximity_threshold_mod (float): Orbital period is estimated as the described object returns to an
-      approximate initial position. It is assumed that the proximity should be within 100 km.
+    - positions (np.ndarray): Observed positions of shape (N, 3), in time order.
+    - times (np.ndarray): Observation times of shape (N,).
+    - proximity_threshold (float): Distance within which the object counts as back at a point.
 
     Returns:
-    - orbital_period (float): Estimated orbital period in seconds.
+    - anchors (np.ndarray): Indices of the points the object returned to.
+    - returns (np.ndarray): Index of the closest point of each return.
+    - periods (np.ndarray): Time from each anchor to the closest approach of its return.
     """
-    # TODO: Alternative idea: what if we just lazily fit a circle? Should that approximate ellipse behavior
-    # sufficiently to gather 1 orbital period?
-    # TODO: In general, this function is a very rough estimate and could use improvement.
-    # Extract initial position from flight path.
-    # TODO: Keep in mind that there might be better "segments" or sections of the flight path for producing
-    # an orbital period. We should find the "best section" with the most descriptive points (and highest
-    # confidence scores) to use in deriving orbital period... AND/OR we should repeat the process of getting
-    # orbital period as we do below and average all the results (weighted by confidence per orbit).
-    initial_position = np.array([flight_path[0]['x'], flight_path[0]['y'], flight_path[0]['z']])
-    
+    # Every pair (i < j) of points within the threshold, sorted by anchor then neighbour.
+    instrument.count('kdtree_builds')
+    instrument.count('kdtree_queries', len(positions))
+    pairs = cKDTree(positions).query_pairs(proximity_threshold, output_type='ndarray')
+    if len(pairs) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, np.empty(0)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    anchor, neighbour = pairs[:, 0], pairs[:, 1]
+
+    # Split the neighbours of each anchor into runs of consecutive indices.
+    new_anchor = np.r_[True, anchor[1:] != anchor[:-1]]
+    new_run = new_anchor | np.r_[True, neighbour[1:] != neighbour[:-1] + 1]
+    run = np.cumsum(new_run) - 1
+    anchor_number = np.cumsum(new_anchor) - 1
+    run_rank = run - run[new_anchor][anchor_number]
+
+    # The return is the first run, unless that run starts right after the anchor (the object leaving it).
+    leaving = (neighbour == anchor + 1)[new_anchor]
+    returning = run_rank == leaving[anchor_number].astype(np.intp)
+    anchor, neighbour, run = anchor[returning], neighbour[returning], run[returning]
+    if len(anchor) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, np.empty(0)
+
+    # Closest point of each return.
+    distances = np.linalg.norm(positions[neighbour] - positions[anchor], axis=1)
+    order = np.lexsort((distances, run))
+    _, first = np.unique(run[order], return_index=True)
+    anchors, returns = anchor[order][first], neighbour[order][first]
+
+    return anchors, returns, _closest_approach(positions, times, anchors, returns)
+
+def follow_recurrences(positions, times, period, proximity_threshold, window=2):
+    """
+    Find where the object next returns to every point of a flight path, given an approximate period.
+
+    Each anchor's return is looked for among the few points observed around one period later, found with a
+    binary search over the times, so the cost stays O(N log N) however many revolutions the path covers.
+
+    Parameters:
+    - positions (np.ndarray): Observed positions of shape (N, 3), in time order.
+    - times (np.ndarray): Observation times of shape (N,), sorted.
+    - period (float): Approximate orbital period, accurate to well within a sampling interval.
+    - proximity_threshold (float): Distance within which the object counts as back at a point.
+    - window (int): Number of points searched on each side of the predicted return.
+
+    Returns:
+    - anchors (np.ndarray): Indices of the points the object returned to.
+    - returns (np.ndarray): Index of the closest point of each return.
+    - periods (np.ndarray): Time from each anchor to the closest approach of its return.
+    """
+    # Points observed around one period after each anchor.
+    anchors = np.flatnonzero(times + period <= times[-1])
+    predicted = np.searchsorted(times, times[anchors] + period)
+    candidates = np.clip(predicted[:, np.newaxis] + np.arange(-window, window + 1), 0, len(times) - 1)
+
+    # Closest candidate of each anchor, if it is within the threshold.
+    distances = np.linalg.norm(positions[candidates] - positions[anchors, np.newaxis], axis=2)
+    closest = np.argmin(distances, axis=1)
+    returned = distances[np.arange(len(anchors)), closest] < proximity_threshold
+    anchors, returns = anchors[returned], candidates[returned, closest[returned]]
+
+    return anchors, returns, _closest_approach(positions, times, anchors, returns)
+
+def _closest_approach(positions, times, anchors, returns):
+    # Time from each anchor to the closest approach of its return, moving along the local velocity by at most
+    # half a sample either way.
+    before = np.maximum(returns - 1, 0)
+    after = np.minimum(returns + 1, len(times) - 1)
+    interval = times[after] - times[before]
+    velocity = (positions[after] - positions[before]) / np.where(interval > 0, interval, np.inf)[:, np.newaxis]
+    speed_squared = np.einsum('ij,ij->i', velocity, velocity)
+    offset = np.einsum('ij,ij->i', positions[returns] - positions[anchors], velocity)
+    shift = -offset / np.where(speed_squared > 0, speed_squared, np.inf)
+    shift = np.clip(shift, -0.5 * interval, 0.5 * interval)
+    return times[returns] + shift - times[anchors]
+
+def _lomb_scargle_period(positions, times, weights, period_range, oversampling):
+    # Peak of the summed Lomb-Scargle periodograms of the three coordinates, on a grid of frequencies.
+    span = times[-1] - times[0]
+    shortest, longest = period_range if period_range is not None else (2 * np.median(np.diff(times)), span)
+    frequencies = np.linspace(1 / longest, 1 / shortest, int(np.ceil(oversampling * span * (1 / shortest - 1 / longest))) + 1)
+    power = sum(
+        lombscargle(times, positions[:, k], 2 * np.pi * frequencies, floating_mean=True, weights=weights)
+        for k in range(3)
+    )
+
+    # Parabolic interpolation of the peak.
+    peak = int(np.clip(np.argmax(power), 1, len(power) - 2))
+    left, centre, right = power[peak - 1:peak + 2]
+    curvature = left - 2 * centre + right
+    shift = 0.5 * (left - right) / curvature if curvature < 0 else 0.0
+    step = frequencies[1] - frequencies[0]
+    frequency = frequencies[peak] + shift * step
+
+    # Half width at half maximum of the peak, as the frequency uncertainty.
+    below = power < 0.5 * power[peak]
+    lower = np.flatnonzero(below[:peak])
+    upper = np.flatnonzero(below[peak:])
+    width = 0.5 * ((upper[0] if len(upper) else len(power) - peak) + (peak - lower[-1] if len(lower) else peak)) * step
+
+    return PeriodEstimate(float(1 / frequency), float(width / frequency**2), 1)
+
+def estimate_period(flight_path, proximity_threshold_mod=PROXIMITY_THRESHOLD_MOD, method='recurrence', period_range=None):
+    """
+    Estimate the orbital period of a flight path, with its uncertainty.
+
+    Parameters:
+    - flight_path (FlightPath or list of dict): Flight path data containing observed positions, in time order.
+    - proximity_threshold_mod (float): Distance within which the object counts as back at an earlier point,
+      for the 'recurrence' method. About the distance covered between two observations works well.
+    - method (str): One of PERIOD_METHODS. 'recurrence' combines the return time of every point of the path
+      (see find_recurrences and follow_recurrences), in O(N log N). 'lombscargle' takes the peak of the Lomb-Scargle periodogram of the
+      coordinates, which handles uneven sampling and needs no threshold, but costs O(N) per trial frequency.
+    - period_range (tuple): Shortest and longest trial periods for 'lombscargle'. Defaults to twice the median
+      sampling interval and the time span of the path.
+
+    Returns:
+    - estimate (PeriodEstimate): Estimated period, or None if the object never returns (or for fewer than
+      three points with 'lombscargle').
+    """
+    if method not in PERIOD_METHODS:
+        raise ValueError(f"Unknown period estimation method {method!r}, expected one of {PERIOD_METHODS}.")
+
+    flight_path = as_flight_path(flight_path)
+    positions = flight_path.positions
+    times = flight_path.t
+    confidences = flight_path.C
+    if not np.any(confidences > 0):
+        confidences = np.ones(len(flight_path))
+
+    if method == 'lombscargle':
+        if len(flight_path) < 3:
+            return None
+        return _lomb_scargle_period(positions, times, confidences, period_range, LOMB_SCARGLE_OVERSAMPLING)
+
     # Define a threshold for proximity.
     proximity_threshold = proximity_threshold_mod * 1.0  # Adjust as needed based on the scale of coordinates.
-    
-    def find_orbit_period(i, points) -> Union[tuple[int, int], None]:
-        # Iterate through flight path data. Return the estimated orbital period and the index.
-        started_orbit = -1
-        for j, point in enumerate(points[i:]):
-            # Calculate distance between current point and initial position.
-            current_position = np.array([point['x'], point['y'], point['z']])
-            distance = np.linalg.norm(current_position - initial_position)
-            
-            # Check if the current point is close to the initial position.
-            if distance < proximity_threshold:
-                # TODO: This is kind of ridiculous, but we expect at least a couple steps between "starting" orbit
-                # and exiting orbit. It's actually an assumption we're making here, there may not be a couple steps available.
-                if started_orbit <= j - 2:
-                    # The object has left its initial starting point and performed, hopefully, an orbital path.
-                    # Calculate orbital period as the time difference between current and initial points.
-                    orbital_period = flight_path[j]['t'] - flight_path[i]['t']
-                    return j, orbital_period
-            else:
-                started_orbit = j
-        # Reached the end of the data.
-        return None
-    
-    def remove_outliers_and_average(nums: list):
-         # Convert list to numpy array.
-        nums = np.array(nums)
 
-        # Calculate average.
-        avg = np.mean(nums)
-        
-        # Calculate absolute differences.
-        abs_diff = np.abs(nums - avg)
-        
-        # Calculate median absolute deviation (MAD).
-        mad = np.median(abs_diff)
-        
-        # Define threshold for outliers.
-        threshold = 0.5 * mad
-        
-        # Identify outliers.
-        outliers = np.abs(nums - avg) > threshold
-        
-        # Remove outliers.
-        filtered_nums = nums[~outliers]
-        
-        # Calculate average of the filtered numbers.
-        avg_filtered = np.mean(filtered_nums)
-        
-        return avg_filtered
-
-    # TODO: Weight by confidence!
-    # Gather all the orbital period estimates we can over the course of this flight path.
-    periods = []
+    # Bootstrap an approximate period from the recurrences within a prefix of the path, growing it until the
+    # object returns (the pairs found grow with the number of revolutions covered, so the prefix is kept short).
+    size = min(RECURRENCE_PREFIX, len(flight_path))
     while True:
-        i = 0
-        p = find_orbit_period(i, flight_path)
-        if p is None:
+        anchors, returns, periods = find_recurrences(positions[:size], times[:size], proximity_threshold)
+        if len(periods) or size == len(flight_path):
             break
-        periods.append(p)
-    if (len(periods) == 0):
-        # If no point close to the initial position is found, return None.
+        size = min(4 * size, len(flight_path))
+    if len(periods) == 0:
+        # If the object never comes back close to an earlier position, return None.
         return None
-    # Average these estimates to get the final result.
-    return remove_outliers_and_average(periods)
+
+    # A revolution missing from the data (drop outs) shows up as a return after several periods; fold those.
+    weights = confidences[anchors] * confidences[returns]
+    approximate_period = _weighted_median(periods, weights if np.any(weights > 0) else np.ones(len(periods)))
+
+    # Follow the return of every point of the whole path from the approximate period.
+    if size < len(flight_path):
+        followed = follow_recurrences(positions, times, approximate_period, proximity_threshold)
+        if len(followed[2]):
+            anchors, returns, periods = followed
+    periods = periods / np.maximum(np.rint(periods / approximate_period), 1)
+
+    # Weight every recurrence by the confidence of both of its ends.
+    weights = confidences[anchors] * confidences[returns]
+    if not np.any(weights > 0):
+        weights = np.ones(len(periods))
+
+    # Remove outliers by median absolute deviation.
+    deviations = np.abs(periods - np.median(periods))
+    inliers = deviations <= PERIOD_OUTLIER_THRESHOLD * 1.4826 * np.median(deviations)
+    periods, weights = periods[inliers], weights[inliers]
+
+    # Confidence-weighted mean, and its standard error over the effective number of recurrences.
+    period = np.average(periods, weights=weights)
+    variance = np.average((periods - period)**2, weights=weights)
+    effective_samples = np.sum(weights)**2 / np.sum(weights**2)
+    return PeriodEstimate(float(period), float(np.sqrt(variance / effective_samples)), len(periods))
+
+def estimate_orbital_period(flight_path, proximity_threshold_mod):
+    """
+    Estimate orbital period given a flight path.
+
+    Parameters:
+    - flight_path (FlightPath or list of dict): Flight path data containing observed positions.
+    - proximity_threshold_mod (float): Orbital period is estimated as the described object returns to an
+      approximate initial position. It is assumed that the proximity should be within 100 km.
+
+    Returns:
+    - orbital_period (float): Estimated orbital period in seconds, or None if the object never returns.
+    """
+    # TODO: Alternative idea: what if we just lazily fit a circle? Should that approximate ellipse behavior
+    # sufficiently to gather 1 orbital period?
+    estimate = estimate_period(flight_path, proximity_threshold_mod)
+    return None if estimate is None else estimate.period
 
 def estimate_orbital_inclination(flight_path):
     """
     Estimate orbital inclination given a flight path.
 
     Parameters:
-    - flight_path (list of dict): Flight path data containing observed positions.
+    - flight_path (FlightPath or list of dict): Flight path data containing observed positions.
 
     Returns:
     - inclination (float): Estimated orbital inclination in radians.
     """
     # Extract observed positions
-    positions = np.array([[data_point['x'], data_point['y'], data_point['z']] for data_point in flight_path])
-
-    # Calculate covariance matrix
-    covariance_matrix = np.cov(positions, rowvar=False)
-
-    # Perform singular value decomposition (SVD) to get orientation of ellipse axes
-    _, _, v = np.linalg.svd(covariance_matrix)
-
-    # Extract direction of smallest axis (normal to orbital plane)
-    normal_vector = v[2]
-
-    # Calculate inclination angle
-    inclination = np.arccos(np.dot(normal_vector, [0, 0, 1]))
+    positions = as_flight_path(flight_path).positions
 
-    return inclination
+    # Inclination of the normal to the best fit plane, oriented along the angular momentum
+    return float(fit_planes(positions, [0, len(positions)]).inclinations[0])
 
-def fit_ellipse_to_flight_path(flight_path):
+@instrument.timed()
+def fit_ellipse_to_flight_path(flight_path, proximity_threshold_mod=PROXIMITY_THRESHOLD_MOD, multi_start=False):
     """
-    Fit an ellipse to the list of points in the flight path.
+    Fit an ellipse to the list of points in the flight path, optionally from several seeds (see
+    estimate_parameters).
     """
     # Preprocess flight path data
-    normalized_flight_path, estimated_speeds, confidence_score_modifiers = preprocess_data(flight_path)
+    normalized_flight_path, confidence_score_modifiers = preprocess_data(flight_path)
+
+    # Compute the per-flight-path invariants once, shared by every objective evaluation
+    context = FitContext(normalized_flight_path, confidence_score_modifiers, proximity_threshold_mod)
     
     # Estimate ellipse parameters
-    optimized_parameters = estimate_parameters(normalized_flight_path, estimated_speeds)
+    optimized_parameters = estimate_parameters(context, multi_start=multi_start)
     
     # Calculate error for the fitted ellipse
-    total_error = calculate_error(optimized_parameters, normalized_flight_path, estimated_speeds, confidence_score_modifiers)
+    total_error = calculate_error(optimized_parameters, context, None, EXPECTED_ECCENTRICITY, BETA)
     
     return optimized_parameters, total_error
 
 # TODO: Remove?
-def ellipse_model(params, t):
+def orbital_plane_basis(incl, omega, Omega):
+    """
+    Unit vectors P (towards periapsis) and Q (90° ahead of it, in the orbital plane) in the reference frame.
+
+    Parameters:
+    - incl (array-like): Inclinations in radians.
+    - omega (array-like): Arguments of periapsis in radians.
+    - Omega (array-like): Longitudes of the ascending node in radians.
+
+    Returns:
+    - P (np.ndarray): Array of shape (..., 3).
+    - Q (np.ndarray): Array of shape (..., 3).
+    """
+    cos_i, sin_i = np.cos(incl), np.sin(incl)
+    cos_w, sin_w = np.cos(omega), np.sin(omega)
+    cos_O, sin_O = np.cos(Omega), np.sin(Omega)
+    P = np.stack((
+        cos_w * cos_O - sin_w * sin_O * cos_i,
+        cos_w * sin_O + sin_w * cos_O * cos_i,
+        sin_w * sin_i
+    ), axis=-1)
+    Q = np.stack((
+        -(sin_w * cos_O + cos_w * sin_O * cos_i),
+        cos_w * cos_O * cos_i - sin_w * sin_O,
+        cos_w * sin_i
+    ), axis=-1)
+    return P, Q
+
+def ellipse_model(params, t, mean_motion=0.0):
     """
     Utility model function representing the parametric equations of an ellipse in 3D space. Uses
     the six Keplerian orbital elements.
 
     Parameters:
-        params (list or array-like): List of six Keplerian orbital elements [a, e, incl, omega, Omega, M].
+        params (list or array-like): List of six Keplerian orbital elements [a, e, incl, omega, Omega, M], or
+            an array of shape (K, 6) holding K element sets.
         t (array-like): Array of time values.
+        mean_motion (float or array-like): Mean motion (n) in radians per unit time; the mean anomaly at time t
+            is M + n * t. With the default of 0, M is used as given at every time.
 
     Returns:
-        model_points (np.ndarray): Array of shape (len(t), 3) representing the model points on the ellipse.
+        model_points (np.ndarray): Array of shape (len(t), 3) representing the model points on the ellipse,
+            or (K, len(t), 3) for K element sets.
     """
-    a, e, incl, omega, Omega, M = params
-    # Compute eccentric anomaly (E) from mean anomaly (M)
-    E = M + e * np.sin(M)
+    params = np.asarray(params, dtype=float)
+    if kernels.JIT and np.ndim(t) == 1:
+        elements = params.reshape(-1, 6)
+        mean_motions = np.broadcast_to(np.asarray(mean_motion, dtype=float), params.shape[:-1]).reshape(-1)
+        model_points = kernels.kepler_positions(
+            elements, mean_motions, np.asarray(t, dtype=float), KEPLER_MAX_ITERATIONS, KEPLER_TOLERANCE
+        )
+        return model_points.reshape(params.shape[:-1] + model_points.shape[1:])
+
+    a, e, incl, omega, Omega, M = np.moveaxis(params, -1, 0)[..., np.newaxis]
+    # Compute eccentric anomaly (E) from mean anomaly (M) by solving Kepler's equation
+    mean_anomaly = M + np.asarray(mean_motion, dtype=float)[..., np.newaxis] * np.asarray(t, dtype=float)
+    E, _ = solve_kepler(mean_anomaly, e)
     # Compute Cartesian coordinates of model points on the ellipse
     x = a * (np.cos(E) - e)
     y = a * np.sqrt(1 - e**2) * np.sin(E)
-    z = np.zeros_like(t)  # Assume a coplanar orbit
     # Rotate the ellipse to its proper orientation in space
-    x_rot = x * (np.cos(omega) * np.cos(Omega) - np.sin(omega) * np.sin(Omega) * np.cos(incl)) \
-            - y * (np.sin(omega) * np.cos(Omega) + np.cos(omega) * np.sin(Omega) * np.cos(incl))
-    y_rot = x * (np.cos(omega) * np.sin(Omega) + np.sin(omega) * np.cos(Omega) * np.cos(incl)) \
-            + y * (np.cos(omega) * np.cos(Omega) - np.sin(omega) * np.sin(Omega) * np.cos(incl))
-    z_rot = x * np.sin(omega) * np.sin(incl) + y * np.cos(omega) * np.sin(incl)
-    model_points = np.column_stack((x_rot, y_rot, z_rot))
+    P, Q = orbital_plane_basis(incl, omega, Omega)
+    model_points = x[..., np.newaxis] * P + y[..., np.newaxis] * Q
     return model_points
 
+def ellipse_model_jacobian(params, t, mean_motion=0.0):
+    """
+    Model points of ellipse_model together with their analytic partial derivatives with respect to the six
+    Keplerian orbital elements [a, e, incl, omega, Omega, M].
+
+    Parameters:
+        params (list or array-like): Six Keplerian orbital elements, or an array of shape (K, 6).
+        t (array-like): Array of time values.
+        mean_motion (float or array-like): Mean motion (n), as in ellipse_model. Held fixed, so it contributes
+            no derivative.
+
+    Returns:
+        model_points (np.ndarray): Array of shape (len(t), 3), or (K, len(t), 3).
+        jacobian (np.ndarray): Array of shape (len(t), 3, 6), or (K, len(t), 3, 6).
+    """
+    a, e, incl, omega, Omega, M = np.moveaxis(np.asarray(params, dtype=float), -1, 0)[..., np.newaxis]
+    mean_anomaly = M + np.asarray(mean_motion, dtype=float)[..., np.newaxis] * np.asarray(t, dtype=float)
+    E, _ = solve_kepler(mean_anomaly, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    root = np.sqrt(1 - e**2)
+
+    # In-plane coordinates and their derivatives with respect to E, with dE/dM = 1 / (1 - e * cos(E)) and
+    # dE/de = sin(E) / (1 - e * cos(E)) from Kepler's equation.
+    x = a * (cos_E - e)
+    y = a * root * sin_E
+    dx_dE = -a * sin_E
+    dy_dE = a * root * cos_E
+    dE_dM = 1 / (1 - e * cos_E)
+    dE_de = sin_E * dE_dM
+    dx_de = dx_dE * dE_de - a
+    dy_de = dy_dE * dE_de - a * e / root * sin_E
+
+    P, Q = orbital_plane_basis(incl, omega, Omega)
+    x, y = x[..., np.newaxis], y[..., np.newaxis]
+    model_points = x * P + y * Q
+
+    # Derivative of the basis with respect to inclination: dP/di = sin(ω) * N, dQ/di = cos(ω) * N.
+    N = np.stack((np.sin(Omega) * np.sin(incl), -np.cos(Omega) * np.sin(incl), np.cos(incl)), axis=-1)
+    jacobian = np.stack((
+        model_points / a[..., np.newaxis],
+        dx_de[..., np.newaxis] * P + dy_de[..., np.newaxis] * Q,
+        (x * np.sin(omega)[..., np.newaxis] + y * np.cos(omega)[..., np.newaxis]) * N,
+        x * Q - y * P,
+        np.stack((-model_points[..., 1], model_points[..., 0], np.zeros_like(model_points[..., 2])), axis=-1),
+        (dx_dE * dE_dM)[..., np.newaxis] * P + (dy_dE * dE_dM)[..., np.newaxis] * Q
+    ), axis=-1)
+    return model_points, jacobian
+
+def element_residuals(elements, context, expected_eccentricity=EXPECTED_ECCENTRICITY, beta=BETA):
+    """
+    Weighted residual vector of the six-element model against a flight path.
+
+    The residuals are sqrt(C) * (model - observed) for every coordinate of every data point, followed by the
+    eccentricity deviation term sqrt(beta * ΣC) * (e - expected_eccentricity), so their sum of squares matches
+    the confidence-weighted error of calculate_error.
+
+    Parameters:
+    - elements (array-like): Six Keplerian orbital elements [a, e, incl, omega, Omega, M], with M at t = 0.
+    - context (FitContext): Precomputed invariants of the flight path.
+    - expected_eccentricity (float): Eccentricity the fit is pulled towards.
+    - beta (float): Weight of the eccentricity deviation term.
+
+    Returns:
+    - residuals (np.ndarray): Array of shape (3N + 1,).
+    """
+    instrument.count('objective_evaluations')
+    model_points = ellipse_model(elements, context.time, context.mean_motion)
+    residuals = context.weights * (model_points - context.positions)
+    prior = np.sqrt(beta * np.sum(context.confidence_score_modifiers)) * (elements[1] - expected_eccentricity)
+    return np.append(residuals.ravel(), prior)
+
+def element_jacobian(elements, context, expected_eccentricity=EXPECTED_ECCENTRICITY, beta=BETA):
+    """
+    Analytic Jacobian of element_residuals with respect to the six elements.
+
+    Returns:
+    - jacobian (np.ndarray): Array of shape (3N + 1, 6).
+    """
+    instrument.count('jacobian_evaluations')
+    _, model_jacobian = ellipse_model_jacobian(elements, context.time, context.mean_motion)
+    jacobian = np.zeros((3 * len(context) + 1, 6))
+    jacobian[:-1] = (context.weights[..., np.newaxis] * model_jacobian).reshape(-1, 6)
+    jacobian[-1, 1] = np.sqrt(beta * np.sum(context.confidence_score_modifiers))
+    return jacobian
+
+@instrument.timed()
+def estimate_elements(context, initial_elements=None, method='trf', expected_eccentricity=EXPECTED_ECCENTRICITY, beta=BETA):
+    """
+    Estimate the six Keplerian orbital elements with a least-squares solver and the analytic Jacobian.
+
+    Parameters:
+    - context (FitContext): Precomputed invariants of the flight path.
+    - initial_elements (array-like): Starting elements. Defaults to the INIT_GUESS_* constants, with the
+      inclination estimated from the flight path.
+    - method (str): One of LEAST_SQUARES_METHODS: 'trf' or 'dogbox' (trust region, with the eccentricity
+      bounded to [0, 1)) or 'lm' (Levenberg-Marquardt, unbounded).
+    - expected_eccentricity (float): Eccentricity the fit is pulled towards.
+    - beta (float): Weight of the eccentricity deviation term.
+
+    Returns:
+    - elements (np.ndarray): Optimized [a, e, incl, omega, Omega, M].
+    - covariance (np.ndarray): Estimated 6x6 covariance of the elements.
+    - result (scipy.optimize.OptimizeResult): Full solver result, including the evaluation counts.
+    """
+    if method not in LEAST_SQUARES_METHODS:
+        raise ValueError(f"Unknown least-squares method {method!r}, expected one of {LEAST_SQUARES_METHODS}.")
+
+    if initial_elements is None:
+        initial_elements = [
+            INIT_GUESS_SEMI_MAJOR,
+            INIT_GUESS_ECCENTRICITY,
+            context.inclination,
+            INIT_GUESS_ORIENTATION,
+            0.0,
+            0.0
+        ]
+    initial_elements = np.asarray(initial_elements, dtype=float)
+
+    # Levenberg-Marquardt doesn't support bounds.
+    bounds = (-np.inf, np.inf)
+    if method != 'lm':
+        bounds = ([0, 0, -np.inf, -np.inf, -np.inf, -np.inf], [np.inf, 1 - 1e-9, np.inf, np.inf, np.inf, np.inf])
+        initial_elements = np.clip(initial_elements, *bounds)
+
+    result = least_squares(
+        element_residuals,
+        initial_elements,
+        jac=element_jacobian,
+        bounds=bounds,
+        method=method,
+        args=(context, expected_eccentricity, beta)
+    )
+
+    # Covariance from the Jacobian at the solution, scaled by the residual variance.
+    degrees_of_freedom = max(len(result.fun) - len(result.x), 1)
+    residual_variance = 2 * result.cost / degrees_of_freedom
+    covariance = residual_variance * np.linalg.pinv(result.jac.T @ result.jac)
+
+    return result.x, covariance, result
+
+def elements_from_plane(normals, periapses, positions, times, eccentricities, mean_motion):
+    """
+    Keplerian elements from the geometry of orbits: their plane, periapsis direction and eccentricity, with the
+    mean anomaly at t = 0 placed so each orbit passes through a given position at a given time.
+
+    Parameters:
+    - normals (np.ndarray): Array of shape (K, 3) of unit normals along the angular momentum.
+    - periapses (np.ndarray): Array of shape (K, 3) of unit vectors towards periapsis, in the plane.
+    - positions (np.ndarray): Array of shape (K, 3) of positions on the orbits.
+    - times (np.ndarray): Array of shape (K,) of the times of the positions.
+    - eccentricities (np.ndarray): Array of shape (K,) of eccentricities.
+    - mean_motion (float): Mean motion (n) in radians per unit time.
+
+    Returns:
+    - elements (np.ndarray): Array of shape (K, 5) of [e, incl, omega, Omega, M].
+    """
+    W, P = np.asarray(normals, dtype=float), np.asarray(periapses, dtype=float)
+    incl = np.arccos(np.clip(W[:, 2], -1.0, 1.0))
+    Omega = np.arctan2(W[:, 0], -W[:, 1])
+    node = np.column_stack((np.cos(Omega), np.sin(Omega), np.zeros(len(Omega))))
+    omega = np.arctan2(np.einsum('ij,ij->i', P, np.cross(W, node)), np.einsum('ij,ij->i', P, node))
+
+    # Mean anomaly at the position, carried back to t = 0.
+    true_anomaly = np.arctan2(np.einsum('ij,ij->i', positions, np.cross(W, P)), np.einsum('ij,ij->i', positions, P))
+    eccentric_anomaly = eccentric_anomaly_from_true(true_anomaly, eccentricities)
+    M = eccentric_anomaly - eccentricities * np.sin(eccentric_anomaly) - mean_motion * np.asarray(times, dtype=float)
+    return np.column_stack((eccentricities, incl, omega, Omega, np.mod(M, 2 * np.pi)))
+
+def gibbs_elements(r1, r2, r3):
+    """
+    Orbit geometry through three position vectors by Gibbs' method, for many triplets at once.
+
+    Only the geometric part of the method is used: the semi-latus rectum p = |N| / |D|, the eccentricity
+    e = |S| / |D| and the orientation of the orbit don't depend on the gravitational parameter, so they hold
+    whatever the units of the positions are.
+
+    Parameters:
+    - r1, r2, r3 (np.ndarray): Arrays of shape (K, 3) of positions, in the order of the motion.
+
+    Returns:
+    - semi_major_axes (np.ndarray): Array of shape (K,). NaN for degenerate (e.g. collinear) triplets.
+    - eccentricities (np.ndarray): Array of shape (K,).
+    - normals (np.ndarray): Array of shape (K, 3) of unit normals along the angular momentum.
+    - periapses (np.ndarray): Array of shape (K, 3) of unit vectors towards periapsis.
+    """
+    norms = [np.linalg.norm(r, axis=1)[:, np.newaxis] for r in (r1, r2, r3)]
+    N = norms[0] * np.cross(r2, r3) + norms[1] * np.cross(r3, r1) + norms[2] * np.cross(r1, r2)
+    D = np.cross(r1, r2) + np.cross(r2, r3) + np.cross(r3, r1)
+    S = r1 * (norms[1] - norms[2]) + r2 * (norms[2] - norms[0]) + r3 * (norms[0] - norms[1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        D_norm = np.linalg.norm(D, axis=1)
+        p = np.linalg.norm(N, axis=1) / D_norm
+        e = np.linalg.norm(S, axis=1) / D_norm
+        W = N / np.linalg.norm(N, axis=1)[:, np.newaxis]
+        # S points 90° ahead of periapsis, so periapsis lies along S x W.
+        P = np.cross(S, W)
+        P /= np.linalg.norm(P, axis=1)[:, np.newaxis]
+        a = np.where(e < 1, p / (1 - e**2), np.nan)
+    return a, e, W, P
+
+def seed_elements(context, phases=MULTI_START_PHASES, triplets=MULTI_START_TRIPLETS):
+    """
+    Cheap analytic candidate elements for the multi-start fit.
+
+    Two families of seeds are generated:
+    - Circular orbits in the best fit plane (pca.fit_planes), with semi-major axes from the observed distances
+      and, when the units are km and s, Kepler's third law, each at a grid of mean anomalies as well as at the
+      one placing it through the observations.
+    - Gibbs' method on triplets of observations spread over the track, a third of a revolution apart where the
+      track is long enough, which also seeds the eccentricity and argument of periapsis.
+
+    Parameters:
+    - context (FitContext): Precomputed invariants of the flight path.
+    - phases (int): Number of mean anomalies tried per plane seed.
+    - triplets (int): Number of Gibbs triplets.
+
+    Returns:
+    - seeds (np.ndarray): Array of shape (S, 6) of finite candidate elements.
+    """
+    positions, times, n = context.positions, context.time, context.mean_motion
+    candidates = []
+
+    # Circular orbits in the best fit plane.
+    plane = fit_planes(positions, [0, len(positions)])
+    normal = plane.normals[0]
+    if np.all(np.isfinite(normal)):
+        radii = np.linalg.norm(positions, axis=1)
+        semi_major_axes = [np.median(radii), 0.5 * (radii.min() + radii.max()), np.cbrt(MU_EARTH / n**2)]
+        # Periapsis at the ascending node (omega = 0), so the phase is the argument of latitude.
+        node = np.cross([0.0, 0.0, 1.0], normal)
+        node = node / np.linalg.norm(node) if np.linalg.norm(node) > 1e-12 else plane.axes[0, 0]
+        _, _, omega, Omega, M = elements_from_plane(
+            np.broadcast_to(normal, positions.shape), np.broadcast_to(node, positions.shape), positions, times,
+            np.zeros(len(positions)), n
+        ).T
+        # Circular mean of the phase over the observations.
+        phase = np.arctan2(np.mean(np.sin(M)), np.mean(np.cos(M)))
+        grid = np.append(phase, phase + np.linspace(0, 2 * np.pi, phases, endpoint=False)[1:])
+        for a in semi_major_axes:
+            candidates.append(np.column_stack((
+                np.full(len(grid), a), np.zeros(len(grid)), np.full(len(grid), plane.inclinations[0]),
+                np.full(len(grid), omega[0]), np.full(len(grid), Omega[0]), grid
+            )))
+
+    # Gibbs triplets, spread over the track and spanning about a third of a revolution when possible.
+    if len(positions) >= 3 and triplets > 0:
+        span = min((times[-1] - times[0]) / 2, context.orbital_period / 3)
+        first = np.flatnonzero(times <= times[-1] - 2 * span)
+        first = first[np.linspace(0, len(first) - 1, min(triplets, len(first))).astype(int)]
+        second = np.searchsorted(times, times[first] + span)
+        third = np.minimum(np.searchsorted(times, times[first] + 2 * span), len(times) - 1)
+        valid = (first < second) & (second < third)
+        first, second, third = first[valid], second[valid], third[valid]
+        a, e, W, P = gibbs_elements(positions[first], positions[second], positions[third])
+        rest = elements_from_plane(W, P, positions[second], times[second], e, n)
+        candidates.append(np.column_stack((a, rest)))
+
+    seeds = np.concatenate(candidates) if candidates else np.empty((0, 6))
+    return seeds[np.all(np.isfinite(seeds), axis=1) & (seeds[:, 0] > 0)]
+
+def element_costs(candidates, context, expected_eccentricity=EXPECTED_ECCENTRICITY, beta=BETA):
+    """
+    Sum of squared element_residuals of many candidate element sets, evaluated in batches through the
+    vectorized ellipse_model rather than one call per candidate.
+
+    Parameters:
+    - candidates (np.ndarray): Array of shape (S, 6) of candidate elements.
+    - context (FitContext): Precomputed invariants of the flight path.
+    - expected_eccentricity (float): Eccentricity the fit is pulled towards.
+    - beta (float): Weight of the eccentricity deviation term.
+
+    Returns:
+    - costs (np.ndarray): Array of shape (S,).
+    """
+    candidates = np.asarray(candidates, dtype=float)
+    instrument.count('objective_evaluations', len(candidates))
+    costs = beta * np.sum(context.confidence_score_modifiers) * (candidates[:, 1] - expected_eccentricity)**2
+    if kernels.JIT:
+        return costs + kernels.weighted_costs(
+            candidates, context.mean_motion, context.time, context.positions, context.confidence_score_modifiers,
+            KEPLER_MAX_ITERATIONS, KEPLER_TOLERANCE
+        )
+
+    chunk = max(MULTI_START_CHUNK // max(len(context), 1), 1)
+    for start in range(0, len(candidates), chunk):
+        model_points = ellipse_model(candidates[start:start + chunk], context.time, context.mean_motion)
+        squared_error = np.sum((model_points - context.positions)**2, axis=-1)
+        costs[start:start + chunk] += squared_error @ context.confidence_score_modifiers
+    return costs
+
+def estimate_elements_multistart(context, method='trf', expected_eccentricity=EXPECTED_ECCENTRICITY, beta=BETA,
+                                 refined=MULTI_START_REFINED, workers=1):
+    """
+    Estimate the six Keplerian orbital elements from several starting points.
+
+    The seeds of seed_elements are scored all at once with element_costs, and only the best few are refined
+    by estimate_elements, optionally in parallel, since a refinement costs as much as scoring hundreds of seeds.
+    This finds the global minimum far more often than more iterations from the single INIT_GUESS_* start.
+
+    Parameters:
+    - context (FitContext): Precomputed invariants of the flight path.
+    - method (str): Least-squares solver, one of LEAST_SQUARES_METHODS.
+    - expected_eccentricity (float): Eccentricity the fit is pulled towards.
+    - beta (float): Weight of the eccentricity deviation term.
+    - refined (int): Number of best seeds refined.
+    - workers (int): Number of processes refining the seeds; 1 refines them in-process.
+
+    Returns:
+    - elements (np.ndarray): Optimized [a, e, incl, omega, Omega, M], the best of the refinements.
+    - covariance (np.ndarray): Estimated 6x6 covariance of the elements.
+    - result (scipy.optimize.OptimizeResult): Solver result of the best refinement.
+    """
+    seeds = seed_elements(context)
+    if len(seeds) == 0:
+        return estimate_elements(context, method=method, expected_eccentricity=expected_eccentricity, beta=beta)
+
+    seeds = seeds[np.argsort(element_costs(seeds, context, expected_eccentricity, beta))[:refined]]
+    refine = functools.partial(
+        estimate_elements, context, method=method, expected_eccentricity=expected_eccentricity, beta=beta
+    )
+    return min(_refine_seeds(refine, seeds, workers), key=lambda fit: fit[2].cost)
+
+@instrument.timed()
+def fit_elements_to_flight_path(flight_path, method='trf', proximity_threshold_mod=PROXIMITY_THRESHOLD_MOD,
+                                multi_start=True, workers=1):
+    """
+    Fit the six Keplerian orbital elements to the flight path.
+
+    Parameters:
+    - flight_path (FlightPath or list of dict): Flight path data.
+    - method (str): Least-squares solver, one of LEAST_SQUARES_METHODS.
+    - proximity_threshold_mod (float): Proximity threshold mod used to estimate the orbital period.
+    - multi_start (bool): Fit from the best analytic seeds (estimate_elements_multistart). False fits from the
+      INIT_GUESS_* constants, which often converges to a wrong minimum (a off by thousands of km).
+    - workers (int): Number of processes refining the seeds of the multi-start fit.
+
+    Returns:
+    - elements (np.ndarray): Optimized [a, e, incl, omega, Omega, M].
+    - covariance (np.ndarray): Estimated 6x6 covariance of the elements.
+    - total_error (float): Weighted sum of squared residuals at the solution.
+    """
+    # Preprocess flight path data
+    normalized_flight_path, confidence_score_modifiers = preprocess_data(flight_path)
+    context = FitContext(normalized_flight_path, confidence_score_modifiers, proximity_threshold_mod)
+
+    # Estimate orbital elements
+    if multi_start:
+        elements, covariance, result = estimate_elements_multistart(context, method=method, workers=workers)
+    else:
+        elements, covariance, result = estimate_elements(context, method=method)
+
+    return elements, covariance, 2 * result.cost
+
 # Main function
 if __name__ == "__main__":
     # Sample flight path data
@@ -0,0 +1,219 @@
+import numpy as np
+import kernels
+from collections import OrderedDict
+from typing import Optional
+from ellipse import ellipse_model, mean_motion
+
+# Chebyshev ephemeris settings.
+EPHEMERIS_DEGREE = 12 # Degree of the polynomial of every segment, per coordinate.
+EPHEMERIS_TOLERANCE = 1e-3 # Bound on the interpolation error of a position, in km.
+EPHEMERIS_MEMORY = 256 << 20 # Bytes of coefficients kept before the least recently used spans are evicted.
+SPAN_SEGMENTS = 16 # Segments per span, the unit of fitting and eviction.
+CALIBRATION_ROUNDS = 30 # Halvings of the segment length tried to meet the tolerance.
+CALIBRATION_SAMPLES = 64 # Points per segment at which the interpolation error is measured.
+CALIBRATION_MARGIN = 0.5 # Share of the tolerance allowed on the calibration segment, for segments elsewhere.
+
+def chebyshev_nodes(degree: int) -> np.ndarray:
+    """
+    Chebyshev points of the first kind on [-1, 1], the degree + 1 nodes of the interpolating polynomial.
+    """
+    return np.cos(np.pi * (np.arange(degree + 1) + 0.5) / (degree + 1))
+
+def chebyshev_coefficients(values: np.ndarray) -> np.ndarray:
+    """
+    Coefficients of the polynomials interpolating values at chebyshev_nodes, along axis -2.
+
+    Args:
+        values (np.ndarray): Array of shape (..., degree + 1, d) of values at the nodes.
+
+    Returns:
+        np.ndarray: Array of the same shape of coefficients c_j of T_j.
+    """
+    n = values.shape[-2]
+    # Discrete cosine transform: c_j = 2 / n * sum_k f(x_k) T_j(x_k), with c_0 halved.
+    transform = np.cos(np.pi * np.outer(np.arange(n), np.arange(n) + 0.5) / n) * (2 / n)
+    transform[0] /= 2
+    return np.einsum('jk,...kd->...jd', transform, values)
+
+def clenshaw(coefficients: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """
+    Evaluate Chebyshev series by Clenshaw's recurrence, one series per point.
+
+    Args:
+        coefficients (np.ndarray): Array of shape (Q, degree + 1, d).
+        x (np.ndarray): Array of shape (Q,) of points in [-1, 1].
+
+    Returns:
+        np.ndarray: Array of shape (Q, d).
+    """
+    x = x[:, np.newaxis]
+    twice_x = 2 * x
+    b1 = np.zeros((coefficients.shape[0], coefficients.shape[2]))
+    b2 = np.zeros_like(b1)
+    for j in range(coefficients.shape[1] - 1, 0, -1):
+        # b1 <- 2x b1 - b2 + c_j, in place.
+        b = twice_x * b1
+        b -= b2
+        b += coefficients[:, j]
+        b1, b2 = b, b1
+    return x * b1 - b2 + coefficients[:, 0]
+
+class EphemerisCache:
+    """
+    Piecewise Chebyshev ephemerides of a catalog, answering batched position lookups without the Kepler chain.
+
+    Every object's time axis is cut into segments of a fixed length, calibrated per object so that the
+    interpolation error stays below the tolerance even around periapsis, where the motion bends fastest.
+    SPAN_SEGMENTS consecutive segments make a span, fitted on first use from ellipse_model at the Chebyshev
+    nodes. The coefficients of all spans live in one contiguous pool of blocks, found through a
+    (object, span) -> block index, so a lookup is a few arithmetic operations plus a Clenshaw evaluation
+    whatever the time. When the pool is full the least recently used span is evicted and its block reused.
+    """
+    __slots__ = (
+        'elements', 'mean_motions', 'degree', 'tolerance', 'segment_lengths', 'error_bounds', 'pool', 'index',
+        'free', 'hits', 'misses', '_nodes'
+    )
+
+    def __init__(self, elements: np.ndarray, mean_motions: Optional[np.ndarray] = None,
+                 degree: int = EPHEMERIS_DEGREE, tolerance: float = EPHEMERIS_TOLERANCE,
+                 max_bytes: int = EPHEMERIS_MEMORY):
+        """
+        Args:
+            elements (np.ndarray): Elements [a, e, incl, omega, Omega, M] of shape (K, 6), with M at t = 0.
+            mean_motions (Optional[np.ndarray]): Mean motions of shape (K,), in radians per second. Defaults
+                to Kepler's third law (ellipse.mean_motion).
+            degree (int): Degree of the polynomials.
+            tolerance (float): Bound on the interpolation error of a position, in the units of a.
+            max_bytes (int): Memory cap of the coefficient pool.
+        """
+        self.elements = np.asarray(elements, dtype=float).reshape(-1, 6)
+        self.mean_motions = mean_motion(self.elements[:, 0]) if mean_motions is None \
+            else np.broadcast_to(np.asarray(mean_motions, dtype=float), len(self.elements)).copy()
+        self.degree = degree
+        self.tolerance = tolerance
+        self._nodes = chebyshev_nodes(degree)
+        self.segment_lengths, self.error_bounds = self._calibrate()
+
+        block_bytes = SPAN_SEGMENTS * (degree + 1) * 3 * 8
+        self.pool = np.empty((max(max_bytes // block_bytes, 1), SPAN_SEGMENTS, degree + 1, 3))
+        self.index = OrderedDict() # span * K + object -> block, least recently used first.
+        self.free = list(range(len(self.pool) - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.elements)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Bytes of coefficients in use.
+        """
+        return len(self.index) * self.pool[0].nbytes
+
+    def _fit(self, objects: np.ndarray, starts: np.ndarray, lengths: np.ndarray, n_segments: int) -> np.ndarray:
+        # Coefficients of n_segments consecutive segments of the given objects from the given start times:
+        # ellipse_model at the nodes of every segment, in one batch.
+        midpoints = starts[:, np.newaxis] + lengths[:, np.newaxis] * (np.arange(n_segments) + 0.5)
+        times = (midpoints[..., np.newaxis] + lengths[:, np.newaxis, np.newaxis] / 2 * self._nodes).reshape(len(objects), -1)
+        values = ellipse_model(self.elements[objects], times, self.mean_motions[objects])
+        return chebyshev_coefficients(values.reshape(len(objects), n_segments, self.degree + 1, 3))
+
+    def _calibrate(self):
+        # Longest segment length (at most a revolution) meeting the tolerance on a segment centered
+        # on periapsis, found by halving; returns the lengths and the errors measured with them.
+        period = 2 * np.pi / self.mean_motions
+        lengths = period.copy()
+        errors = np.full(len(self), np.inf)
+        # Time of a periapsis passage (M = 0) of every object.
+        periapsis = np.mod(-self.elements[:, 5], 2 * np.pi) / self.mean_motions
+        samples = np.linspace(-1, 1, CALIBRATION_SAMPLES)
+        pending = np.arange(len(self))
+        for _ in range(CALIBRATION_ROUNDS):
+            if len(pending) == 0:
+                break
+            starts = periapsis[pending] - lengths[pending] / 2
+            coefficients = self._fit(pending, starts, lengths[pending], 1)[:, 0]
+            times = periapsis[pending, np.newaxis] + lengths[pending, np.newaxis] / 2 * samples
+            exact = ellipse_model(self.elements[pending], times, self.mean_motions[pending])
+            approximate = clenshaw(
+                np.repeat(coefficients, len(samples), axis=0), np.tile(samples, len(pending))
+            ).reshape(exact.shape)
+            errors[pending] = np.max(np.linalg.norm(approximate - exact, axis=-1), axis=1)
+            failed = errors[pending] > CALIBRATION_MARGIN * self.tolerance
+            lengths[pending[failed]] /= 2
+            pending = pending[failed]
+        return lengths, errors
+
+    def positions(self, object_ids: np.ndarray, times: np.ndarray) -> np.ndarray:
+        """
+        Positions of objects at times, for a batch of (object, time) queries.
+
+        Args:
+            object_ids (np.ndarray): Indices of the objects in the catalog, shape (Q,).
+            times (np.ndarray): Times of shape (Q,), or a scalar for every query.
+
+        Returns:
+            np.ndarray: Array of shape (Q, 3).
+        """
+        object_ids, times = np.broadcast_arrays(np.asarray(object_ids, dtype=np.int64), np.asarray(times, dtype=float))
+        object_ids, times = object_ids.ravel(), times.ravel()
+
+        # Segment of every query, and the span it belongs to.
+        lengths = self.segment_lengths[object_ids]
+        segments = np.floor(times / lengths).astype(np.int64)
+        spans = np.floor_divide(segments, SPAN_SEGMENTS)
+        x = 2 * (times / lengths - segments) - 1
+
+        # Block of every distinct span, fitting the missing ones. The spans are handled in groups no larger
+        # than the pool, so eviction never drops a span still needed by the group.
+        keys, inverse = np.unique(spans * len(self) + object_ids, return_inverse=True)
+        positions = np.empty((len(times), 3))
+        for start in range(0, len(keys), len(self.pool)):
+            group = keys[start:start + len(self.pool)]
+            blocks = self._blocks(group)
+            selected = np.flatnonzero((inverse >= start) & (inverse < start + len(group)))
+            # Row of every query's segment in the pool, seen as one flat table of segments.
+            rows = blocks[inverse[selected] - start] * SPAN_SEGMENTS + segments[selected] - spans[selected] * SPAN_SEGMENTS
+            table = self.pool.reshape(-1, self.degree + 1, 3)
+            if kernels.JIT:
+                positions[selected] = kernels.chebyshev_lookup(table, rows, x[selected])
+            else:
+                positions[selected] = clenshaw(np.take(table, rows, axis=0), x[selected])
+        return positions
+
+    def _blocks(self, keys: np.ndarray) -> np.ndarray:
+        # Pool blocks of span keys (span * K + object), fitting the spans not cached yet into free or evicted
+        # blocks.
+        blocks = np.empty(len(keys), dtype=np.int64)
+        missing = []
+        for i, key in enumerate(keys.tolist()):
+            block = self.index.get(key)
+            if block is None:
+                missing.append(i)
+            else:
+                self.index.move_to_end(key)
+                blocks[i] = block
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if not missing:
+            return blocks
+
+        for i in missing:
+            if not self.free:
+                _, block = self.index.popitem(last=False)
+                self.free.append(block)
+            blocks[i] = self.free.pop()
+            self.index[int(keys[i])] = blocks[i]
+
+        spans, objects = np.divmod(keys[missing], len(self))
+        lengths = self.segment_lengths[objects]
+        self.pool[blocks[missing]] = self._fit(objects, spans * SPAN_SEGMENTS * lengths, lengths, SPAN_SEGMENTS)
+        return blocks
+
+    def clear(self) -> None:
+        """
+        Evict every span.
+        """
+        self.index.clear()
+        self.free = list(range(len(self.pool) - 1, -1, -1))
@@ -0,0 +1,121 @@
+import numpy as np
+from typing import Iterable, Iterator, List, Tuple, Union
+
+# Columns of a flight path, in storage order: coordinates (x, y, z), speed (s), time (t) and confidence score (C).
+FIELDS = ('x', 'y', 'z', 's', 't', 'C')
+
+class FlightPath:
+    """
+    Columnar flight path: one contiguous float64 row per field (see FIELDS) in a single (6, N) array.
+
+    Column properties and slices are views into that array, so passing a FlightPath between stages never
+    copies or rebuilds the observations. Indexing with an integer returns the legacy {'x', 'y', 'z', 's', 't', 'C'}
+    dict for that point, and iterating yields those dicts, so code written for lists of dicts keeps working.
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values: np.ndarray):
+        """
+        Args:
+            values (np.ndarray): Array of shape (6, N) holding the columns in FIELDS order.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 2 or values.shape[0] != len(FIELDS):
+            raise ValueError(f"Expected an array of shape ({len(FIELDS)}, N), got {values.shape}.")
+        self.values = values
+
+    @classmethod
+    def from_columns(cls, x, y, z, s=0.0, t=0.0, C=1.0) -> 'FlightPath':
+        """
+        Build a flight path from column arrays. Scalar speed, time or confidence are broadcast to every point.
+        """
+        x = np.asarray(x, dtype=float)
+        values = np.empty((len(FIELDS), len(x)))
+        for row, column in zip(values, (x, y, z, s, t, C)):
+            row[:] = column
+        return cls(values)
+
+    @classmethod
+    def from_dicts(cls, flight_path: Iterable[dict]) -> 'FlightPath':
+        """
+        Build a flight path from a list of {'x', 'y', 'z', 's', 't', 'C'} dicts. Missing speeds and times default
+        to 0 and missing confidence scores to 1.
+        """
+        flight_path = list(flight_path)
+        defaults = {'s': 0.0, 't': 0.0, 'C': 1.0}
+        values = np.empty((len(FIELDS), len(flight_path)))
+        for row, field in zip(values, FIELDS):
+            if field in defaults:
+                row[:] = np.fromiter((point.get(field, defaults[field]) for point in flight_path), float, len(flight_path))
+            else:
+                row[:] = np.fromiter((point[field] for point in flight_path), float, len(flight_path))
+        return cls(values)
+
+    @classmethod
+    def from_tuples(cls, flight_path: Iterable[Tuple[float, float, float, float, float, float]]) -> 'FlightPath':
+        """
+        Build a flight path from the (x, y, z, s, C, t) tuples produced by cloud.cloud.
+        """
+        x, y, z, s, C, t = np.array(list(flight_path), dtype=float).reshape(-1, 6).T
+        return cls.from_columns(x, y, z, s, t, C)
+
+    def to_dicts(self) -> List[dict]:
+        """
+        Convert to the legacy list of {'x', 'y', 'z', 's', 't', 'C'} dicts.
+        """
+        return [dict(zip(FIELDS, row)) for row in self.values.T.tolist()]
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.values[0]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.values[1]
+
+    @property
+    def z(self) -> np.ndarray:
+        return self.values[2]
+
+    @property
+    def s(self) -> np.ndarray:
+        return self.values[3]
+
+    @property
+    def t(self) -> np.ndarray:
+        return self.values[4]
+
+    @property
+    def C(self) -> np.ndarray:
+        return self.values[5]
+
+    @property
+    def positions(self) -> np.ndarray:
+        """
+        View of the coordinates as an array of shape (N, 3).
+        """
+        return self.values[:3].T
+
+    def __len__(self) -> int:
+        return self.values.shape[1]
+
+    def __getitem__(self, index) -> Union['FlightPath', dict]:
+        # Integer index: a single point in the legacy dict format.
+        if isinstance(index, (int, np.integer)):
+            return dict(zip(FIELDS, self.values[:, index].tolist()))
+        # Slices give views; masks and index arrays give copies, as with any NumPy array.
+        return FlightPath(self.values[:, index])
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.to_dicts())
+
+    def __repr__(self) -> str:
+        return f"FlightPath({len(self)} points)"
+
+def as_flight_path(flight_path: Union[FlightPath, Iterable[dict]]) -> FlightPath:
+    """
+    Return the flight path as a FlightPath, converting from a list of dicts if needed.
+    """
+    if isinstance(flight_path, FlightPath):
+        return flight_path
+    return FlightPath.from_dicts(flight_path)
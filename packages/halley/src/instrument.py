@@ -0,0 +1,319 @@
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Union
+
+# Opt-in profiling of the halley stages: wall time and peak resident memory per stage, and counters of the work
+# done (objective evaluations, Kepler iterations, KD-tree builds and queries, association candidates, ICP
+# iterations).
+#
+# Nothing is recorded unless a Profiler is active (see profile_batch). Until then stage() returns a shared no-op
+# context manager, timed functions call straight through and count() returns at once, so the instrumented code
+# only pays one global lookup per call site. Call sites whose count itself costs something (e.g. a reduction
+# over an array) check active() first. Only the calling process is profiled: work done in the process
+# pools of batch.fit_many or the multi-start fits isn't counted, nor are the Kepler iterations of the compiled
+# kernels (kernels.JIT), which don't report them.
+#
+# Usage:
+#     with profile_batch('batch-0042.json', labels={'batch': '42'}) as profiler:
+#         flight_paths = cloud(images)
+#     print(profiler.to_prometheus())
+
+MEMORY_INTERVAL = 0.01 # Seconds between samples of the resident memory while profiling; 0 samples at stage boundaries only.
+METRIC_PREFIX = 'halley' # Prefix of the Prometheus metric names.
+PROMETHEUS_SUFFIXES = ('.prom', '.txt') # Report files written in the Prometheus text format rather than JSON.
+
+# Profiler recording the current run, if any.
+_active = None
+
+# Stage of every call while profiling is off; nullcontext is reentrant, so one instance serves them all.
+_NO_STAGE = contextlib.nullcontext()
+
+def resident_memory() -> int:
+    """
+    Resident memory of the process in bytes, from /proc where available, else its peak so far from getrusage
+    (0 where neither is available).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+class StageStats:
+    """
+    Accumulated measurements of one stage.
+    """
+    __slots__ = ('calls', 'total', 'minimum', 'maximum', 'peak_memory')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0 # Wall time of all calls, in seconds.
+        self.minimum = float('inf')
+        self.maximum = 0.0
+        self.peak_memory = 0 # Highest resident memory seen during a call, in bytes.
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.calls if self.calls else 0.0,
+            'min_seconds': self.minimum if self.calls else 0.0,
+            'max_seconds': self.maximum,
+            'peak_memory_bytes': self.peak_memory
+        }
+
+class _Stage:
+    # One timed call of a stage.
+    __slots__ = ('profiler', 'name', 'start', 'peak')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.peak = resident_memory()
+        with self.profiler._lock:
+            self.profiler._open.add(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        elapsed = time.perf_counter() - self.start
+        memory = resident_memory()
+        profiler = self.profiler
+        with profiler._lock:
+            profiler._open.discard(self)
+            stats = profiler.stages.get(self.name)
+            if stats is None:
+                stats = profiler.stages[self.name] = StageStats()
+            stats.calls += 1
+            stats.total += elapsed
+            stats.minimum = min(stats.minimum, elapsed)
+            stats.maximum = max(stats.maximum, elapsed)
+            stats.peak_memory = max(stats.peak_memory, self.peak, memory)
+            profiler.peak_memory = max(profiler.peak_memory, memory)
+        return False
+
+class Profiler:
+    """
+    Stage timers, counters and peak memory of a run, recorded while it is active (as a context manager).
+
+    A background thread samples the resident memory every memory_interval seconds, so the peak of a stage
+    includes its temporaries and not only the memory left when it returns. Profilers nest: entering one makes it
+    the active profiler until it exits, when the previous one is restored.
+    """
+    __slots__ = (
+        'stages', 'counters', 'labels', 'memory_interval', 'peak_memory', 'wall_time', '_open', '_lock',
+        '_previous', '_start', '_stop', '_sampler'
+    )
+
+    def __init__(self, memory_interval: float = MEMORY_INTERVAL, labels: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            memory_interval (float): Seconds between memory samples; 0 disables the sampling thread.
+            labels (Optional[Dict[str, str]]): Labels of the run (e.g. the batch), added to every exported metric.
+        """
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.labels = dict(labels or {})
+        self.memory_interval = memory_interval
+        self.peak_memory = 0
+        self.wall_time = 0.0
+        self._open = set()
+        self._lock = threading.Lock()
+        self._previous = None
+        self._stop = None
+        self._sampler = None
+
+    def __enter__(self) -> 'Profiler':
+        global _active
+        self._previous, _active = _active, self
+        self.peak_memory = max(self.peak_memory, resident_memory())
+        if self.memory_interval > 0:
+            self._stop = threading.Event()
+            self._sampler = threading.Thread(target=self._sample, name='halley-memory-sampler', daemon=True)
+            self._sampler.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        global _active
+        self.wall_time += time.perf_counter() - self._start
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        self.peak_memory = max(self.peak_memory, resident_memory())
+        _active, self._previous = self._previous, None
+        return False
+
+    def _sample(self):
+        # Body of the sampling thread.
+        while not self._stop.wait(self.memory_interval):
+            memory = resident_memory()
+            with self._lock:
+                self.peak_memory = max(self.peak_memory, memory)
+                for stage in self._open:
+                    stage.peak = max(stage.peak, memory)
+
+    def stage(self, name: str) -> _Stage:
+        """
+        Context manager timing one call of a stage.
+        """
+        return _Stage(self, name)
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Add value to a counter.
+        """
+        value = int(value)
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        """
+        Everything recorded, as a JSON-serializable dictionary.
+        """
+        with self._lock:
+            return {
+                'labels': dict(self.labels),
+                'wall_seconds': self.wall_time,
+                'peak_memory_bytes': self.peak_memory,
+                'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+                'counters': dict(self.counters)
+            }
+
+    def to_json(self, path: Optional[Union[str, Path]] = None) -> str:
+        """
+        The report as JSON, also written to path if given.
+        """
+        text = json.dumps(self.report(), indent=2)
+        if path is not None:
+            Path(path).write_text(text + '\n')
+        return text
+
+    def to_prometheus(self, path: Optional[Union[str, Path]] = None, prefix: str = METRIC_PREFIX) -> str:
+        """
+        The report in the Prometheus text exposition format, also written to path if given (e.g. for the
+        textfile collector of the node exporter).
+        """
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, description, samples):
+            name = _metric_name(f'{prefix}_{name}')
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels({**report["labels"], **labels})} {value}')
+
+        stages = report['stages']
+        metric('stage_seconds_total', 'counter', 'Wall time spent in a stage.',
+               [({'stage': name}, stats['total_seconds']) for name, stats in stages.items()])
+        metric('stage_calls_total', 'counter', 'Calls of a stage.',
+               [({'stage': name}, stats['calls']) for name, stats in stages.items()])
+        metric('stage_max_seconds', 'gauge', 'Longest call of a stage.',
+               [({'stage': name}, stats['max_seconds']) for name, stats in stages.items()])
+        metric('stage_peak_memory_bytes', 'gauge', 'Peak resident memory during a stage.',
+               [({'stage': name}, stats['peak_memory_bytes']) for name, stats in stages.items()])
+        for name, value in report['counters'].items():
+            metric(f'{name}_total', 'counter', f'Count of {name.replace("_", " ")}.', [({}, value)])
+        metric('wall_seconds', 'gauge', 'Wall time of the profiled run.', [({}, report['wall_seconds'])])
+        metric('peak_memory_bytes', 'gauge', 'Peak resident memory of the profiled run.',
+               [({}, report['peak_memory_bytes'])])
+
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            Path(path).write_text(text)
+        return text
+
+def _metric_name(name: str) -> str:
+    # Prometheus metric names match [a-zA-Z_:][a-zA-Z0-9_:]*.
+    name = re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+    return name if re.match(r'[a-zA-Z_:]', name) else '_' + name
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{_metric_name(key)}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+def active() -> Optional[Profiler]:
+    """
+    The active profiler, None when profiling is off.
+    """
+    return _active
+
+def stage(name: str):
+    """
+    Context manager timing a stage with the active profiler, a no-op when profiling is off.
+    """
+    profiler = _active
+    if profiler is None:
+        return _NO_STAGE
+    return profiler.stage(name)
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Add value to a counter of the active profiler, a no-op when profiling is off.
+    """
+    profiler = _active
+    if profiler is not None:
+        profiler.count(name, value)
+
+def timed(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """
+    Decorator timing every call of a function as a stage, named after the function unless name is given.
+    """
+    def decorate(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return function(*args, **kwargs)
+            with profiler.stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@contextlib.contextmanager
+def profile_batch(path: Optional[Union[str, Path]] = None, labels: Optional[Dict[str, str]] = None,
+                  memory_interval: float = MEMORY_INTERVAL) -> Iterator[Profiler]:
+    """
+    Profile a batch of work, writing its report to path when it ends (even if it raised).
+
+    Args:
+        path (Optional[Union[str, Path]]): Report file: Prometheus text for the PROMETHEUS_SUFFIXES, JSON
+            otherwise. None only keeps the report on the yielded profiler.
+        labels (Optional[Dict[str, str]]): Labels of the batch, e.g. {'batch': '42'}.
+        memory_interval (float): Seconds between memory samples.
+
+    Yields:
+        Profiler: The profiler recording the batch.
+    """
+    profiler = Profiler(memory_interval, labels)
+    try:
+        with profiler:
+            yield profiler
+    finally:
+        if path is not None:
+            if Path(path).suffix in PROMETHEUS_SUFFIXES:
+                profiler.to_prometheus(path)
+            else:
+                profiler.to_json(path)
@@ -1,4 +1,202 @@
 # Generate sample data, use point cloud registration to label and produce flight paths,
 # then non-linear regression to best fit an ellipse, and finally produce a visual plot of the
 # path collection.
-# At each step the dataset should be saved to a static filepath (overwrite, use pickle).
+# Every stage is checkpointed by stage.Pipeline: its arrays are saved as .npy files under a key hashing its
+# code, parameters and inputs, so re-running only recomputes the stages downstream of what changed.
+#
+# Usage: python main.py --objects 100 --frames 500 --parity 60 --seed 0
+
+import argparse
+import functools
+import numpy as np
+import batch
+import cloud
+import ellipse
+import flightpath
+import kernels
+import pca
+import propagate
+import sample
+import stream
+import track
+from batch import fit_many
+from ellipse import fit_elements_to_flight_path
+from flightpath import FlightPath
+from sample import CatalogChunk, generate_catalog, generate_images
+from stage import Pipeline
+from track import TrackStore
+
+def generate_stage(n_objects: int, n_frames: int, parity: float, dropout: float, noise: float, seed: int,
+                   chunk_size: int) -> dict:
+    """
+    Generate a synthetic catalog with velocities, observed every parity seconds.
+    """
+    chunks = list(generate_catalog(
+        n_objects, np.arange(n_frames) * parity, dropout=dropout, noise=noise, seed=seed, chunk_size=chunk_size,
+        velocities=True
+    ))
+    return {
+        'object_ids': np.concatenate([chunk.object_ids for chunk in chunks]),
+        'elements': np.concatenate([chunk.elements for chunk in chunks]),
+        'timestamps': chunks[0].timestamps,
+        'positions': np.concatenate([chunk.positions for chunk in chunks]),
+        'velocities': np.concatenate([chunk.velocities for chunk in chunks])
+    }
+
+def associate_stage(catalog: dict, window: int, tolerance: float, workers: int) -> dict:
+    """
+    Stream the catalog's images through a TrackStore, labelling every detection with a track ID.
+    """
+    chunk = CatalogChunk(**{field: np.asarray(catalog[field]) for field in CatalogChunk._fields})
+    store = TrackStore(window=window, tolerance=tolerance, workers=workers)
+    for _ in store.stream(generate_images(chunk)):
+        pass
+
+    # Object of every detection, in the order the images list their points.
+    observed = ~np.isnan(chunk.positions[:, :, 0])
+    object_ids = [chunk.object_ids[observed[:, i]] for i in range(len(chunk.timestamps))]
+
+    track_ids, detections = store.detections()
+    return {
+        'track_ids': track_ids,
+        'object_ids': np.concatenate(object_ids) if object_ids else np.empty(0, dtype=np.int64),
+        'detections': detections,
+        'tracks_started': store.next_track_id
+    }
+
+def tracks_stage(associations: dict, min_length: int) -> dict:
+    """
+    Group the detections per track, in time order, keeping tracks with at least min_length detections.
+    """
+    order = np.argsort(associations['track_ids'], kind='stable')
+    ids = np.asarray(associations['track_ids'])[order]
+    values = np.asarray(associations['detections'])[:, order]
+    object_ids = np.asarray(associations['object_ids'])[order]
+
+    track_ids, counts = np.unique(ids, return_counts=True)
+    kept = counts >= min_length
+    selected = np.repeat(kept, counts)
+    object_ids = object_ids[selected]
+
+    offsets = np.zeros(np.count_nonzero(kept) + 1, dtype=np.int64)
+    np.cumsum(counts[kept], out=offsets[1:])
+
+    # Majority object of every track and the share of its detections belonging to it.
+    labels = np.empty(len(offsets) - 1, dtype=np.int64)
+    purity = np.empty(len(offsets) - 1)
+    for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        objects, votes = np.unique(object_ids[start:end], return_counts=True)
+        labels[i] = objects[votes.argmax()]
+        purity[i] = votes.max() / (end - start)
+
+    return {
+        'track_ids': track_ids[kept],
+        'values': values[:, selected],
+        'offsets': offsets,
+        'labels': labels,
+        'purity': purity
+    }
+
+def fit_stage(tracks: dict, method: str, proximity_threshold_mod: float, multi_start: bool, workers: int) -> dict:
+    """
+    Fit the six orbital elements of every track across a process pool.
+
+    A proximity_threshold_mod of 0 uses the median distance between consecutive detections of the tracks.
+    """
+    values, offsets = np.asarray(tracks['values']), np.asarray(tracks['offsets'])
+    if not proximity_threshold_mod:
+        steps = np.linalg.norm(np.diff(values[:3], axis=1), axis=0)
+        within = np.ones(len(steps), dtype=bool)
+        within[offsets[1:-1] - 1] = False
+        proximity_threshold_mod = float(np.median(steps[within])) if within.any() else 1.0
+
+    fit = functools.partial(
+        fit_elements_to_flight_path, method=method, proximity_threshold_mod=proximity_threshold_mod,
+        multi_start=multi_start
+    )
+    outcomes = fit_many(
+        [FlightPath(values[:, start:end]) for start, end in zip(offsets[:-1], offsets[1:])],
+        workers=workers,
+        fit=fit
+    )
+
+    failed = np.array([outcome.result is None for outcome in outcomes], dtype=bool)
+    elements = np.full((len(outcomes), 6), np.nan)
+    covariances = np.full((len(outcomes), 6, 6), np.nan)
+    errors = np.full(len(outcomes), np.nan)
+    for i, outcome in enumerate(outcomes):
+        if outcome.result is not None:
+            elements[i], covariances[i], errors[i] = outcome.result
+
+    return {
+        'elements': elements,
+        'covariances': covariances,
+        'errors': errors,
+        'failed': failed,
+        'proximity_threshold_mod': proximity_threshold_mod
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the halley pipeline on synthetic data, with checkpoints.')
+    parser.add_argument('--objects', type=int, default=100, help='Number of objects.')
+    parser.add_argument('--frames', type=int, default=500, help='Number of frames.')
+    parser.add_argument('--parity', type=float, default=60.0, help='Seconds between frames.')
+    parser.add_argument('--dropout', type=float, default=0.0, help='Drop out rate.')
+    parser.add_argument('--noise', type=float, default=0.0, help='Position noise in km.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalog.')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Objects generated per chunk.')
+    parser.add_argument('--window', type=int, default=4, help='Frames kept for association.')
+    parser.add_argument(
+        '--tolerance', type=float, default=50.0,
+        help='Association tolerance in km; must cover the prediction error over the gaps between detections.'
+    )
+    parser.add_argument('--min-length', type=int, default=10, help='Minimum detections of a fitted track.')
+    parser.add_argument('--method', default='trf', help='Least-squares method of the fit.')
+    parser.add_argument('--proximity', type=float, default=0.0, help='Proximity threshold of the period estimate.')
+    parser.add_argument(
+        '--multi-start', action=argparse.BooleanOptionalAction, default=True,
+        help='Fit from the best of several analytic seeds; --no-multi-start fits from the fixed initial guess.'
+    )
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes of the fit.')
+    parser.add_argument('--force', nargs='*', default=(), help='Stages to recompute even if checkpointed.')
+    parser.add_argument('--render', default=None, help='Image file to render the fitted catalog overview to.')
+    args = parser.parse_args()
+
+    pipeline = Pipeline(force=args.force)
+    catalog = pipeline.run(
+        'generate', generate_stage, depends=(
+            sample, propagate, kernels, ellipse.solve_kepler, ellipse.orbital_plane_basis, ellipse.mean_motion
+        ),
+        n_objects=args.objects, n_frames=args.frames, parity=args.parity, dropout=args.dropout, noise=args.noise,
+        seed=args.seed, chunk_size=args.chunk_size
+    )
+    associations = pipeline.run(
+        'associate', associate_stage, catalog, depends=(cloud, stream, track, sample.generate_images),
+        window=args.window, tolerance=args.tolerance, settings={'workers': args.workers or 1}
+    )
+    tracks = pipeline.run('tracks', tracks_stage, associations, min_length=args.min_length)
+    if len(tracks['offsets']) == 1:
+        raise SystemExit(
+            f"No track reached --min-length {args.min_length} ({associations.metadata['tracks_started']} started): "
+            f"the association tolerance of {args.tolerance} km is likely too tight for --parity {args.parity} s."
+        )
+    fits = pipeline.run(
+        'fit', fit_stage, tracks, depends=(ellipse, batch, pca, kernels, flightpath),
+        method=args.method, proximity_threshold_mod=args.proximity, multi_start=args.multi_start, settings={'workers': args.workers}
+    )
+
+    print(f"{len(tracks['offsets']) - 1} tracks of {associations.metadata['tracks_started']} started, "
+          f"mean purity {np.mean(tracks['purity']):.3f}, {int(np.sum(fits['failed']))} failed fits.")
+
+    if args.render:
+        # Imported here, so that matplotlib is only needed when rendering.
+        from visual import render_catalog
+        render_catalog(
+            args.render,
+            elements=np.asarray(fits['elements'])[~np.asarray(fits['failed'])],
+            points=np.asarray(tracks['values'])[:3].T,
+            title=f"{len(tracks['offsets']) - 1} tracks"
+        )
+
+if __name__ == "__main__":
+    main()
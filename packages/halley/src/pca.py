@@ -1,5 +1,112 @@
 import numpy as np
-from sklearn.decomposition import PCA
+from typing import NamedTuple
+
+class PlaneFit(NamedTuple):
+    """
+    Principal component fit of K tracks, as arrays with one entry per track.
+    """
+    centroids: np.ndarray # Shape (K, 3): mean of the points.
+    covariances: np.ndarray # Shape (K, 3, 3): sample covariance of the points.
+    variances: np.ndarray # Shape (K, 3): variance along each principal axis, in decreasing order.
+    axes: np.ndarray # Shape (K, 3, 3): unit principal axes as rows, in decreasing order of variance.
+    normals: np.ndarray # Shape (K, 3): unit normal of the best fit plane, along the angular momentum.
+    inclinations: np.ndarray # Shape (K,): angle between the normal and the z axis, in radians.
+
+def fit_planes(positions, offsets):
+    """
+    Fit the best fit plane of many tracks at once, by principal component analysis.
+
+    The tracks are given in ragged form: all points concatenated, with track k being
+    positions[offsets[k]:offsets[k + 1]] (see batch.pack_flight_paths). Centroids and covariances come from
+    segmented sums over the points, and the principal axes from one stacked eigendecomposition of the 3x3
+    covariances. The normal is oriented along the angular momentum of the points taken in order, so the
+    inclination distinguishes prograde from retrograde orbits.
+
+    Parameters:
+        positions (np.ndarray): Array of shape (N, 3) holding the points of every track, each track in time order.
+        offsets (np.ndarray): Array of shape (K + 1,) of track boundaries.
+
+    Returns:
+        PlaneFit: Plane parameters of every track. Tracks with fewer than two points get NaN.
+    """
+    positions = np.asarray(positions, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    counts = np.diff(offsets)
+    n_tracks = len(counts)
+    valid = counts >= 2
+    starts = offsets[:-1][valid]
+    # Segments of reduceat run from one start to the next, so sums are taken over every non-empty track.
+    nonempty = counts > 0
+    segments = offsets[:-1][nonempty]
+    selected = valid[nonempty]
+
+    # Shift each track by its first point, so the sums don't lose precision far from the origin. Kept as
+    # contiguous columns, which the products below are much faster on.
+    x, y, z = shifted = np.ascontiguousarray((positions - positions[np.repeat(offsets[:-1], counts)]).T)
+
+    centroids = np.full((n_tracks, 3), np.nan)
+    covariances = np.full((n_tracks, 3, 3), np.nan)
+    variances = np.full((n_tracks, 3), np.nan)
+    axes = np.full((n_tracks, 3, 3), np.nan)
+    normals = np.full((n_tracks, 3), np.nan)
+    if len(starts):
+        # Segmented first and second moments.
+        n = counts[valid][:, np.newaxis]
+        mean = np.add.reduceat(shifted, segments, axis=1)[:, selected].T / n
+        # Only the six distinct products of the symmetric second moment are summed.
+        rows, columns = np.triu_indices(3)
+        second = np.empty((len(starts), 3, 3))
+        second[:, rows, columns] = np.add.reduceat(
+            np.stack((x * x, x * y, x * z, y * y, y * z, z * z)), segments, axis=1
+        )[:, selected].T
+        second[:, columns, rows] = second[:, rows, columns]
+        covariances[valid] = (second - n[..., np.newaxis] * mean[:, :, np.newaxis] * mean[:, np.newaxis, :]) \
+            / (n[..., np.newaxis] - 1)
+        centroids[valid] = mean + positions[starts]
+
+        # Principal axes, in decreasing order of variance; the normal is the axis of least variance.
+        eigenvalues, eigenvectors = np.linalg.eigh(covariances[valid])
+        variances[valid] = eigenvalues[:, ::-1]
+        axes[valid] = np.swapaxes(eigenvectors[:, :, ::-1], 1, 2)
+        normals[valid] = axes[valid, 2]
+
+        # Orient the normals along the angular momentum: the sum of cross products of consecutive points,
+        # leaving out the products spanning two tracks.
+        crosses = np.stack((
+            y[:-1] * z[1:] - z[:-1] * y[1:],
+            z[:-1] * x[1:] - x[:-1] * z[1:],
+            x[:-1] * y[1:] - y[:-1] * x[1:]
+        ))
+        boundaries = offsets[1:-1] - 1
+        crosses[:, boundaries[(boundaries >= 0) & (boundaries < crosses.shape[1])]] = 0
+        momentum = np.add.reduceat(crosses, np.minimum(segments, crosses.shape[1] - 1), axis=1)[:, selected].T
+        flip = np.einsum('ij,ij->i', momentum, normals[valid]) < 0
+        normals[np.flatnonzero(valid)[flip]] *= -1
+
+    inclinations = np.arccos(np.clip(normals[:, 2], -1.0, 1.0))
+    return PlaneFit(centroids, covariances, variances, axes, normals, inclinations)
+
+def fit_ellipses_pca(positions, offsets):
+    """
+    Fit an ellipse to each of many tracks using Principal Component Analysis (PCA).
+
+    Parameters:
+        positions (np.ndarray): Array of shape (N, 3) holding the points of every track.
+        offsets (np.ndarray): Array of shape (K + 1,) of track boundaries, as in fit_planes.
+
+    Returns:
+        ellipse_params (np.ndarray): Array of shape (K, 6) of (center x, y, z, semi-major axis length,
+            semi-minor axis length, orientation angle) per track.
+    """
+    planes = fit_planes(positions, offsets)
+
+    # Points spread evenly around an ellipse have a variance of half the squared semi-axis along each axis.
+    semi_axes = np.sqrt(2 * np.maximum(planes.variances[:, :2], 0))
+
+    # Orientation angle of the major axis in the xy plane.
+    orientation_angles = np.arctan2(planes.axes[:, 0, 1], planes.axes[:, 0, 0])
+
+    return np.column_stack((planes.centroids, semi_axes, orientation_angles))
 
 def fit_ellipse_pca(observed_points):
     """
@@ -11,26 +118,11 @@ def fit_ellipse_pca(observed_points):
     Returns:
         ellipse_params (tuple): Tuple containing the parameters of the best-fit ellipse.
     """
-    # Perform PCA on observed points
-    pca = PCA(n_components=2)
-    pca.fit(observed_points)
-    
-    # Extract principal components
-    principal_components = pca.components_
-
-    # Extract center of the ellipse (mean of observed points)
-    center = np.mean(observed_points, axis=0)
-
-    # Extract semi-major and semi-minor axes lengths
-    semi_major_axis_length = np.linalg.norm(principal_components[0])
-    semi_minor_axis_length = np.linalg.norm(principal_components[1])
-
-    # Extract orientation angle of the ellipse
-    orientation_angle = np.arctan2(principal_components[0, 1], principal_components[0, 0])
+    observed_points = np.asarray(observed_points, dtype=float)
+    ellipse_params = fit_ellipses_pca(observed_points, [0, len(observed_points)])[0]
 
     # Return tuple containing ellipse parameters
-    ellipse_params = (center[0], center[1], center[2], semi_major_axis_length, semi_minor_axis_length, orientation_angle)
-    return ellipse_params
+    return tuple(ellipse_params)
 
 # Example usage
 if __name__ == "__main__":
@@ -48,4 +140,4 @@ if __name__ == "__main__":
     print("Center:", ellipse_params[:3])
     print("Semi-major axis length:", ellipse_params[3])
     print("Semi-minor axis length:", ellipse_params[4])
-    print("Orientation angle (phi):", ellipse_params[5])
\ No newline at end of file
+    print("Orientation angle (phi):", ellipse_params[5])
@@ -0,0 +1,154 @@
+import numpy as np
+import kernels
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+from ellipse import KEPLER_MAX_ITERATIONS, KEPLER_TOLERANCE, mean_motion, orbital_plane_basis, solve_kepler
+
+# Object-epoch pairs propagated per chunk, bounding the float64 temporaries to a few hundred MB whatever the
+# size of the catalog.
+PROPAGATION_CHUNK = 1 << 20
+
+# Output precisions. Every chunk is computed in float64, since the mean anomaly M + n * t loses too much
+# precision in float32 over long time spans; float32 only halves the output, at about 0.5 m of rounding on a
+# LEO position in km.
+DTYPES = (np.float32, np.float64)
+
+def _propagate_chunk(elements: np.ndarray, mean_motions: np.ndarray, timestamps: np.ndarray, velocities: bool):
+    # Positions (and velocities) of one chunk of objects, in float64.
+    if kernels.JIT:
+        kernel = kernels.kepler_states if velocities else kernels.kepler_positions
+        return kernel(
+            np.ascontiguousarray(elements), np.ascontiguousarray(mean_motions), timestamps,
+            KEPLER_MAX_ITERATIONS, KEPLER_TOLERANCE
+        )
+
+    a, e, incl, omega, Omega, M = (column[:, np.newaxis] for column in elements.T)
+    n = mean_motions[:, np.newaxis]
+    E, _ = solve_kepler(M + n * timestamps, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    root = np.sqrt(1 - e**2)
+    P, Q = orbital_plane_basis(incl, omega, Omega)
+    positions = (a * (cos_E - e))[..., np.newaxis] * P + (a * root * sin_E)[..., np.newaxis] * Q
+    if not velocities:
+        return positions
+    rate = n * a / (1 - e * cos_E)
+    return positions, (-rate * sin_E)[..., np.newaxis] * P + (rate * root * cos_E)[..., np.newaxis] * Q
+
+def _prepare(elements, timestamps, mean_motions) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    elements = np.asarray(elements, dtype=np.float64).reshape(-1, 6)
+    timestamps = np.asarray(timestamps, dtype=np.float64).reshape(-1)
+    mean_motions = mean_motion(elements[:, 0]) if mean_motions is None \
+        else np.broadcast_to(np.asarray(mean_motions, dtype=np.float64), len(elements))
+    return elements, timestamps, mean_motions
+
+def chunk_rows(n_timestamps: int, chunk_size: int = PROPAGATION_CHUNK) -> int:
+    """
+    Number of objects per chunk so that a chunk holds about chunk_size object-epoch pairs.
+    """
+    return max(chunk_size // max(n_timestamps, 1), 1)
+
+def propagate_chunks(elements: np.ndarray, timestamps: np.ndarray, velocities: bool = False,
+                     mean_motions: Optional[np.ndarray] = None, dtype=np.float64,
+                     chunk_size: int = PROPAGATION_CHUNK) -> Iterator[Tuple[slice, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Propagate a catalog chunk by chunk of objects, for consumers that reduce each chunk (e.g. screening) and
+    never need the whole (K, T, 3) array at once.
+
+    Args:
+        elements (np.ndarray): Elements [a, e, incl, omega, Omega, M] of shape (K, 6), with M at t = 0.
+        timestamps (np.ndarray): Epochs of shape (T,), in seconds.
+        velocities (bool): Also yield velocities.
+        mean_motions (Optional[np.ndarray]): Mean motions of shape (K,), in radians per second. Defaults to
+            Kepler's third law (ellipse.mean_motion).
+        dtype: Output precision, one of DTYPES.
+        chunk_size (int): Object-epoch pairs per chunk.
+
+    Yields:
+        Tuple[slice, np.ndarray, Optional[np.ndarray]]: Objects of the chunk, their positions of shape
+            (k, T, 3) and their velocities (None unless requested).
+    """
+    if np.dtype(dtype) not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype!r}, expected one of {DTYPES}.")
+    elements, timestamps, mean_motions = _prepare(elements, timestamps, mean_motions)
+    rows = chunk_rows(len(timestamps), chunk_size)
+    for start in range(0, len(elements), rows):
+        chunk = slice(start, min(start + rows, len(elements)))
+        result = _propagate_chunk(elements[chunk], mean_motions[chunk], timestamps, velocities)
+        positions, chunk_velocities = result if velocities else (result, None)
+        yield (
+            chunk,
+            positions.astype(dtype, copy=False),
+            None if chunk_velocities is None else chunk_velocities.astype(dtype, copy=False)
+        )
+
+def propagate(elements: np.ndarray, timestamps: np.ndarray, velocities: bool = False,
+              mean_motions: Optional[np.ndarray] = None, dtype=np.float64, out: Optional[np.ndarray] = None,
+              out_velocities: Optional[np.ndarray] = None, path: Optional[Union[str, Path]] = None,
+              chunk_size: int = PROPAGATION_CHUNK, workers: int = 1):
+    """
+    Ephemerides of a whole catalog: the positions (and velocities) of K objects at T epochs.
+
+    The objects are propagated in chunks of about chunk_size object-epoch pairs, each written straight into
+    its slice of the output, so the working memory stays bounded however large the catalog is. For outputs
+    that don't fit in memory (e.g. 100k objects x 10k epochs is 12 GB in float32), pass path to write to a
+    memory-mapped .npy file, or use propagate_chunks. With workers > 1 the chunks are propagated by a thread
+    pool; NumPy and the compiled kernels release the GIL for most of the work.
+
+    Args:
+        elements (np.ndarray): Elements [a, e, incl, omega, Omega, M] of shape (K, 6), with M at t = 0.
+        timestamps (np.ndarray): Epochs of shape (T,), in seconds.
+        velocities (bool): Also return velocities.
+        mean_motions (Optional[np.ndarray]): Mean motions of shape (K,), in radians per second. Defaults to
+            Kepler's third law (ellipse.mean_motion).
+        dtype: Output precision, one of DTYPES.
+        out (Optional[np.ndarray]): Array of shape (K, T, 3) to write the positions to.
+        out_velocities (Optional[np.ndarray]): Array of shape (K, T, 3) to write the velocities to.
+        path (Optional[Union[str, Path]]): .npy file to write the positions to, memory-mapped, when out isn't
+            given; the velocities go next to it, with a '.velocities' suffix before '.npy'.
+        chunk_size (int): Object-epoch pairs per chunk.
+        workers (int): Number of threads propagating chunks.
+
+    Returns:
+        positions (np.ndarray): Array of shape (K, T, 3), and velocities of the same shape if requested.
+    """
+    if np.dtype(dtype) not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype!r}, expected one of {DTYPES}.")
+    elements, timestamps, mean_motions = _prepare(elements, timestamps, mean_motions)
+    shape = (len(elements), len(timestamps), 3)
+
+    def allocate(array, suffix):
+        if array is not None:
+            if array.shape != shape:
+                raise ValueError(f"Output of shape {array.shape}, expected {shape}.")
+            return array
+        if path is not None:
+            file = Path(path)
+            return np.lib.format.open_memmap(file.with_name(file.stem + suffix + '.npy'), mode='w+', dtype=dtype, shape=shape)
+        return np.empty(shape, dtype=dtype)
+
+    positions = allocate(out, '')
+    velocity_output = allocate(out_velocities, '.velocities') if velocities else None
+
+    rows = chunk_rows(len(timestamps), chunk_size)
+    def propagate_rows(start):
+        chunk = slice(start, min(start + rows, len(elements)))
+        result = _propagate_chunk(elements[chunk], mean_motions[chunk], timestamps, velocities)
+        if velocities:
+            positions[chunk], velocity_output[chunk] = result
+        else:
+            positions[chunk] = result
+
+    starts = range(0, len(elements), rows)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(propagate_rows, starts))
+    else:
+        for start in starts:
+            propagate_rows(start)
+
+    for output in (positions, velocity_output):
+        if isinstance(output, np.memmap):
+            output.flush()
+
+    return (positions, velocity_output) if velocities else positions
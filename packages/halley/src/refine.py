@@ -0,0 +1,199 @@
+import numpy as np
+from scipy.optimize import least_squares
+from typing import NamedTuple, Optional, Union
+from ellipse import (
+    PROXIMITY_THRESHOLD_MOD, FitContext, ellipse_model_jacobian, estimate_elements, estimate_elements_multistart,
+    preprocess_data
+)
+
+# Lower bound on the eigenvalues of a covariance when it is inverted, relative to the largest one.
+COVARIANCE_FLOOR = 1e-15
+
+class OrbitState(NamedTuple):
+    """
+    Running estimate of an object's orbit: the six Keplerian elements [a, e, incl, omega, Omega, M] followed by
+    the mean motion n, so the mean anomaly at time t is M + n * t as in ellipse.ellipse_model, with their 7x7
+    covariance. The mean motion is part of the state so that observations spread over weeks can correct the
+    period rather than only the phase.
+    """
+    state: np.ndarray # Shape (7,): [a, e, incl, omega, Omega, M, n].
+    covariance: np.ndarray # Shape (7, 7).
+    noise_variance: float # Variance of one position coordinate of an observation with confidence 1.
+    time: float # Time of the latest observation included.
+    observations: int # Number of observations included.
+
+    @property
+    def elements(self) -> np.ndarray:
+        return self.state[:6]
+
+    @property
+    def mean_motion(self) -> float:
+        return float(self.state[6])
+
+    def predict(self, t: Union[float, np.ndarray]) -> np.ndarray:
+        """
+        Predicted position at time t, of shape (3,), or (len(t), 3) for an array of times.
+        """
+        points, _ = ellipse_model_jacobian(self.elements, np.atleast_1d(t), self.mean_motion)
+        return points[0] if np.ndim(t) == 0 else points
+
+def _measurement(state: np.ndarray, times: np.ndarray):
+    # Model positions (m, 3) and their Jacobian (3m, 7) with respect to the state, including the mean motion,
+    # whose derivative is t times the derivative with respect to M.
+    points, jacobian = ellipse_model_jacobian(state[:6], times, state[6])
+    jacobian = np.concatenate((jacobian, jacobian[..., 5:6] * times[:, np.newaxis, np.newaxis]), axis=-1)
+    return points, jacobian.reshape(-1, 7)
+
+def _constrain(state: np.ndarray) -> np.ndarray:
+    # Keep the semi-major axis positive and the orbit elliptical.
+    state[0] = max(state[0], 0.0)
+    state[1] = np.clip(state[1], 0.0, 1 - 1e-9)
+    return state
+
+def initial_state(flight_path, method: str = 'trf', proximity_threshold_mod: float = PROXIMITY_THRESHOLD_MOD,
+                  multi_start: bool = True, workers: int = 1) -> OrbitState:
+    """
+    Fit an orbit from scratch, as the starting state of the incremental updates.
+
+    The updates only linearize around this state, so it has to be in the right basin: by default it comes from
+    the multi-start fit, as in ellipse.fit_elements_to_flight_path.
+
+    Args:
+        flight_path (FlightPath or list of dict): Flight path data.
+        method (str): Least-squares solver, one of ellipse.LEAST_SQUARES_METHODS.
+        proximity_threshold_mod (float): Proximity threshold mod used to estimate the orbital period.
+        multi_start (bool): Fit from the best analytic seeds (ellipse.estimate_elements_multistart). False
+            fits from the INIT_GUESS_* constants, which often converges to a wrong minimum.
+        workers (int): Number of processes refining the seeds of the multi-start fit.
+
+    Returns:
+        OrbitState: Fitted elements and mean motion, with the element covariance of the fit and the variance of
+            the mean motion from the period estimate's uncertainty.
+    """
+    normalized_flight_path, confidence_score_modifiers = preprocess_data(flight_path)
+    context = FitContext(normalized_flight_path, confidence_score_modifiers, proximity_threshold_mod)
+    if multi_start:
+        elements, element_covariance, result = estimate_elements_multistart(context, method=method, workers=workers)
+    else:
+        elements, element_covariance, result = estimate_elements(context, method=method)
+
+    covariance = np.zeros((7, 7))
+    covariance[:6, :6] = element_covariance
+    covariance[6, 6] = (context.mean_motion * context.period_uncertainty / context.orbital_period)**2
+
+    degrees_of_freedom = max(len(result.fun) - len(result.x), 1)
+    return OrbitState(
+        np.append(elements, context.mean_motion),
+        covariance,
+        2 * result.cost / degrees_of_freedom,
+        float(np.max(context.time)),
+        len(context)
+    )
+
+def update(state: OrbitState, positions: np.ndarray, times: Union[float, np.ndarray], confidences=1.0,
+           process_noise: Optional[np.ndarray] = None, iterations: int = 1) -> OrbitState:
+    """
+    Update an orbit with new observations, without refitting: one (iterated) extended Kalman filter step.
+
+    The Keplerian elements are constant between observations, so the prediction step only inflates the
+    covariance by the optional process noise over the elapsed time. The measurement update linearizes
+    ellipse.ellipse_model around the current state; with iterations > 1 it is relinearized around the updated
+    state (iterated EKF), which helps when the new observations are far from the prediction.
+
+    Args:
+        state (OrbitState): Current state.
+        positions (np.ndarray): Observed positions, of shape (3,) or (m, 3).
+        times (Union[float, np.ndarray]): Observation times, a scalar or of shape (m,).
+        confidences (array-like): Confidence scores of the observations, scaling their noise variance by 1 / C.
+        process_noise (Optional[np.ndarray]): Variance added to each state component per unit of elapsed time,
+            of shape (7,), to model unmodelled forces (e.g. drag).
+        iterations (int): Number of linearizations of the measurement update.
+
+    Returns:
+        OrbitState: Updated state.
+    """
+    positions = np.atleast_2d(np.asarray(positions, dtype=float))
+    times = np.atleast_1d(np.asarray(times, dtype=float))
+    variances = np.repeat(state.noise_variance / np.broadcast_to(confidences, times.shape), 3)
+
+    # Prediction: constant elements, covariance inflated over the elapsed time.
+    covariance = state.covariance
+    if process_noise is not None:
+        covariance = covariance + np.diag(np.asarray(process_noise) * max(np.max(times) - state.time, 0.0))
+
+    # Measurement update, relinearized around the latest estimate on every iteration.
+    prior = state.state
+    estimate = prior
+    for _ in range(iterations):
+        predicted, H = _measurement(estimate, times)
+        innovation = (positions - predicted).ravel() - H @ (prior - estimate)
+        S = H @ covariance @ H.T + np.diag(variances)
+        K = np.linalg.solve(S, H @ covariance).T
+        estimate = _constrain(prior + K @ innovation)
+
+    # Joseph form, which keeps the covariance symmetric positive semi-definite.
+    I_KH = np.eye(7) - K @ H
+    covariance = I_KH @ covariance @ I_KH.T + (K * variances) @ K.T
+
+    return OrbitState(
+        estimate,
+        covariance,
+        state.noise_variance,
+        max(state.time, float(np.max(times))),
+        state.observations + len(times)
+    )
+
+def refit(state: OrbitState, flight_path, method: str = 'trf', max_nfev: Optional[int] = None) -> OrbitState:
+    """
+    Warm-started refit of an orbit with new observations.
+
+    Only the new observations are fitted; everything seen before enters through the current state and its
+    covariance as a Gaussian prior, so the result is the maximum a posteriori orbit over all observations at the
+    cost of fitting the new ones. The solver starts from the current state, so it typically converges in a few
+    iterations. More robust than update when the new observations span a long arc.
+
+    Args:
+        state (OrbitState): Current state.
+        flight_path (FlightPath or list of dict): New observations.
+        method (str): Least-squares solver, one of ellipse.LEAST_SQUARES_METHODS.
+        max_nfev (Optional[int]): Cap on the number of residual evaluations.
+
+    Returns:
+        OrbitState: Refitted state.
+    """
+    normalized_flight_path, confidence_score_modifiers = preprocess_data(flight_path)
+    positions, times = normalized_flight_path.positions, normalized_flight_path.t
+    weights = np.sqrt(confidence_score_modifiers / state.noise_variance)[:, np.newaxis, np.newaxis]
+
+    # Square root of the prior information matrix, from the eigendecomposition of the covariance.
+    eigenvalues, eigenvectors = np.linalg.eigh(state.covariance)
+    eigenvalues = np.maximum(eigenvalues, COVARIANCE_FLOOR * max(eigenvalues.max(), COVARIANCE_FLOOR))
+    whitening = eigenvectors.T / np.sqrt(eigenvalues)[:, np.newaxis]
+
+    def residuals(x):
+        points, _ = ellipse_model_jacobian(x[:6], times, x[6])
+        return np.concatenate(((weights[..., 0] * (points - positions)).ravel(), whitening @ (x - state.state)))
+
+    def jacobian(x):
+        _, H = _measurement(x, times)
+        return np.concatenate(((weights * H.reshape(-1, 3, 7)).reshape(-1, 7), whitening))
+
+    bounds = (-np.inf, np.inf)
+    if method != 'lm':
+        bounds = ([0, 0, -np.inf, -np.inf, -np.inf, -np.inf, -np.inf], [np.inf, 1 - 1e-9, np.inf, np.inf, np.inf, np.inf, np.inf])
+    result = least_squares(
+        residuals, _constrain(state.state.copy()), jac=jacobian, bounds=bounds, method=method, max_nfev=max_nfev
+    )
+
+    # The residuals are whitened, so the covariance is the inverse of the Gauss-Newton information matrix J^T J.
+    # Inverted through the SVD of J, since J^T J squares a condition number that the mean motion already makes
+    # large.
+    _, singular_values, vt = np.linalg.svd(result.jac, full_matrices=False)
+    singular_values = np.maximum(singular_values, np.finfo(float).eps * max(result.jac.shape) * singular_values[0])
+    return OrbitState(
+        result.x,
+        (vt.T / singular_values**2) @ vt,
+        state.noise_variance,
+        max(state.time, float(np.max(times))),
+        state.observations + len(times)
+    )
@@ -0,0 +1,253 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares
+from scipy.sparse import coo_matrix
+from scipy.spatial.transform import Rotation
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+from batch import attach_array, share_array
+from cloud import ICPResult, apply_icp_algorithm, load_frame
+
+# Rigid registration of a sequence of frames: every pair of consecutive frames is registered with ICP
+# (cloud.apply_icp_algorithm), independently of the others, across a process pool, and the relative transforms
+# are chained into the pose of every frame in the coordinates of the first. Registering extra, non-consecutive
+# pairs (loop closures) and optimizing the pose graph spreads the drift accumulated along the chain over all of
+# its links instead of leaving it on the last frames.
+#
+# Poses follow the convention of apply_icp_algorithm: the transform (R, t) of the pair (i, j) maps points of
+# frame j into frame i, x_i = R x_j + t, and the pose of frame k maps it into frame 0.
+
+POSE_GRAPH_MIN_RMS = 1e-6 # Floor of the ICP RMS error weighting a link of the pose graph, in km.
+
+class Registration(NamedTuple):
+    """
+    Poses of a sequence of F frames, with the registrations of their links.
+    """
+    rotations: np.ndarray # Shape (F, 3, 3): rotation of every frame into frame 0.
+    translations: np.ndarray # Shape (F, 3): translation of every frame into frame 0.
+    pairs: np.ndarray # Shape (L, 2): frames (i, j) of every registered link, consecutive pairs first.
+    links: List[ICPResult] # ICP registration of frame j onto frame i of every link.
+
+    def transform(self, index: int, points: np.ndarray) -> np.ndarray:
+        """
+        Map points of frame index into the coordinates of frame 0.
+        """
+        return np.asarray(points, dtype=float) @ self.rotations[index].T + self.translations[index]
+
+def pack_frames(frames: Iterable[Union[np.ndarray, dict]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenate frames into one (total, 3) array of points plus offsets, so frame i is the row range
+    offsets[i]:offsets[i + 1].
+
+    Args:
+        frames (Iterable[Union[np.ndarray, dict]]): Point clouds of shape (N, 3), or images (see cloud.load_frame).
+    """
+    clouds = [
+        load_frame(frame)[0] if isinstance(frame, dict) else np.asarray(frame, dtype=float).reshape(-1, 3)
+        for frame in frames
+    ]
+    offsets = np.zeros(len(clouds) + 1, dtype=np.int64)
+    np.cumsum([len(points) for points in clouds], out=offsets[1:])
+    points = np.concatenate(clouds) if clouds else np.empty((0, 3))
+    return points, offsets
+
+# Per-worker state, set by _initialize_worker.
+_worker = {}
+
+def _initialize_worker(name: str, shape: Tuple[int, int], offsets: np.ndarray, max_iterations: int,
+                       tolerance: float):
+    _worker['block'], _worker['points'] = attach_array(name, shape)
+    _worker['offsets'] = offsets
+    _worker['settings'] = (max_iterations, tolerance)
+
+def _register_pair(pair: Tuple[int, int], points: np.ndarray = None, offsets: np.ndarray = None,
+                   settings: Tuple[int, float] = None) -> ICPResult:
+    points = _worker['points'] if points is None else points
+    offsets = _worker['offsets'] if offsets is None else offsets
+    max_iterations, tolerance = _worker['settings'] if settings is None else settings
+    i, j = pair
+    # Zero-copy views of the two frames.
+    return apply_icp_algorithm(
+        points[offsets[j]:offsets[j + 1]], points[offsets[i]:offsets[i + 1]], max_iterations, tolerance
+    )
+
+def register_pairs(points: np.ndarray, offsets: np.ndarray, pairs: Sequence[Tuple[int, int]],
+                   workers: Optional[int] = None, chunksize: int = 1, max_iterations: int = 50,
+                   tolerance: float = 1e-6) -> List[ICPResult]:
+    """
+    Register frame j onto frame i for every pair (i, j), across a process pool.
+
+    The frames are packed into one shared memory block that every worker attaches to, so each task only ships
+    a pair of frame indices, as in batch.fit_many.
+
+    Args:
+        points (np.ndarray): Points of all frames, shape (total, 3), as from pack_frames.
+        offsets (np.ndarray): Offsets of the frames, shape (F + 1,).
+        pairs (Sequence[Tuple[int, int]]): Frames (i, j) to register.
+        workers (Optional[int]): Number of worker processes. Defaults to the number of CPUs; 1 registers
+            in-process.
+        chunksize (int): Number of pairs handed to a worker per task.
+        max_iterations (int): Maximum number of ICP iterations per pair.
+        tolerance (float): ICP convergence threshold.
+
+    Returns:
+        List[ICPResult]: One registration per pair, in input order.
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    pairs = [(int(i), int(j)) for i, j in pairs]
+    workers = workers or os.cpu_count()
+
+    if workers == 1 or len(pairs) <= 1:
+        return [_register_pair(pair, points, offsets, (max_iterations, tolerance)) for pair in pairs]
+
+    with share_array(points) as (name, _):
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initialize_worker,
+            initargs=(name, points.shape, offsets, max_iterations, tolerance)
+        ) as executor:
+            return list(executor.map(_register_pair, pairs, chunksize=chunksize))
+
+def chain_poses(rotations: np.ndarray, translations: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compose the transforms of the consecutive pairs (k, k + 1) into the pose of every frame in frame 0.
+
+    Args:
+        rotations (np.ndarray): Relative rotations of shape (F - 1, 3, 3).
+        translations (np.ndarray): Relative translations of shape (F - 1, 3).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Rotations (F, 3, 3) and translations (F, 3) of the frames.
+    """
+    poses_R = np.empty((len(rotations) + 1, 3, 3))
+    poses_t = np.empty((len(rotations) + 1, 3))
+    poses_R[0], poses_t[0] = np.eye(3), 0.0
+    for k, (R, t) in enumerate(zip(rotations, translations)):
+        # x_0 = R_k x_k + t_k and x_k = R x_(k+1) + t.
+        poses_R[k + 1] = poses_R[k] @ R
+        poses_t[k + 1] = poses_R[k] @ t + poses_t[k]
+    return poses_R, poses_t
+
+def optimize_pose_graph(rotations: np.ndarray, translations: np.ndarray, pairs: np.ndarray,
+                        relative_rotations: np.ndarray, relative_translations: np.ndarray,
+                        weights: Optional[np.ndarray] = None, scale: float = 1.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Adjust the poses of the frames to agree best with all the registered links, frame 0 held fixed.
+
+    Every link (i, j) contributes the rotation error rotvec(R_ij^T R_i^T R_j), times scale so that it is a
+    displacement at a typical distance from the center of a frame, and the translation error
+    R_i^T (t_j - t_i) - t_ij, both times the link's weight. The poses are solved as rotation vectors and
+    translations by scipy.optimize.least_squares, with the sparsity of the Jacobian (each link only involves
+    two frames) so that long sequences stay tractable.
+
+    Args:
+        rotations (np.ndarray): Initial rotations of the frames, shape (F, 3, 3), e.g. from chain_poses.
+        translations (np.ndarray): Initial translations, shape (F, 3).
+        pairs (np.ndarray): Frames (i, j) of the links, shape (L, 2).
+        relative_rotations (np.ndarray): Measured rotations of the links, shape (L, 3, 3).
+        relative_translations (np.ndarray): Measured translations of the links, shape (L, 3).
+        weights (Optional[np.ndarray]): Weights of the links, shape (L,). Defaults to 1.
+        scale (float): Length converting rotation errors into displacements.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Optimized rotations (F, 3, 3) and translations (F, 3).
+    """
+    pairs = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+    n_frames = len(rotations)
+    if n_frames < 2 or len(pairs) == 0:
+        return rotations, translations
+    weights = np.ones(len(pairs)) if weights is None else np.asarray(weights, dtype=float)
+    measured = Rotation.from_matrix(relative_rotations)
+    first, second = pairs[:, 0], pairs[:, 1]
+
+    # The unknowns are rotation vectors relative to frame 0, which is held at its given pose; the residuals
+    # take the absolute rotations.
+    fixed = Rotation.from_matrix(rotations[0])
+
+    def unpack(x):
+        rotvecs = np.vstack((np.zeros(3), x[:3 * (n_frames - 1)].reshape(-1, 3)))
+        offsets = np.vstack((translations[:1], x[3 * (n_frames - 1):].reshape(-1, 3)))
+        return fixed * Rotation.from_rotvec(rotvecs), offsets
+
+    def residuals(x):
+        poses, offsets = unpack(x)
+        rotation_errors = (measured.inv() * poses[first].inv() * poses[second]).as_rotvec() * scale
+        translation_errors = poses[first].inv().apply(offsets[second] - offsets[first]) - relative_translations
+        return (weights[:, np.newaxis] * np.hstack((rotation_errors, translation_errors))).ravel()
+
+    # The six residuals of a link depend on the rotation and translation of its two frames, frame 0 excepted.
+    links = np.repeat(np.arange(len(pairs)), 2)
+    frames = pairs.ravel()
+    moving = frames > 0
+    links, frames = links[moving], frames[moving]
+    rows = 6 * links[:, np.newaxis] + np.arange(6)
+    columns = np.hstack((
+        3 * (frames[:, np.newaxis] - 1) + np.arange(3),
+        3 * (n_frames - 1) + 3 * (frames[:, np.newaxis] - 1) + np.arange(3)
+    ))
+    rows, columns = np.broadcast_arrays(rows[:, :, np.newaxis], columns[:, np.newaxis, :])
+    sparsity = coo_matrix(
+        (np.ones(rows.size), (rows.ravel(), columns.ravel())), shape=(6 * len(pairs), 6 * (n_frames - 1))
+    ).tocsr()
+
+    initial = fixed.inv() * Rotation.from_matrix(rotations[1:])
+    x0 = np.concatenate((initial.as_rotvec().ravel(), translations[1:].ravel()))
+    result = least_squares(residuals, x0, jac_sparsity=sparsity, method='trf', x_scale='jac')
+    poses, offsets = unpack(result.x)
+    return poses.as_matrix(), offsets
+
+def register_frames(frames: Iterable[Union[np.ndarray, dict]], closures: Sequence[Tuple[int, int]] = (),
+                    optimize: bool = False, workers: Optional[int] = None, chunksize: int = 1,
+                    max_iterations: int = 50, tolerance: float = 1e-6) -> Registration:
+    """
+    Register a sequence of frames into the coordinates of the first.
+
+    All consecutive pairs (and the loop closures) are registered at once by register_pairs, so the wall time
+    scales with the number of frames divided by the number of workers, rather than registering each frame
+    after the previous one. The relative transforms are then chained into poses, and optionally refined by
+    optimize_pose_graph over all the links, each weighted by the inverse of its ICP RMS error.
+
+    Args:
+        frames (Iterable[Union[np.ndarray, dict]]): Point clouds of shape (N, 3), or images (see
+            cloud.load_frame).
+        closures (Sequence[Tuple[int, int]]): Extra pairs of frames (i, j) to register, e.g. revisits of the
+            same part of the sky.
+        optimize (bool): Optimize the pose graph rather than only chaining the consecutive pairs.
+        workers (Optional[int]): Number of worker processes. Defaults to the number of CPUs; 1 registers
+            in-process.
+        chunksize (int): Number of pairs handed to a worker per task.
+        max_iterations (int): Maximum number of ICP iterations per pair.
+        tolerance (float): ICP convergence threshold.
+
+    Returns:
+        Registration: Poses of the frames and registrations of the links.
+    """
+    points, offsets = pack_frames(frames)
+    n_frames = len(offsets) - 1
+    if n_frames == 0:
+        return Registration(np.empty((0, 3, 3)), np.empty((0, 3)), np.empty((0, 2), dtype=np.intp), [])
+
+    pairs = np.array(
+        [(k, k + 1) for k in range(n_frames - 1)] + [tuple(pair) for pair in closures], dtype=np.intp
+    ).reshape(-1, 2)
+    if np.any((pairs < 0) | (pairs >= n_frames)):
+        raise ValueError(f"Loop closures must pair frames in [0, {n_frames}).")
+
+    links = register_pairs(points, offsets, pairs, workers, chunksize, max_iterations, tolerance)
+    relative_rotations = np.array([link.R for link in links]).reshape(-1, 3, 3)
+    relative_translations = np.array([link.t for link in links]).reshape(-1, 3)
+    rotations, translations = chain_poses(relative_rotations[:n_frames - 1], relative_translations[:n_frames - 1])
+
+    if optimize and len(pairs) >= n_frames:
+        # Typical distance of a point from the center of its frame.
+        centered = [
+            points[start:end] - points[start:end].mean(axis=0)
+            for start, end in zip(offsets[:-1], offsets[1:]) if end > start
+        ]
+        scale = float(np.median([np.sqrt(np.mean(np.sum(c**2, axis=1))) for c in centered])) if centered else 1.0
+        weights = 1 / np.maximum([link.rms for link in links], POSE_GRAPH_MIN_RMS)
+        rotations, translations = optimize_pose_graph(
+            rotations, translations, pairs, relative_rotations, relative_translations, weights, scale
+        )
+
+    return Registration(rotations, translations, pairs, links)
@@ -1,4 +1,10 @@
 import numpy as np
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Union
+from ellipse import EARTH_RADIUS
+from propagate import propagate
+
+# Order of the six Keplerian orbital elements in element arrays, as used by ellipse.ellipse_model.
+ELEMENT_NAMES = ('a', 'e', 'incl', 'omega', 'Omega', 'M')
 
 def generate_orbital_ellipse(mass_object, mass_earth, circumference_earth, diameter_earth):
     """
@@ -42,18 +48,145 @@ def generate_flight_path(a, e, inconsistency, parity_Q):
 
     return flight_path
 
+def uniform(low: float, high: float) -> Callable:
+    """
+    Uniform element distribution on [low, high), for generate_catalog.
+    """
+    return lambda rng, size: rng.uniform(low, high, size)
+
+def normal(mean: float, std: float, low: float = -np.inf, high: float = np.inf) -> Callable:
+    """
+    Normal element distribution clipped to [low, high], for generate_catalog.
+    """
+    return lambda rng, size: np.clip(rng.normal(mean, std, size), low, high)
+
+# Default element distributions: low Earth orbits (300 km to 2000 km altitude) in any orientation, with
+# eccentricities low enough to keep every perigee above 160 km. Semi-major axis in km, angles in radians.
+DEFAULT_DISTRIBUTIONS = {
+    'a': uniform(EARTH_RADIUS + 300, EARTH_RADIUS + 2000),
+    'e': uniform(0.0, 0.02),
+    'incl': uniform(0.0, np.pi),
+    'omega': uniform(0.0, 2 * np.pi),
+    'Omega': uniform(0.0, 2 * np.pi),
+    'M': uniform(0.0, 2 * np.pi)
+}
+
+class CatalogChunk(NamedTuple):
+    """
+    A chunk of generated objects. Dropped out observations are NaN in positions (and velocities).
+    """
+    object_ids: np.ndarray # Shape (k,).
+    elements: np.ndarray # Shape (k, 6), in ELEMENT_NAMES order, with M at t = 0.
+    timestamps: np.ndarray # Shape (T,), in seconds.
+    positions: np.ndarray # Shape (k, T, 3), in km.
+    velocities: Optional[np.ndarray] # Shape (k, T, 3), in km / s, if requested.
+
+def propagate_elements(elements: np.ndarray, timestamps: np.ndarray, velocities: bool = False):
+    """
+    Positions (and velocities) of K objects at T timestamps, propagated in bounded chunks of objects by
+    propagate.propagate.
+
+    Parameters:
+        elements (np.ndarray): Array of shape (K, 6) in ELEMENT_NAMES order, with M at t = 0.
+        timestamps (np.ndarray): Array of shape (T,), in seconds.
+        velocities (bool): Also return velocities.
+
+    Returns:
+        positions (np.ndarray): Array of shape (K, T, 3), and velocities of the same shape if requested.
+    """
+    return propagate(elements, timestamps, velocities)
+
+def generate_catalog(n_objects: int, timestamps: np.ndarray, distributions: Optional[Dict[str, Callable]] = None,
+                     dropout: Union[float, Callable] = 0.0, noise: Union[float, Callable] = 0.0,
+                     seed: Optional[int] = None, chunk_size: int = 10000,
+                     velocities: bool = False) -> Iterator[CatalogChunk]:
+    """
+    Generate a synthetic catalog of objects with their observed positions, chunk by chunk.
+
+    Parameters:
+        n_objects (int): Number of objects.
+        timestamps (np.ndarray): Observation timestamps in seconds, e.g. np.arange(n) * PARITY.
+        distributions (Optional[Dict[str, Callable]]): Distribution of each element, by name in ELEMENT_NAMES,
+            as a callable (rng, size) -> array (see uniform and normal). Missing names use DEFAULT_DISTRIBUTIONS.
+        dropout (Union[float, Callable]): Probability of an observation dropping out, or a callable
+            (rng, shape) -> boolean mask of the dropped observations for a (k, T) chunk.
+        noise (Union[float, Callable]): Standard deviation of isotropic Gaussian position noise in km, or a
+            callable (rng, positions) -> noisy positions.
+        seed (Optional[int]): Seed; the same seed and chunk size always reproduce the same catalog.
+        chunk_size (int): Number of objects per chunk, bounding memory to chunk_size x T observations at a time.
+        velocities (bool): Also generate (noise-free) velocities.
+
+    Yields:
+        CatalogChunk: Objects of the next chunk.
+    """
+    distributions = {**DEFAULT_DISTRIBUTIONS, **(distributions or {})}
+    timestamps = np.asarray(timestamps, dtype=float)
+    n_chunks = -(-n_objects // chunk_size)
+
+    # One independent random stream per chunk, derived from the seed.
+    for chunk, seed_sequence in enumerate(np.random.SeedSequence(seed).spawn(n_chunks)):
+        rng = np.random.default_rng(seed_sequence)
+        start = chunk * chunk_size
+        size = min(chunk_size, n_objects - start)
+
+        # Draw the elements and propagate every object to every timestamp.
+        elements = np.column_stack([distributions[name](rng, size) for name in ELEMENT_NAMES])
+        result = propagate_elements(elements, timestamps, velocities)
+        positions, object_velocities = result if velocities else (result, None)
+
+        # Noise model.
+        if callable(noise):
+            positions = noise(rng, positions)
+        elif noise > 0:
+            positions += rng.normal(0.0, noise, positions.shape)
+
+        # Drop out model.
+        dropped = dropout(rng, positions.shape[:2]) if callable(dropout) else rng.random(positions.shape[:2]) < dropout
+        positions[dropped] = np.nan
+        if object_velocities is not None:
+            object_velocities[dropped] = np.nan
+
+        yield CatalogChunk(np.arange(start, start + size), elements, timestamps, positions, object_velocities)
+
+def generate_images(chunk: CatalogChunk, confidence: float = 1.0) -> List[dict]:
+    """
+    Convert a chunk generated with velocities into images (one per timestamp) of the points observed at that
+    time, in the format consumed by cloud.cloud and stream.StreamingCloud. Each point also carries the 'id' of
+    its object.
+    """
+    images = []
+    for i, timestamp in enumerate(chunk.timestamps):
+        observed = np.flatnonzero(~np.isnan(chunk.positions[:, i, 0]))
+        velocity = chunk.velocities[observed, i]
+        speed = np.linalg.norm(velocity, axis=1)
+        direction = velocity / speed[:, np.newaxis]
+        images.append({
+            'timestamp': float(timestamp),
+            'points': [
+                {'coordinates': coordinates, 'speed': s, 'direction': d, 'confidence': confidence, 'id': object_id}
+                for coordinates, s, d, object_id in zip(
+                    chunk.positions[observed, i].tolist(),
+                    speed.tolist(),
+                    direction.tolist(),
+                    chunk.object_ids[observed].tolist()
+                )
+            ]
+        })
+    return images
+
 # Example usage:
-mass_object = 1000  # Mass of the object.
-mass_earth = 5.972e24  # Mass of the Earth.
-circumference_earth = 40075e3  # Circumference of the Earth in meters.
-diameter_earth = 12742e3  # Diameter of the Earth in meters.
-parity_Q = 1  # Parity of time between images.
-inconsistency = 0.2  # Inconsistency factor (proportion of points to drop out).
+if __name__ == "__main__":
+    mass_object = 1000  # Mass of the object.
+    mass_earth = 5.972e24  # Mass of the Earth.
+    circumference_earth = 40075e3  # Circumference of the Earth in meters.
+    diameter_earth = 12742e3  # Diameter of the Earth in meters.
+    parity_Q = 1  # Parity of time between images.
+    inconsistency = 0.2  # Inconsistency factor (proportion of points to drop out).
 
-# Generate parameters of the orbital ellipse
-a, e = generate_orbital_ellipse(mass_object, mass_earth, circumference_earth, diameter_earth)
+    # Generate parameters of the orbital ellipse
+    a, e = generate_orbital_ellipse(mass_object, mass_earth, circumference_earth, diameter_earth)
 
-# Generate flight path data with "drop out" effects
-flight_path = generate_flight_path(a, e, inconsistency, parity_Q)
+    # Generate flight path data with "drop out" effects
+    flight_path = generate_flight_path(a, e, inconsistency, parity_Q)
 
-print(flight_path)
+    print(flight_path)
@@ -0,0 +1,179 @@
+import hashlib
+import inspect
+import json
+import shutil
+import time
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Union
+
+# Where stage checkpoints are kept, one directory per stage and key.
+CHECKPOINT_DIRECTORY = Path(__file__).resolve().parents[1] / '.cache' / 'stages'
+
+# Bump when the checkpoint layout changes, to invalidate existing checkpoints.
+CHECKPOINT_VERSION = 1
+
+class Checkpoint:
+    """
+    Output of a pipeline stage: named arrays, memory-mapped when loaded from disk, plus JSON metadata. The key
+    identifies the content, so downstream stages hash a checkpoint by its key instead of by its arrays.
+    """
+    __slots__ = ('stage', 'key', 'arrays', 'metadata', 'cached')
+
+    def __init__(self, stage: str, key: str, arrays: Dict[str, np.ndarray], metadata: dict, cached: bool):
+        self.stage = stage
+        self.key = key
+        self.arrays = arrays
+        self.metadata = metadata
+        self.cached = cached
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __repr__(self) -> str:
+        return f"Checkpoint({self.stage}, {self.key[:12]}, {'cached' if self.cached else 'computed'})"
+
+def _update_digest(digest, value) -> None:
+    # Feed a value into the digest, tagged by type so e.g. 1 and '1' don't collide.
+    if isinstance(value, Checkpoint):
+        digest.update(b'checkpoint:' + value.key.encode())
+    elif isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f'array:{value.dtype.str}:{value.shape}:'.encode())
+        digest.update(repr(value.tolist()).encode() if value.dtype.hasobject else value.view(np.uint8).reshape(-1))
+    elif isinstance(value, dict):
+        digest.update(f'dict:{len(value)}:'.encode())
+        for key in sorted(value, key=str):
+            _update_digest(digest, str(key))
+            _update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'sequence:{len(value)}:'.encode())
+        for item in value:
+            _update_digest(digest, item)
+    elif callable(value) or inspect.ismodule(value):
+        _update_digest(digest, source_digest(value))
+    else:
+        digest.update(f'{type(value).__name__}:{value!r};'.encode())
+
+def digest(*values) -> str:
+    """
+    Content hash of values: arrays by dtype, shape and bytes, containers recursively, checkpoints by their key
+    and functions or modules by their source.
+    """
+    result = hashlib.sha256(str(CHECKPOINT_VERSION).encode())
+    for value in values:
+        _update_digest(result, value)
+    return result.hexdigest()
+
+def source_digest(code: Union[Callable, object]) -> str:
+    """
+    Hash of the source of a function, class or module, falling back to its qualified name when the source isn't
+    available (e.g. builtins).
+    """
+    try:
+        source = inspect.getsource(code)
+    except (OSError, TypeError):
+        source = f'{getattr(code, "__module__", "")}.{getattr(code, "__qualname__", repr(code))}'
+    return hashlib.sha256(source.encode()).hexdigest()
+
+class Pipeline:
+    """
+    Runner of pipeline stages with content-hashed, resumable checkpoints.
+
+    A stage is a function taking the arrays of its input checkpoints (as dicts) and keyword parameters, and
+    returning a dict of arrays, with JSON-serializable values (anything that isn't an array) kept as metadata.
+    Its key hashes the stage name, the source of the function and of the code it depends on, its parameters and
+    the keys of its inputs. When a checkpoint with that key exists the stage is skipped and its arrays are
+    memory-mapped instead, so changing only the last stage (e.g. the fitter) doesn't recompute earlier ones.
+
+    Checkpoints are written as .npy files plus a manifest.json in directory/stage/key, to a temporary directory
+    renamed into place once complete, so an interrupted stage is never mistaken for a finished one.
+    """
+
+    def __init__(self, directory: Union[str, Path] = CHECKPOINT_DIRECTORY, force: Iterable[str] = (),
+                 log: Optional[Callable[[str], None]] = print):
+        """
+        Args:
+            directory (Union[str, Path]): Directory of the checkpoints.
+            force (Iterable[str]): Names of the stages to recompute even if they are checkpointed.
+            log (Optional[Callable[[str], None]]): Called with a line per stage run, None for silence.
+        """
+        self.directory = Path(directory)
+        self.force = set(force)
+        self.log = log
+
+    def run(self, name: str, function: Callable, *inputs: Checkpoint, depends: Iterable = (),
+            settings: Optional[dict] = None, **parameters) -> Checkpoint:
+        """
+        Run a stage, or load its checkpoint if its inputs, parameters and code haven't changed.
+
+        Args:
+            name (str): Name of the stage.
+            function (Callable): Stage function, called as function(*input arrays, **parameters, **settings).
+            inputs (Checkpoint): Checkpoints of the upstream stages.
+            depends (Iterable): Functions, classes or modules the stage's result depends on, hashed by source.
+            settings (Optional[dict]): Keyword arguments that don't change the result (e.g. the number of
+                workers), passed to the function but left out of the key.
+            parameters: Parameters of the stage.
+
+        Returns:
+            Checkpoint: Output of the stage.
+        """
+        key = digest(name, function, tuple(depends), parameters, inputs)
+        path = self.directory / name / key
+
+        if name not in self.force and (path / 'manifest.json').exists():
+            checkpoint = load_checkpoint(path)
+            self._log(f'{name}: cached ({key[:12]})')
+            return checkpoint
+
+        start = time.perf_counter()
+        output = function(*(checkpoint.arrays for checkpoint in inputs), **parameters, **(settings or {}))
+        arrays = {field: value for field, value in output.items() if isinstance(value, np.ndarray)}
+        metadata = {field: value for field, value in output.items() if not isinstance(value, np.ndarray)}
+        elapsed = time.perf_counter() - start
+
+        save_checkpoint(path, name, key, arrays, metadata, elapsed)
+        self._log(f'{name}: computed in {elapsed:.2f}s ({key[:12]})')
+        checkpoint = load_checkpoint(path)
+        checkpoint.cached = False
+        return checkpoint
+
+    def _log(self, line: str) -> None:
+        if self.log is not None:
+            self.log(line)
+
+def save_checkpoint(path: Path, stage: str, key: str, arrays: Dict[str, np.ndarray], metadata: dict,
+                    elapsed: float = 0.0) -> None:
+    """
+    Write a checkpoint to path: one .npy file per array and the manifest, atomically.
+    """
+    temporary = path.with_name(path.name + '.tmp')
+    shutil.rmtree(temporary, ignore_errors=True)
+    temporary.mkdir(parents=True)
+
+    for field, array in arrays.items():
+        np.save(temporary / f'{field}.npy', np.ascontiguousarray(array))
+
+    manifest = {
+        'version': CHECKPOINT_VERSION,
+        'stage': stage,
+        'key': key,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'elapsed': elapsed,
+        'arrays': {field: {'dtype': array.dtype.str, 'shape': list(array.shape)} for field, array in arrays.items()},
+        'metadata': metadata
+    }
+    (temporary / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+
+    shutil.rmtree(path, ignore_errors=True)
+    temporary.rename(path)
+
+def load_checkpoint(path: Union[str, Path]) -> Checkpoint:
+    """
+    Load a checkpoint written by save_checkpoint, memory-mapping its arrays.
+    """
+    path = Path(path)
+    manifest = json.loads((path / 'manifest.json').read_text())
+    arrays = {field: np.load(path / f'{field}.npy', mmap_mode='r') for field in manifest['arrays']}
+    return Checkpoint(manifest['stage'], manifest['key'], arrays, manifest['metadata'], cached=True)
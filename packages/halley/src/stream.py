@@ -0,0 +1,290 @@
+import numpy as np
+import instrument
+from collections import deque
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import KDTree
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, NamedTuple, Optional, Tuple
+from cloud import (
+    DETECTION_NOISE_VARIANCE, GATE_THRESHOLD, load_frame, predict_expected_positions, predict_orbit_positions,
+    search_mahalanobis_neighbors
+)
+
+class Frame:
+    """
+    One image of the stream, held as arrays with its spatial index.
+    """
+    __slots__ = ('index', 'timestamp', 'positions', 'speeds', 'directions', 'confidences', 'tree')
+
+    def __init__(self, index: int, image: dict):
+        """
+        Args:
+            index (int): Sequence number of the frame in the stream.
+            image (dict): Image with a 'timestamp' and a list of 'points' (see cloud.load_frame).
+        """
+        self.index = index
+        self.timestamp = float(image['timestamp'])
+        self.positions, self.speeds, self.directions, self.confidences = load_frame(image)
+        self.tree = KDTree(self.positions)
+        instrument.count('kdtree_builds')
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+class FrameUpdate(NamedTuple):
+    """
+    Associations found for one incoming frame. Entry k links point indices[k] of this frame to point
+    source_indices[k] of the earlier frame with sequence number source_frames[k].
+    """
+    frame: Frame
+    indices: np.ndarray
+    source_frames: np.ndarray
+    source_indices: np.ndarray
+    distances: np.ndarray
+
+    def flight_path_points(self) -> np.ndarray:
+        """
+        Associated points of this frame as rows of (x, y, z, s, C, t), as produced by cloud.cloud.
+        """
+        frame = self.frame
+        return np.column_stack((
+            frame.positions[self.indices],
+            frame.speeds[self.indices],
+            frame.confidences[self.indices],
+            np.full(len(self.indices), frame.timestamp)
+        ))
+
+def assign_globally(rows: np.ndarray, columns: np.ndarray, costs: np.ndarray, unassigned_cost: float
+                    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Minimum total cost one-to-one assignment between candidate (row, column) pairs.
+
+    Every row may also stay unassigned at unassigned_cost, so rows are only matched where that's cheaper than
+    leaving them out. Solved as a sparse minimum weight bipartite matching, so the cost is driven by the number
+    of candidates rather than by the size of the frames.
+
+    Args:
+        rows (np.ndarray): Row (e.g. new point) index of each candidate.
+        columns (np.ndarray): Column (e.g. earlier point) index of each candidate.
+        costs (np.ndarray): Cost of each candidate, all below unassigned_cost.
+        unassigned_cost (float): Cost of leaving a row unassigned.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Matched rows and columns.
+    """
+    if len(rows) == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # Compact the rows and columns that actually have candidates.
+    unique_rows, row_positions = np.unique(rows, return_inverse=True)
+    unique_columns, column_positions = np.unique(columns, return_inverse=True)
+    n_rows, n_columns = len(unique_rows), len(unique_columns)
+
+    # One private "unassigned" column per row, so a full matching of the rows always exists. Weights are
+    # offset by one because explicit zeros would read as missing edges.
+    graph = csr_matrix(
+        (
+            np.concatenate((costs, np.full(n_rows, unassigned_cost))) + 1.0,
+            (
+                np.concatenate((row_positions, np.arange(n_rows))),
+                np.concatenate((column_positions, n_columns + np.arange(n_rows)))
+            )
+        ),
+        shape=(n_rows, n_columns + n_rows)
+    )
+    matched_rows, matched_columns = min_weight_full_bipartite_matching(graph)
+
+    # Drop rows that were left unassigned.
+    assigned = matched_columns < n_columns
+    return unique_rows[matched_rows[assigned]], unique_columns[matched_columns[assigned]]
+
+def associate_orbits(states: np.ndarray, frame: Frame, covariances: Optional[np.ndarray] = None,
+                     noise_variance=DETECTION_NOISE_VARIANCE, threshold: float = GATE_THRESHOLD, workers: int = 1
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Associate known tracks with the points of a frame through their orbits.
+
+    Every track's state is propagated to the frame's timestamp (cloud.predict_orbit_positions), every point
+    inside a track's covariance gate is kept as a hypothesis (cloud.search_mahalanobis_neighbors), and the
+    hypotheses are resolved by a global one-to-one assignment minimizing the total squared Mahalanobis distance.
+
+    Args:
+        states (np.ndarray): Track states of shape (K, 6) or (K, 7), see cloud.predict_orbit_positions.
+        frame (Frame): Incoming frame.
+        covariances (Optional[np.ndarray]): State covariances of shape (K, 6, 6) or (K, 7, 7).
+        noise_variance: Variance of one position coordinate of a detection, a scalar or one per track; must be
+            positive unless the state covariances are.
+        threshold (float): Squared Mahalanobis distance of the gates.
+        workers (int): Number of workers for the queries (-1 uses all cores).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Matched tracks, their points in the frame and the squared
+            Mahalanobis distances between them.
+    """
+    prediction = predict_orbit_positions(states, frame.timestamp, covariances, noise_variance)
+    offsets, indices, squared_distances = search_mahalanobis_neighbors(
+        prediction, frame.positions, threshold, frame.tree, workers
+    )
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    matched_rows, matched_columns = assign_globally(rows, indices, squared_distances, threshold)
+
+    # Distances of the matched pairs, looked up through the candidates' (row, column) keys.
+    keys = rows * len(frame) + indices
+    order = np.argsort(keys)
+    matched = order[np.searchsorted(keys[order], matched_rows * len(frame) + matched_columns)]
+    return matched_rows, matched_columns, squared_distances[matched]
+
+class StreamingCloud:
+    """
+    Frame-by-frame association engine.
+
+    Frames are pushed one at a time. Each new frame is associated against a bounded window of recent frames:
+    its points are predicted back to each earlier frame's timestamp (cloud.predict_expected_positions) and
+    matched to a point of that frame within the tolerance, trying the most recent frame first so that points
+    missing from one frame (drop outs) can still be associated with an older one. Only the window of frames and
+    their KDTrees is kept, so memory stays constant however long the stream runs.
+    """
+
+    def __init__(self, window: int = 4, tolerance: float = 5.0, workers: int = 1, assignment: str = 'nearest',
+                 max_candidates: int = 4, mu: float = 0.0):
+        """
+        Args:
+            window (int): Number of recent frames kept for association.
+            tolerance (float): Tolerance distance for searching nearest neighbors.
+            workers (int): Number of workers for the nearest neighbor queries (-1 uses all cores).
+            assignment (str): 'nearest' links every point to its nearest neighbor, so several points may claim
+                the same earlier point. 'hungarian' gathers up to max_candidates neighbors per point and solves
+                a global one-to-one assignment minimizing the total squared distance.
+            max_candidates (int): Number of candidates per point considered by the 'hungarian' assignment.
+            mu (float): Gravitational parameter of the prediction, 0 for the constant speed model (see
+                cloud.predict_expected_positions).
+        """
+        if assignment not in ('nearest', 'hungarian'):
+            raise ValueError(f"Unknown assignment {assignment!r}, expected 'nearest' or 'hungarian'.")
+        self.window = deque(maxlen=window)
+        self.tolerance = tolerance
+        self.workers = workers
+        self.assignment = assignment
+        self.max_candidates = max_candidates
+        self.mu = mu
+        self.frames_seen = 0
+
+    def eligible(self, previous: Frame) -> Optional[np.ndarray]:
+        """
+        Mask of the points of an earlier frame that new points may be associated with, or None for all of them.
+        """
+        return None
+
+    def associate(self, frame: Frame, previous: Frame, unmatched: np.ndarray
+                  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Associate the unmatched points of a frame with the points of an earlier frame.
+
+        Args:
+            frame (Frame): Incoming frame.
+            previous (Frame): Earlier frame from the window.
+            unmatched (np.ndarray): Indices of the incoming frame's points still to associate.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Matched points of the incoming frame, their matches in the
+                earlier frame and the distances between the predicted and matched positions.
+        """
+        # Predict where the unmatched points were at the earlier frame's timestamp.
+        predicted_positions = predict_expected_positions(
+            frame.positions[unmatched],
+            frame.speeds[unmatched],
+            frame.directions[unmatched],
+            previous.timestamp - frame.timestamp,
+            self.mu
+        )
+
+        # Nearest neighbors within tolerance; misses come back with an infinite distance and index len(previous).
+        # A single neighbor is enough when every point is eligible and the nearest one wins anyway.
+        eligible = self.eligible(previous)
+        k = 1 if self.assignment == 'nearest' and eligible is None else min(self.max_candidates, len(previous))
+        nearest_distances, nearest_indices = previous.tree.query(
+            predicted_positions,
+            k=[*range(1, k + 1)],
+            distance_upper_bound=self.tolerance,
+            workers=self.workers
+        )
+        candidates = np.isfinite(nearest_distances)
+        if eligible is not None:
+            candidates[candidates] = eligible[nearest_indices[candidates]]
+        if instrument.active() is not None:
+            instrument.count('kdtree_queries', len(predicted_positions))
+            instrument.count('association_queries', len(predicted_positions))
+            instrument.count('association_candidates', np.count_nonzero(candidates))
+
+        if self.assignment == 'nearest':
+            # Keep the nearest eligible candidate of each point.
+            matched = np.flatnonzero(candidates.any(axis=1))
+            nearest = candidates[matched].argmax(axis=1)
+            return unmatched[matched], nearest_indices[matched, nearest], nearest_distances[matched, nearest]
+
+        # Global assignment over every candidate pair.
+        rows, columns = np.nonzero(candidates)
+        matched_rows, matched_columns = assign_globally(
+            rows,
+            nearest_indices[rows, columns],
+            nearest_distances[rows, columns]**2,
+            self.tolerance**2
+        )
+        distances = np.linalg.norm(predicted_positions[matched_rows] - previous.positions[matched_columns], axis=1)
+        return unmatched[matched_rows], matched_columns, distances
+
+    def push(self, image: dict) -> FrameUpdate:
+        """
+        Associate an incoming image with the frames in the window, then add it to the window.
+
+        Args:
+            image (dict): Image with a 'timestamp' and a list of 'points'.
+
+        Returns:
+            FrameUpdate: Associations of the new frame's points.
+        """
+        frame = Frame(self.frames_seen, image)
+        self.frames_seen += 1
+
+        indices, source_frames, source_indices, distances = [], [], [], []
+        unmatched = np.arange(len(frame))
+
+        # Most recent frame first; points matched there aren't searched for in older frames.
+        for previous in reversed(self.window):
+            if len(unmatched) == 0 or len(previous) == 0:
+                continue
+
+            matched, matched_previous, matched_distances = self.associate(frame, previous, unmatched)
+
+            indices.append(matched)
+            source_frames.append(np.full(len(matched), previous.index))
+            source_indices.append(matched_previous)
+            distances.append(matched_distances)
+            unmatched = np.setdiff1d(unmatched, matched, assume_unique=True)
+
+        self.window.append(frame)
+
+        if not indices:
+            empty = np.empty(0, dtype=np.intp)
+            return FrameUpdate(frame, empty, empty, empty, np.empty(0))
+        return FrameUpdate(
+            frame,
+            np.concatenate(indices),
+            np.concatenate(source_frames),
+            np.concatenate(source_indices),
+            np.concatenate(distances)
+        )
+
+    def stream(self, images: Iterable[dict]) -> Iterator[FrameUpdate]:
+        """
+        Associate images from an iterable (e.g. a generator reading from a telescope) as they arrive.
+        """
+        for image in images:
+            yield self.push(image)
+
+    async def astream(self, images: AsyncIterable[dict]) -> AsyncIterator[FrameUpdate]:
+        """
+        Associate images from an async iterable as they arrive.
+        """
+        async for image in images:
+            yield self.push(image)
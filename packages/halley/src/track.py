@@ -0,0 +1,138 @@
+import numpy as np
+from typing import Dict, List, NamedTuple, Tuple
+from ellipse import MU_EARTH
+from flightpath import FIELDS, FlightPath
+from stream import Frame, StreamingCloud
+
+class TrackUpdate(NamedTuple):
+    """
+    Track assignment of one incoming frame: the track ID of every point of the frame, and a mask of the points
+    that started a new track.
+    """
+    frame: Frame
+    track_ids: np.ndarray
+    new: np.ndarray
+
+class TrackStore(StreamingCloud):
+    """
+    Streaming tracker that links detections into flight paths with stable track IDs.
+
+    Every detection of an incoming frame is either chained to the latest detection (the head) of an existing
+    track, through the same predicted-to-observed association as StreamingCloud, or starts a new track. Only
+    track heads are candidates, so a track never forks, and conflicting candidates are resolved by the global
+    assignment ('hungarian' by default). A head stays a candidate until it leaves the window, so a track
+    survives missed detections: the prediction over the gap follows two-body motion around the Earth by
+    default, which stays within the tolerance over several frames where the constant speed model doesn't. The
+    detections of every track are kept in columnar form and handed out grouped per track, ready to fit.
+    """
+
+    def __init__(self, window: int = 4, tolerance: float = 5.0, workers: int = 1, assignment: str = 'hungarian',
+                 max_candidates: int = 4, mu: float = MU_EARTH):
+        """
+        Args:
+            window (int): Number of recent frames kept for association; tracks unseen for longer aren't extended.
+            tolerance (float): Tolerance distance for searching nearest neighbors.
+            workers (int): Number of workers for the nearest neighbor queries (-1 uses all cores).
+            assignment (str): 'hungarian' (global assignment) or 'nearest' (greedy).
+            max_candidates (int): Number of candidates per point considered by the 'hungarian' assignment.
+            mu (float): Gravitational parameter of the prediction, in km^3 / s^2; 0 for the constant speed model.
+        """
+        super().__init__(window, tolerance, workers, assignment, max_candidates, mu)
+        self.next_track_id = 0
+        # Track IDs and head masks of the points of the frames in the window, by frame sequence number.
+        self._track_ids: Dict[int, np.ndarray] = {}
+        self._heads: Dict[int, np.ndarray] = {}
+        # Detections of every frame seen: track IDs and (6, n) flight path columns.
+        self._detection_ids: List[np.ndarray] = []
+        self._detections: List[np.ndarray] = []
+
+    def eligible(self, previous: Frame) -> np.ndarray:
+        return self._heads[previous.index]
+
+    def push(self, image: dict) -> TrackUpdate:
+        """
+        Associate an incoming image and assign a track ID to each of its points.
+
+        Args:
+            image (dict): Image with a 'timestamp' and a list of 'points'.
+
+        Returns:
+            TrackUpdate: Track IDs of the new frame's points.
+        """
+        update = super().push(image)
+        frame = update.frame
+
+        # Chain associated points onto the tracks of their matches; the matches stop being heads.
+        track_ids = np.full(len(frame), -1, dtype=np.int64)
+        for source_frame in np.unique(update.source_frames):
+            selected = update.source_frames == source_frame
+            source_indices = update.source_indices[selected]
+            track_ids[update.indices[selected]] = self._track_ids[source_frame][source_indices]
+            self._heads[source_frame][source_indices] = False
+
+        # Unassociated points start new tracks.
+        new = track_ids < 0
+        track_ids[new] = self.next_track_id + np.arange(np.count_nonzero(new))
+        self.next_track_id += int(np.count_nonzero(new))
+
+        self._track_ids[frame.index] = track_ids
+        self._heads[frame.index] = np.ones(len(frame), dtype=bool)
+
+        # Forget frames that have left the window.
+        oldest = self.window[0].index
+        for index in [index for index in self._track_ids if index < oldest]:
+            del self._track_ids[index]
+            del self._heads[index]
+
+        # Record the detections in flight path column order.
+        columns = np.empty((len(FIELDS), len(frame)))
+        columns[:3] = frame.positions.T
+        columns[3] = frame.speeds
+        columns[4] = frame.timestamp
+        columns[5] = frame.confidences
+        self._detection_ids.append(track_ids)
+        self._detections.append(columns)
+
+        return TrackUpdate(frame, track_ids, new)
+
+    def detections(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every detection seen so far, in arrival order.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Track ID of every detection and the (6, n) flight path columns.
+        """
+        if not self._detections:
+            return np.empty(0, dtype=np.int64), np.empty((len(FIELDS), 0))
+
+        # Compact the per-frame chunks.
+        self._detection_ids = [np.concatenate(self._detection_ids)]
+        self._detections = [np.concatenate(self._detections, axis=1)]
+        return self._detection_ids[0], self._detections[0]
+
+    def flight_paths(self, min_length: int = 1) -> Dict[int, FlightPath]:
+        """
+        Detections grouped per track, in time order.
+
+        Args:
+            min_length (int): Minimum number of detections of a returned track.
+
+        Returns:
+            Dict[int, FlightPath]: Flight path of every track, by track ID. The flight paths are views into one
+                array sorted by track ID.
+        """
+        if not self._detections:
+            return {}
+
+        # Group by track with one stable sort (frames arrive in time order).
+        detection_ids, detections = self.detections()
+        order = np.argsort(detection_ids, kind='stable')
+        ids = detection_ids[order]
+        values = detections[:, order]
+
+        track_ids, starts, counts = np.unique(ids, return_index=True, return_counts=True)
+        return {
+            int(track_id): FlightPath(values[:, start:start + count])
+            for track_id, start, count in zip(track_ids, starts, counts)
+            if count >= min_length
+        }
@@ -1,18 +1,29 @@
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
-
-# Example flight data
-flight_data = [
-    {"x": 0.09834656272990491, "y": 1.3058987135924756, "z": -0.4216147641794593, "C": 0.1294812, "t": 1000},
-    {"x": -1.394440151263701, "y": -1.0377787399951643, "z": -3.1146443337834087, "C": 0.71409183571, "t": 2000},
-    # More points...
-]
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
+from pathlib import Path
+from typing import Optional, Sequence, Union
+from ellipse import EARTH_RADIUS, orbital_plane_basis
+
+# Coordinate axes of each 2D projection of the catalog overview.
+PROJECTIONS = {'xy': (0, 1), 'xz': (0, 2), 'yz': (1, 2)}
+
+# Level of detail of the catalog overview.
+ORBIT_SAMPLES = 128 # Points per drawn orbit.
+MAX_SEGMENTS = 500_000 # Orbits are drawn with fewer points each when they would exceed this many segments.
+MAX_LINES = 5_000 # More orbits than this are drawn as a density image of their samples instead of lines.
+MAX_SCATTER_POINTS = 50_000 # Larger point sets are drawn as a density image, or decimated.
+DENSITY_BINS = 512 # Bins per axis of the density image.
 
 def plot_flight_path(ellipse_params):
     """
     Plot flight path as a yellow ellipse given ellipse parameters.
-    
+
     Parameters:
         ellipse_params (dict): Dictionary containing ellipse parameters:
             - 'a': Semi-major axis
@@ -20,15 +31,9 @@ def plot_flight_path(ellipse_params):
             - 'center': Tuple containing (x, y) coordinates of the center
             - 'angle': Angle of rotation (in degrees)
     """
-    a = ellipse_params['a']
-    b = ellipse_params['b']
-    center = ellipse_params['center']
-    angle = np.radians(ellipse_params['angle'])
-
-    # Generate points on the ellipse
-    t = np.linspace(0, 2 * np.pi, 100)
-    x = center[0] + a * np.cos(t) * np.cos(angle) - b * np.sin(t) * np.sin(angle)
-    y = center[1] + a * np.cos(t) * np.sin(angle) + b * np.sin(t) * np.cos(angle)
+    x, y = sample_ellipses(
+        ellipse_params['a'], ellipse_params['b'], [ellipse_params['center']], np.radians(ellipse_params['angle']), 100
+    )[0].T
 
     # Plot the ellipse
     plt.plot(x, y, color='yellow')
@@ -43,42 +48,188 @@ def plot_flight_path(ellipse_params):
     plt.axis('equal')
     plt.show()
 
+def sample_ellipses(a, b, centers, angles, n_samples=ORBIT_SAMPLES):
+    """
+    Sample points on many 2D ellipses at once.
 
-# Convert flight data units to matplotlib units (if needed)
-
-# Extract x, y, z coordinates from flight data
-x_coords = [point['x'] for point in flight_data]
-y_coords = [point['y'] for point in flight_data]
-z_coords = [point['z'] for point in flight_data]
-
-# Convert coordinates to numpy arrays for easier manipulation (if needed)
-x_coords = np.array(x_coords)
-y_coords = np.array(y_coords)
-z_coords = np.array(z_coords)
-
-# Create a 3D plot
-fig = plt.figure()
-ax = fig.add_subplot(111, projection='3d')
-
-# Plot Earth as a transparent wireframe (spherical)
-u = np.linspace(0, 2 * np.pi, 100)
-v = np.linspace(0, np.pi, 100)
-earth_x = np.outer(np.cos(u), np.sin(v))
-earth_y = np.outer(np.sin(u), np.sin(v))
-earth_z = np.outer(np.ones(np.size(u)), np.cos(v))
-ax.plot_surface(earth_x, earth_y, earth_z, color='b', alpha=0.2)
+    Parameters:
+        a (array-like): Semi-major axes, of shape (K,) or scalar.
+        b (array-like): Semi-minor axes, of shape (K,) or scalar.
+        centers (array-like): Centers of shape (K, 2).
+        angles (array-like): Angles of rotation in radians, of shape (K,) or scalar.
+        n_samples (int): Points per ellipse; the first point is repeated at the end to close the curve.
+
+    Returns:
+        points (np.ndarray): Array of shape (K, n_samples, 2).
+    """
+    t = np.linspace(0, 2 * np.pi, n_samples)
+    cos_t, sin_t = np.cos(t), np.sin(t)
+    a, b, angles = (np.asarray(value, dtype=float)[..., np.newaxis] for value in (a, b, angles))
+    centers = np.asarray(centers, dtype=float)
+    cos_angle, sin_angle = np.cos(angles), np.sin(angles)
+    x = centers[:, 0, np.newaxis] + a * cos_t * cos_angle - b * sin_t * sin_angle
+    y = centers[:, 1, np.newaxis] + a * cos_t * sin_angle + b * sin_t * cos_angle
+    return np.stack((x, y), axis=-1)
+
+def sample_orbits(elements, n_samples=ORBIT_SAMPLES):
+    """
+    Sample points on many orbits at once, evenly spaced in eccentric anomaly (no Kepler solve needed).
 
-# Plot flight path as a yellow ellipse
-# You would need to compute the ellipse points based on your estimated parameters
+    Parameters:
+        elements (array-like): Keplerian elements [a, e, incl, omega, Omega, M] of shape (K, 6); M is ignored.
+        n_samples (int): Points per orbit; the first point is repeated at the end to close the curve.
 
-# Plot points along the flight path as red dots
-ax.scatter(x_coords, y_coords, z_coords, color='r', marker='o')
+    Returns:
+        points (np.ndarray): Array of shape (K, n_samples, 3).
+    """
+    a, e, incl, omega, Omega, _ = (column[:, np.newaxis] for column in np.asarray(elements, dtype=float).T)
+    E = np.linspace(0, 2 * np.pi, n_samples)
+    P, Q = orbital_plane_basis(incl, omega, Omega)
+    x = (a * (np.cos(E) - e))[..., np.newaxis]
+    y = (a * np.sqrt(1 - e**2) * np.sin(E))[..., np.newaxis]
+    return x * P + y * Q
+
+def render_catalog(path: Union[str, Path], elements: Optional[np.ndarray] = None, orbits: Optional[np.ndarray] = None,
+                   points: Optional[np.ndarray] = None, projections: Sequence[str] = ('xy', 'xz', 'yz'),
+                   density: Optional[bool] = None, title: Optional[str] = None, size: float = 6.0, dpi: int = 150,
+                   seed: Optional[int] = 0) -> None:
+    """
+    Render an overview of a catalog to an image file, without a display.
+
+    Every projection gets its own panel with the Earth as a disc. Orbits are drawn as one LineCollection per
+    panel, with fewer points per orbit when the catalog is large, and past MAX_LINES orbits as the density of
+    their samples. Point sets larger than MAX_SCATTER_POINTS are
+    rasterized into a log-scaled density image (or randomly decimated, with density=False), so rendering
+    time stays bounded however many tracks there are.
+
+    Args:
+        path (Union[str, Path]): Output file; the format follows the suffix (e.g. .png, .svg, .pdf).
+        elements (Optional[np.ndarray]): Keplerian elements of shape (K, 6) of the orbits to draw.
+        orbits (Optional[np.ndarray]): Already sampled orbits or tracks to draw as lines, of shape (K, n, 3).
+        points (Optional[np.ndarray]): Observed points of shape (N, 3); NaN rows are skipped.
+        projections (Sequence[str]): Panels to draw, from PROJECTIONS.
+        density (Optional[bool]): Draw the points as a density image. Defaults to doing so only for large sets.
+        title (Optional[str]): Figure title.
+        size (float): Size of each panel in inches.
+        dpi (int): Resolution of raster output.
+        seed (Optional[int]): Seed of the decimation.
+    """
+    for projection in projections:
+        if projection not in PROJECTIONS:
+            raise ValueError(f"Unknown projection {projection!r}, expected one of {tuple(PROJECTIONS)}.")
+
+    # Orbits, with a level of detail that bounds the number of segments.
+    lines = [] if orbits is None else [np.asarray(orbits, dtype=float)]
+    if elements is not None and len(elements):
+        n_samples = int(np.clip(MAX_SEGMENTS // len(elements), 8, ORBIT_SAMPLES))
+        lines.append(sample_orbits(elements, n_samples))
+    lines = [line for line in lines if len(line)]
+    line_density = sum(len(line) for line in lines) > MAX_LINES
+
+    # Points, decimated unless drawn as a density image.
+    if points is not None:
+        points = np.asarray(points, dtype=float)
+        points = points[~np.isnan(points).any(axis=1)]
+        if density is None:
+            density = len(points) > MAX_SCATTER_POINTS
+        if not density and len(points) > MAX_SCATTER_POINTS:
+            points = points[np.random.default_rng(seed).choice(len(points), MAX_SCATTER_POINTS, replace=False)]
+
+    # Extent shared by every panel, so they are to the same scale.
+    extents = [EARTH_RADIUS] + [np.nanmax(np.abs(line)) for line in lines]
+    if points is not None and len(points):
+        extents.append(np.max(np.abs(points)))
+    extent = 1.05 * max(extents)
+
+    figure = Figure(figsize=(size * len(projections), size), layout='constrained')
+    FigureCanvasAgg(figure)
+    for i, projection in enumerate(projections):
+        ax = figure.add_subplot(1, len(projections), i + 1)
+        first, second = PROJECTIONS[projection]
+
+        # Earth as a disc.
+        ax.add_patch(Circle((0, 0), EARTH_RADIUS, color='b', alpha=0.2, zorder=0))
+
+        # Orbits as batched line collections, the alpha fading as they get denser, or for very many orbits as the
+        # density of their samples (drawing cost grows with the number of lines, not of pixels).
+        if line_density:
+            samples = np.concatenate([line.reshape(-1, 3) for line in lines])
+            counts, _, _ = np.histogram2d(
+                samples[:, first], samples[:, second], bins=DENSITY_BINS, range=[[-extent, extent]] * 2
+            )
+            ax.imshow(
+                np.ma.masked_equal(counts.T, 0), origin='lower', extent=(-extent, extent, -extent, extent),
+                cmap='YlOrBr_r', norm=LogNorm(), alpha=0.6, interpolation='nearest', zorder=1
+            )
+        else:
+            for line in lines:
+                alpha = float(np.clip(200 / len(line), 0.02, 0.8))
+                ax.add_collection(LineCollection(
+                    line[..., [first, second]], colors='y', linewidths=0.5, alpha=alpha, rasterized=True, zorder=1
+                ))
+
+        # Points as a density image or a rasterized scatter.
+        if points is not None and len(points):
+            if density:
+                counts, _, _ = np.histogram2d(
+                    points[:, first], points[:, second], bins=DENSITY_BINS, range=[[-extent, extent]] * 2
+                )
+                ax.imshow(
+                    np.ma.masked_equal(counts.T, 0), origin='lower', extent=(-extent, extent, -extent, extent),
+                    cmap='inferno', norm=LogNorm(), interpolation='nearest', zorder=2
+                )
+            else:
+                ax.scatter(points[:, first], points[:, second], s=1, c='r', marker='.', linewidths=0, rasterized=True, zorder=2)
+
+        ax.set_xlim(-extent, extent)
+        ax.set_ylim(-extent, extent)
+        ax.set_aspect('equal')
+        ax.set_xlabel(projection[0].upper())
+        ax.set_ylabel(projection[1].upper())
+        ax.grid(True, linewidth=0.3)
+
+    if title is not None:
+        figure.suptitle(title)
+    figure.savefig(path, dpi=dpi)
+
+if __name__ == "__main__":
+    # Example flight data
+    flight_data = [
+        {"x": 0.09834656272990491, "y": 1.3058987135924756, "z": -0.4216147641794593, "C": 0.1294812, "t": 1000},
+        {"x": -1.394440151263701, "y": -1.0377787399951643, "z": -3.1146443337834087, "C": 0.71409183571, "t": 2000},
+        # More points...
+    ]
+
+    # Convert flight data units to matplotlib units (if needed)
+
+    # Extract x, y, z coordinates from flight data
+    x_coords = np.array([point['x'] for point in flight_data])
+    y_coords = np.array([point['y'] for point in flight_data])
+    z_coords = np.array([point['z'] for point in flight_data])
+
+    # Create a 3D plot
+    fig = plt.figure()
+    ax = fig.add_subplot(111, projection='3d')
+
+    # Plot Earth as a transparent wireframe (spherical)
+    u = np.linspace(0, 2 * np.pi, 100)
+    v = np.linspace(0, np.pi, 100)
+    earth_x = np.outer(np.cos(u), np.sin(v))
+    earth_y = np.outer(np.sin(u), np.sin(v))
+    earth_z = np.outer(np.ones(np.size(u)), np.cos(v))
+    ax.plot_surface(earth_x, earth_y, earth_z, color='b', alpha=0.2)
+
+    # Plot flight path as a yellow ellipse
+    # You would need to compute the ellipse points based on your estimated parameters
+
+    # Plot points along the flight path as red dots
+    ax.scatter(x_coords, y_coords, z_coords, color='r', marker='o')
 
-# Set labels and title
-ax.set_xlabel('X')
-ax.set_ylabel('Y')
-ax.set_zlabel('Z')
-ax.set_title('Estimated Flight Path')
+    # Set labels and title
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_zlabel('Z')
+    ax.set_title('Estimated Flight Path')
 
-# Show plot
-plt.show()
+    # Show plot
+    plt.show()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The halley modules are flat files under src/ importing each other by name.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
@@ -0,0 +1,109 @@
+import numpy as np
+from scipy.optimize import minimize
+from conjunction import node_filter, screen
+from ellipse import eccentric_anomaly_from_true, ellipse_model, mean_motion, orbital_plane_basis
+
+THRESHOLD = 5.0
+
+# Eccentric, near-coplanar pairs (about 1° to 2° of mutual inclination) whose orbits pass within THRESHOLD of
+# each other, yet whose radii at the line of nodes differ by more than THRESHOLD plus a fixed 10 km margin.
+REGRESSIONS = [
+    ([8590.744682332728, 0.36501710125861686, 0.7826416153208693, 4.325007079823374, 3.192746668535688],
+     [8815.961245427623, 0.34218386570566517, 0.7940161576459125, 4.600320208266645, 3.168096647405687]),
+    ([7029.5400098389, 0.37232455347826915, 2.5059241915869093, 2.696860047997112, 1.8381264398418051],
+     [7252.924542445702, 0.39547919248932345, 2.5319712195951483, 2.409903013402236, 1.8243539203917842]),
+    ([7326.56685864328, 0.36626667531759965, 1.0277079107332983, 3.581042924347189, 3.118390043875914],
+     [7127.887157357447, 0.3724355371647334, 1.0045774490759523, 3.405115545501577, 3.114519103219595]),
+]
+
+def _position(elements, nu):
+    a, e, incl, omega, Omega = elements[:5]
+    P, Q = orbital_plane_basis(incl, omega, Omega)
+    r = a * (1 - e**2) / (1 + e * np.cos(nu))
+    return (r * np.cos(nu))[..., np.newaxis] * P + (r * np.sin(nu))[..., np.newaxis] * Q
+
+def _moid(first, second, samples=360):
+    # Minimum distance between two orbit curves and the true anomalies where it occurs: a grid search refined
+    # from its best cells.
+    grid = np.linspace(0, 2 * np.pi, samples, endpoint=False)
+    distances = np.linalg.norm(_position(first, grid)[:, np.newaxis] - _position(second, grid), axis=-1)
+    best = (np.inf, None)
+    for cell in np.argsort(distances, axis=None)[:20]:
+        i, j = np.unravel_index(cell, distances.shape)
+        result = minimize(
+            lambda nu: np.linalg.norm(_position(first, nu[0]) - _position(second, nu[1])), [grid[i], grid[j]],
+            method='Nelder-Mead', options={'xatol': 1e-10, 'fatol': 1e-9}
+        )
+        best = min(best, (result.fun, result.x), key=lambda candidate: candidate[0])
+    return best
+
+def _phase(elements, true_anomaly, time):
+    # Mean anomaly at epoch putting the orbit at true_anomaly at time.
+    e = elements[1]
+    eccentric_anomaly = eccentric_anomaly_from_true(true_anomaly, e)
+    return eccentric_anomaly - e * np.sin(eccentric_anomaly) - mean_motion(elements[0]) * time
+
+def _near_coplanar_pairs(n_pairs, seed):
+    rng = np.random.default_rng(seed)
+    first = np.column_stack((
+        rng.uniform(7000, 9000, n_pairs), rng.uniform(0.2, 0.4, n_pairs), rng.uniform(0, np.pi, n_pairs),
+        rng.uniform(0, 2 * np.pi, n_pairs), rng.uniform(0, 2 * np.pi, n_pairs)
+    ))
+    second = first + np.column_stack((
+        rng.uniform(-250, 250, n_pairs), rng.uniform(-0.03, 0.03, n_pairs), rng.uniform(-0.03, 0.03, n_pairs),
+        rng.uniform(-0.3, 0.3, n_pairs), rng.uniform(-0.03, 0.03, n_pairs)
+    ))
+    # Every other pair gets the semi-major axis of its second orbit set so the orbits cross the line of nodes
+    # less than THRESHOLD apart.
+    for k in range(0, n_pairs, 2):
+        P, Q = orbital_plane_basis(*first[k, 2:5])
+        normal = np.cross(P, Q)
+        P_second, Q_second = orbital_plane_basis(*second[k, 2:5])
+        node = np.cross(normal, np.cross(P_second, Q_second))
+        radius = np.linalg.norm(_position(first[k], np.arctan2(node @ Q, node @ P)))
+        e, nu = second[k, 1], np.arctan2(node @ Q_second, node @ P_second)
+        second[k, 0] = (radius + rng.uniform(0, THRESHOLD - 0.5)) * (1 + e * np.cos(nu)) / (1 - e**2)
+    return list(zip(first.tolist(), second.tolist()))
+
+def test_node_filter_keeps_close_eccentric_near_coplanar_pairs():
+    elements = np.array([orbit + [0.0] for pair in REGRESSIONS for orbit in pair])
+    for k in range(len(REGRESSIONS)):
+        assert _moid(elements[2 * k], elements[2 * k + 1])[0] < THRESHOLD
+    first = np.arange(0, len(elements), 2)
+    assert node_filter(elements, first, first + 1, THRESHOLD).all()
+
+def test_screen_matches_brute_force_on_eccentric_near_coplanar_pairs():
+    # Every pair is phased to be at its closest points at t = 1000 s, so those with a MOID below the threshold
+    # really meet.
+    pairs = REGRESSIONS + _near_coplanar_pairs(24, seed=0)
+    elements = []
+    for first, second in pairs:
+        first, second = np.array(first + [0.0]), np.array(second + [0.0])
+        _, (nu_first, nu_second) = _moid(first, second)
+        first[5], second[5] = _phase(first, nu_first, 1000.0), _phase(second, nu_second, 1000.0)
+        elements += [first, second]
+    elements = np.array(elements)
+    first = np.arange(0, len(elements), 2)
+    second = first + 1
+
+    # Brute force: the distance of every pair every 0.05 s.
+    times = np.arange(0.0, 2000.0, 0.05)
+    n = mean_motion(elements[:, 0])
+    brute = np.linalg.norm(
+        ellipse_model(elements[first], times, n[first]) - ellipse_model(elements[second], times, n[second]), axis=-1
+    ).min(axis=1)
+    assert (brute < THRESHOLD).sum() >= len(REGRESSIONS) + 6
+
+    conjunctions = screen(elements, 0.0, 2000.0, threshold=THRESHOLD)
+    found = {}
+    for i, j, distance in zip(conjunctions.first, conjunctions.second, conjunctions.distances):
+        key = (min(i, j), max(i, j))
+        found[key] = min(found.get(key, np.inf), distance)
+
+    # Relative speeds stay below 2 km/s, so the sampled minima are within 0.05 km of the true ones.
+    for k in range(len(pairs)):
+        key = (first[k], second[k])
+        if brute[k] < THRESHOLD - 0.05:
+            assert key in found, f'pair {k} missed at {brute[k]:.3f} km'
+        if key in found:
+            assert abs(found[key] - brute[k]) <= 0.05
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from ellipse import ellipse_model, ellipse_model_jacobian, mean_motion
+
+PARAMS = np.array([
+    [7200.0, 0.001, 0.9, 0.4, 1.0, 0.3],
+    [8000.0, 0.3, 1.7, 5.1, 3.0, 2.0],
+    [11000.0, 0.7, 0.05, 2.2, 4.4, 6.0],
+])
+TIMES = np.linspace(0.0, 9000.0, 41)
+
+@pytest.mark.parametrize('params', PARAMS)
+def test_jacobian_matches_finite_differences(params):
+    n = mean_motion(params[0])
+    points, jacobian = ellipse_model_jacobian(params, TIMES, n)
+    np.testing.assert_allclose(points, ellipse_model(params, TIMES, n), rtol=0, atol=1e-9)
+
+    # Central differences, with steps of about 1e-7 of each element's scale.
+    steps = np.array([1e-3, 1e-7, 1e-7, 1e-7, 1e-7, 1e-7])
+    for k, h in enumerate(steps):
+        shift = np.zeros(6)
+        shift[k] = h
+        difference = (ellipse_model(params + shift, TIMES, n) - ellipse_model(params - shift, TIMES, n)) / (2 * h)
+        np.testing.assert_allclose(jacobian[..., k], difference, rtol=0, atol=1e-6 * np.abs(difference).max())
+
+def test_batched_jacobian_matches_single():
+    n = mean_motion(PARAMS[:, 0])
+    points, jacobian = ellipse_model_jacobian(PARAMS, TIMES, n)
+    assert jacobian.shape == (len(PARAMS), len(TIMES), 3, 6)
+    for k, params in enumerate(PARAMS):
+        single_points, single_jacobian = ellipse_model_jacobian(params, TIMES, n[k])
+        np.testing.assert_allclose(points[k], single_points, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(jacobian[k], single_jacobian, rtol=1e-12, atol=1e-9)
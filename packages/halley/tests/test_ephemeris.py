@@ -0,0 +1,61 @@
+import numpy as np
+from ellipse import ellipse_model, mean_motion
+from ephemeris import SPAN_SEGMENTS, EphemerisCache
+
+def _catalog(n_objects, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((
+        rng.uniform(6800, 12000, n_objects), rng.uniform(0.0, 0.7, n_objects), rng.uniform(0, np.pi, n_objects),
+        rng.uniform(0, 2 * np.pi, n_objects), rng.uniform(0, 2 * np.pi, n_objects), rng.uniform(0, 2 * np.pi, n_objects)
+    ))
+
+ELEMENTS = _catalog(25)
+
+def _queries(n_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, len(ELEMENTS), n_queries), rng.uniform(-5000.0, 50000.0, n_queries)
+
+def _exact(object_ids, times):
+    return ellipse_model(ELEMENTS[object_ids], times[:, np.newaxis], mean_motion(ELEMENTS[object_ids, 0]))[:, 0]
+
+def test_positions_within_tolerance():
+    object_ids, times = _queries(5000)
+    for tolerance in (1e-2, 1e-3, 1e-5):
+        cache = EphemerisCache(ELEMENTS, tolerance=tolerance)
+        errors = np.linalg.norm(cache.positions(object_ids, times) - _exact(object_ids, times), axis=-1)
+        assert errors.max() <= tolerance
+
+def test_lookups_reuse_fitted_spans():
+    object_ids, times = _queries(2000)
+    cache = EphemerisCache(ELEMENTS)
+    first = cache.positions(object_ids, times)
+    misses = cache.misses
+    assert cache.hits == 0 and misses == len(np.unique(
+        np.floor_divide(np.floor(times / cache.segment_lengths[object_ids]), SPAN_SEGMENTS) * len(ELEMENTS) + object_ids
+    ))
+    np.testing.assert_array_equal(cache.positions(object_ids, times), first)
+    assert cache.misses == misses and cache.hits == misses
+
+def test_eviction_under_a_tiny_memory_cap():
+    object_ids, times = _queries(3000)
+    cache = EphemerisCache(ELEMENTS)
+    expected = cache.positions(object_ids, times)
+
+    block_bytes = cache.pool[0].nbytes
+    for blocks in (1, 2, 7):
+        small = EphemerisCache(ELEMENTS, max_bytes=blocks * block_bytes)
+        assert len(small.pool) == blocks
+        np.testing.assert_allclose(small.positions(object_ids, times), expected, rtol=0, atol=1e-9)
+        # Again, in a different order, through spans evicted and refitted in between.
+        np.testing.assert_allclose(small.positions(object_ids[::-1], times[::-1]), expected[::-1], rtol=0, atol=1e-9)
+        assert small.nbytes <= blocks * block_bytes
+        assert small.misses > cache.misses
+
+def test_clear():
+    object_ids, times = _queries(500)
+    cache = EphemerisCache(ELEMENTS, max_bytes=0)
+    expected = cache.positions(object_ids, times)
+    assert cache.nbytes > 0
+    cache.clear()
+    assert cache.nbytes == 0 and len(cache.free) == len(cache.pool)
+    np.testing.assert_array_equal(cache.positions(object_ids, times), expected)
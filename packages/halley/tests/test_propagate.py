@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from ellipse import ellipse_model, mean_motion
+from propagate import propagate, propagate_chunks
+
+def _catalog(n_objects, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((
+        rng.uniform(6800, 12000, n_objects), rng.uniform(0.0, 0.5, n_objects), rng.uniform(0, np.pi, n_objects),
+        rng.uniform(0, 2 * np.pi, n_objects), rng.uniform(0, 2 * np.pi, n_objects), rng.uniform(0, 2 * np.pi, n_objects)
+    ))
+
+ELEMENTS = _catalog(37)
+TIMESTAMPS = np.linspace(0.0, 20000.0, 53)
+
+def test_propagate_matches_ellipse_model():
+    expected = ellipse_model(ELEMENTS, TIMESTAMPS, mean_motion(ELEMENTS[:, 0]))
+    np.testing.assert_allclose(propagate(ELEMENTS, TIMESTAMPS), expected, rtol=0, atol=1e-6)
+
+def test_velocities_match_finite_differences():
+    h = 1e-3
+    _, velocities = propagate(ELEMENTS, TIMESTAMPS, velocities=True)
+    differences = (propagate(ELEMENTS, TIMESTAMPS + h) - propagate(ELEMENTS, TIMESTAMPS - h)) / (2 * h)
+    np.testing.assert_allclose(velocities, differences, rtol=0, atol=1e-6)
+
+@pytest.mark.parametrize('chunk_size', [1, 53, 200, 10**6])
+@pytest.mark.parametrize('workers', [1, 3])
+def test_chunks_and_threads_match_whole(chunk_size, workers):
+    positions, velocities = propagate(ELEMENTS, TIMESTAMPS, velocities=True)
+    chunked = propagate(ELEMENTS, TIMESTAMPS, velocities=True, chunk_size=chunk_size, workers=workers)
+    np.testing.assert_array_equal(chunked[0], positions)
+    np.testing.assert_array_equal(chunked[1], velocities)
+
+def test_propagate_chunks_cover_the_catalog():
+    positions, velocities = propagate(ELEMENTS, TIMESTAMPS, velocities=True)
+    covered = np.zeros(len(ELEMENTS), dtype=int)
+    for chunk, chunk_positions, chunk_velocities in propagate_chunks(ELEMENTS, TIMESTAMPS, velocities=True, chunk_size=200):
+        covered[chunk] += 1
+        np.testing.assert_array_equal(chunk_positions, positions[chunk])
+        np.testing.assert_array_equal(chunk_velocities, velocities[chunk])
+    assert (covered == 1).all()
+
+def test_memory_mapped_output(tmp_path):
+    positions, velocities = propagate(ELEMENTS, TIMESTAMPS, velocities=True)
+    mapped, mapped_velocities = propagate(
+        ELEMENTS, TIMESTAMPS, velocities=True, path=tmp_path / 'ephemerides.npy', chunk_size=100, workers=2
+    )
+    assert isinstance(mapped, np.memmap) and isinstance(mapped_velocities, np.memmap)
+    np.testing.assert_array_equal(np.load(tmp_path / 'ephemerides.npy'), positions)
+    np.testing.assert_array_equal(np.load(tmp_path / 'ephemerides.velocities.npy'), velocities)
+
+def test_float32_output():
+    positions = propagate(ELEMENTS, TIMESTAMPS)
+    single = propagate(ELEMENTS, TIMESTAMPS, dtype=np.float32, chunk_size=100)
+    assert single.dtype == np.float32
+    # Rounding only: float32 keeps about 7 significant digits of positions up to 18000 km.
+    np.testing.assert_allclose(single, positions, rtol=0, atol=2e-3)
+
+def test_output_checks():
+    with pytest.raises(ValueError):
+        propagate(ELEMENTS, TIMESTAMPS, dtype=np.float16)
+    with pytest.raises(ValueError):
+        propagate(ELEMENTS, TIMESTAMPS, out=np.empty((len(ELEMENTS), len(TIMESTAMPS) + 1, 3)))
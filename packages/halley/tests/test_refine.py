@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from ellipse import ellipse_model, mean_motion
+from flightpath import FlightPath
+from refine import initial_state, refit, update
+from sample import generate_catalog
+
+TIMESTAMPS = np.arange(360) * 60.0
+
+@pytest.fixture(scope='module')
+def catalog():
+    return next(generate_catalog(3, TIMESTAMPS, noise=0.05, seed=0))
+
+def _initial_state(chunk, k):
+    # Proximity threshold of the period estimate: the median distance between detections, as in main.
+    steps = np.linalg.norm(np.diff(chunk.positions[k, :300], axis=0), axis=-1)
+    return initial_state(_flight_path(chunk, k, slice(0, 300)), proximity_threshold_mod=float(np.median(steps)))
+
+def _flight_path(chunk, k, frames):
+    positions = chunk.positions[k, frames]
+    return FlightPath.from_columns(positions[:, 0], positions[:, 1], positions[:, 2], 0.0, TIMESTAMPS[frames], 1.0)
+
+def _truth(chunk, k, times):
+    return ellipse_model(chunk.elements[k], times, mean_motion(chunk.elements[k, 0]))
+
+@pytest.mark.parametrize('k', range(3))
+def test_initial_state_finds_the_true_orbit(catalog, k):
+    state = _initial_state(catalog, k)
+    assert abs(state.elements[0] - catalog.elements[k, 0]) < 1e-3 * catalog.elements[k, 0]
+    errors = np.linalg.norm(state.predict(TIMESTAMPS[300:]) - _truth(catalog, k, TIMESTAMPS[300:]), axis=-1)
+    assert errors.max() < 0.5
+
+@pytest.mark.parametrize('k', range(3))
+def test_updates_from_the_initial_state_track_the_orbit(catalog, k):
+    state = _initial_state(catalog, k)
+    updated = update(state, catalog.positions[k, 300:330], TIMESTAMPS[300:330])
+    refitted = refit(updated, _flight_path(catalog, k, slice(330, 360)))
+    assert refitted.observations == 360
+    for estimate in (updated, refitted):
+        errors = np.linalg.norm(estimate.predict(TIMESTAMPS) - _truth(catalog, k, TIMESTAMPS), axis=-1)
+        assert errors.max() < 0.5
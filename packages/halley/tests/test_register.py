@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from register import chain_poses, optimize_pose_graph, register_frames
+
+def _drift(n_frames, rotation_noise, translation_noise, seed):
+    # Poses (R_k, t_k) mapping frame k into frame 0, drifting as a random walk from the identity.
+    rng = np.random.default_rng(seed)
+    rotvecs = np.cumsum(rng.normal(0, rotation_noise, (n_frames, 3)), axis=0)
+    translations = np.cumsum(rng.normal(0, translation_noise, (n_frames, 3)), axis=0)
+    rotvecs[0], translations[0] = 0.0, 0.0
+    return Rotation.from_rotvec(rotvecs).as_matrix(), translations
+
+def _rotation_errors(rotations, expected):
+    return np.linalg.norm(Rotation.from_matrix(np.swapaxes(rotations, 1, 2) @ expected).as_rotvec(), axis=1)
+
+def _relative(rotations, translations, pairs):
+    # Transforms of the links (i, j): x_i = R x_j + t.
+    first, second = pairs[:, 0], pairs[:, 1]
+    relative_rotations = np.swapaxes(rotations[first], 1, 2) @ rotations[second]
+    relative_translations = np.einsum('lji,lj->li', rotations[first], translations[second] - translations[first])
+    return relative_rotations, relative_translations
+
+@pytest.fixture(scope='module')
+def drifting_frames():
+    rng = np.random.default_rng(0)
+    base = rng.uniform(-100, 100, (1000, 3))
+    rotations, translations = _drift(8, 2e-3, 0.5, seed=1)
+    # x_k = R_k^T (x_0 - t_k), plus measurement noise.
+    frames = [(base - translations[k]) @ rotations[k] + rng.normal(0, 0.05, base.shape) for k in range(len(rotations))]
+    return frames, rotations, translations
+
+def test_chain_poses_inverts_the_links():
+    rotations, translations = _drift(20, 1e-2, 1.0, seed=2)
+    pairs = np.column_stack((np.arange(19), np.arange(1, 20)))
+    chained = chain_poses(*_relative(rotations, translations, pairs))
+    np.testing.assert_allclose(chained[0], rotations, atol=1e-12)
+    np.testing.assert_allclose(chained[1], translations, atol=1e-9)
+
+@pytest.mark.parametrize('optimize', [False, True])
+def test_register_frames_recovers_drift(drifting_frames, optimize):
+    frames, rotations, translations = drifting_frames
+    closures = [(0, len(frames) - 1)] if optimize else ()
+    registration = register_frames(frames, closures=closures, optimize=optimize, workers=1)
+    assert len(registration.links) == len(frames) - 1 + len(closures)
+    assert np.linalg.norm(registration.translations - translations, axis=1).max() < 0.02
+    assert _rotation_errors(registration.rotations, rotations).max() < 1e-4
+
+def test_register_frames_in_worker_processes(drifting_frames):
+    frames, _, _ = drifting_frames
+    serial = register_frames(frames, workers=1)
+    parallel = register_frames(frames, workers=2, chunksize=2)
+    np.testing.assert_allclose(parallel.rotations, serial.rotations, atol=1e-12)
+    np.testing.assert_allclose(parallel.translations, serial.translations, atol=1e-9)
+
+def test_optimize_pose_graph_spreads_loop_closure_error():
+    n_frames = 200
+    rotations, translations = _drift(n_frames, 1e-2, 1.0, seed=3)
+    pairs = np.array([(k, k + 1) for k in range(n_frames - 1)] + [(0, n_frames - 1), (0, n_frames // 2)])
+    relative_rotations, relative_translations = _relative(rotations, translations, pairs)
+
+    # Biased consecutive links drift when chained; the exact loop closures pull the poses back.
+    biased = slice(0, n_frames - 1)
+    relative_translations[biased] += 0.05
+    relative_rotations[biased] = relative_rotations[biased] @ Rotation.from_rotvec([1e-4, 0, 0]).as_matrix()
+    chained = chain_poses(relative_rotations[biased], relative_translations[biased])
+    weights = np.ones(len(pairs))
+    weights[n_frames - 1:] = 100.0
+
+    optimized = optimize_pose_graph(*chained, pairs, relative_rotations, relative_translations, weights, scale=100.0)
+    chained_error = np.linalg.norm(chained[1] - translations, axis=1).max()
+    optimized_error = np.linalg.norm(optimized[1] - translations, axis=1).max()
+    assert chained_error > 10
+    assert optimized_error < chained_error / 20
+    np.testing.assert_array_equal(optimized[0][0], rotations[0])
+
+@pytest.mark.parametrize('world', [None, ([0.3, -1.2, 0.8], [50.0, -20.0, 10.0])])
+def test_optimize_pose_graph_keeps_consistent_poses(world):
+    rotations, translations = _drift(30, 1e-2, 1.0, seed=4)
+    if world is not None:
+        # The same poses in a world frame where frame 0 isn't at the identity; the links don't change.
+        rotation = Rotation.from_rotvec(world[0]).as_matrix()
+        rotations, translations = rotation @ rotations, translations @ rotation.T + world[1]
+    pairs = np.array([(k, k + 1) for k in range(29)] + [(0, 29), (5, 20)])
+    optimized = optimize_pose_graph(rotations, translations, pairs, *_relative(rotations, translations, pairs))
+    assert _rotation_errors(optimized[0], rotations).max() < 1e-9
+    np.testing.assert_allclose(optimized[1], translations, atol=1e-7)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from cloud import predict_expected_positions
+from ellipse import MU_EARTH
+from sample import generate_catalog, generate_images
+from track import TrackStore
+
+TIMESTAMPS = np.arange(200) * 60.0
+
+WINDOW = 4
+
+def _track(chunk, **kwargs):
+    store = TrackStore(window=WINDOW, tolerance=50.0, **kwargs)
+    for _ in store.stream(generate_images(chunk)):
+        pass
+    # Object of every detection, in the order the images list their points.
+    observed = ~np.isnan(chunk.positions[:, :, 0])
+    object_ids = np.concatenate([chunk.object_ids[observed[:, i]] for i in range(len(chunk.timestamps))])
+    track_ids, _ = store.detections()
+    return store, track_ids, object_ids
+
+@pytest.mark.parametrize('dropout', [0.0, 0.1, 0.2])
+def test_tracks_survive_dropouts(dropout):
+    chunk = next(generate_catalog(20, TIMESTAMPS, dropout=dropout, noise=0.01, seed=0, velocities=True))
+    store, track_ids, object_ids = _track(chunk)
+
+    # One pure track per object, restarted only after the object dropped out of the whole window.
+    restarts = 0
+    for observed in ~np.isnan(chunk.positions[:, :, 0]):
+        seen = np.flatnonzero(observed)
+        restarts += np.count_nonzero(np.diff(seen) > WINDOW)
+    assert store.next_track_id == len(chunk.object_ids) + restarts
+    for track_id in np.unique(track_ids):
+        assert len(np.unique(object_ids[track_ids == track_id])) == 1
+
+def test_constant_speed_tracks_fragment_on_dropouts():
+    chunk = next(generate_catalog(20, TIMESTAMPS, dropout=0.1, noise=0.01, seed=0, velocities=True))
+    store, _, _ = _track(chunk, mu=0.0)
+    assert store.next_track_id > 100
+
+def test_two_body_prediction():
+    chunk = next(generate_catalog(50, TIMESTAMPS[:6], seed=1, velocities=True))
+    positions, velocities = chunk.positions[:, 0], chunk.velocities[:, 0]
+    speeds = np.linalg.norm(velocities, axis=1)
+    for frames in range(1, 6):
+        delta_t = TIMESTAMPS[frames]
+        predicted = predict_expected_positions(positions, speeds, velocities / speeds[:, np.newaxis], delta_t, MU_EARTH)
+        assert np.linalg.norm(predicted - chunk.positions[:, frames], axis=1).max() < 10.0